@@ -1,4 +1,7 @@
 import dash
+from dash.long_callback import DiskcacheLongCallbackManager
+import diskcache
+import flask
 from dash import dcc
 from dash import html
 from dash.dependencies import Input, Output, State
@@ -7,23 +10,37 @@ from dash import dash_table
 
 import pandas as pd
 import plotly.graph_objects as go
-import plotly.express as px
 import warnings
 #import sys
 import re
-import csv
+import os
+from functools import lru_cache
+import tempfile
+import textwrap
 #import math
-import random
 #import timeit
 
 #import urllib
 import numpy as np
-import statsmodels.api as sm
 #from scipy import stats
-from sklearn.preprocessing import PolynomialFeatures
-from statsmodels.stats.outliers_influence import summary_table
 
-px.set_mapbox_access_token('pk.eyJ1Ijoia2xvY2V5IiwiYSI6ImNrYm9uaWhoYjI0ZDcycW56ZWExODRmYzcifQ.Mb27BYst186G4r5fjju6Pw')
+import provider_store
+import report_index
+import report_merge
+import schema_manifest
+import session_cache
+import app_data
+import frame_codec
+import report_export
+import export_jobs
+import transforms
+import regression
+import result_cache
+import plot_traces
+import percentile_bands
+import feature_distributions
+import peer_sketches
+import expressions
 
 #########################################################################################
 ################################# CONFIG APP ############################################
@@ -34,10 +51,26 @@ FONT_AWESOME = "https://use.fontawesome.com/releases/v5.10.2/css/all.css"
 warnings.filterwarnings('ignore')
 pd.set_option('display.max_columns', None)
 
+# Loaded reports and other cached data are kept under this directory
+CACHE_DIR = os.environ.get('HCRIS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'hcris-app'))
+
+# Report loads and regressions run as long callbacks, in background processes
+# that the request timeout does not apply to. Regressions are cached on disk
+# by their inputs and the data version, so repeated queries return at once
+long_callback_manager = DiskcacheLongCallbackManager(diskcache.Cache(os.path.join(CACHE_DIR, 'long_callbacks')),
+                                                     cache_by=[lambda: long_callback_version()],
+                                                     expire=float(os.environ.get('HCRIS_CACHE_TTL', 6 * 3600)),
+                                                     )
+
+# Report loads are not cached by their inputs: a load that failed for some
+# providers must be retried on the next click, not replayed from the cache.
+# Providers already read come from the per-provider frame cache instead
+load_callback_manager = DiskcacheLongCallbackManager(diskcache.Cache(os.path.join(CACHE_DIR, 'long_callbacks')))
+
 external_stylesheets=[dbc.themes.BOOTSTRAP, FONT_AWESOME, 'https://codepen.io/chriddyp/pen/bWLwgP.css']
 app = dash.Dash(__name__, 
                 external_stylesheets = external_stylesheets,
-                #long_callback_manager = long_callback_manager,
+                long_callback_manager = long_callback_manager,
                 )
 
 app.config.suppress_callback_exceptions = True
@@ -45,79 +78,280 @@ server = app.server
 
 ################################# LOAD DATA ##################################
 
-gendat_df = pd.read_pickle('dataframe_data/GenDat4App_p4.pkl')
-gendat_df[('S2_1_C2_2', 'Hospital State', '', 'Hospital State (S2_1_C2_2)')] = gendat_df[('S2_1_C2_2', 'Hospital State', '', 'Hospital State (S2_1_C2_2)')].replace(np.nan, 'Not given')
-gendat_df[('Hospital type (modified)', 'Hospital type (modified)', 'Hospital type (modified)', 'Hospital type (modified)')] = gendat_df[('Hospital type (modified)', 'Hospital type (modified)', 'Hospital type (modified)', 'Hospital type (modified)')].replace(np.nan, 'Not given')
-gendat_df[('S2_1_C1_21', 'Type of Control of Hospital (See Table I)', '', 'Type of Control of Hospital (See Table I) (S2_1_C1_21)')] = gendat_df[(('S2_1_C1_21', 'Type of Control of Hospital (See Table I)', '', 'Type of Control of Hospital (See Table I) (S2_1_C1_21)'))].replace(np.nan, 'Not given')
+# General hospital data, the crosswalk and the report categories are loaded on 
+# first use (see app_data.py)
 
+ddfs = "100%"
 
-crosswalk_df = pd.read_csv('dataframe_data/2552-10 SAS FILE RECORD LAYOUT AND CROSSWALK TO 96 - 2021.csv')
-crosswalk_df.drop(labels=['WORKSHEET', 'DATA_TYPE', '96_FIELD_NAME', 'WKSHT CD', 'LINE', 'COLUMN'], axis=1, inplace=True)
 
-crosswalk_df.rename(columns={"TYPE": "Category",
-                             "SUBTYPE": 'Sub-category',
-                             "10_FIELD_NAME": 'Feature code',
-                             "FIELD DESCRIPTION ": "Feature description",
-                             },
-                    inplace=True,
-                    )
+# Provider reports are read from a local Parquet store when one is present
+# (see provider_store.py), otherwise from the HCRIS-databuilder repository.
+PROVIDER_STORE = provider_store.default_store(timeout=float(os.environ.get('HCRIS_FETCH_TIMEOUT', 20)))
+
+# Number of provider files read at once, and retries for each failed read
+FETCH_WORKERS = provider_store.default_workers()
+FETCH_RETRIES = int(os.environ.get('HCRIS_FETCH_RETRIES', 2))
+
+# Loaded reports stay on the server; df_tab1 only holds a key to them
+SESSION_CACHE = session_cache.SessionCache(os.path.join(CACHE_DIR, 'sessions'),
+                                           max_bytes=int(os.environ.get('HCRIS_CACHE_MB', 512)) * 2**20,
+                                           max_spill_bytes=int(os.environ.get('HCRIS_SPILL_MB', 4096)) * 2**20,
+                                           ttl=float(os.environ.get('HCRIS_CACHE_TTL', 6 * 3600)),
+                                           codec=frame_codec.get_codec(os.environ.get('HCRIS_FRAME_CODEC', 'arrow')),
+                                           )
+
+# Reports of each provider are cached separately, so changing a selection only
+# reads the providers that were added (see report_merge.py)
+PROVIDER_CACHE = session_cache.SessionCache(os.path.join(CACHE_DIR, 'providers'),
+                                            max_bytes=int(os.environ.get('HCRIS_PROVIDER_CACHE_MB', 512)) * 2**20,
+                                            max_spill_bytes=int(os.environ.get('HCRIS_SPILL_MB', 4096)) * 2**20,
+                                            ttl=float(os.environ.get('HCRIS_CACHE_TTL', 6 * 3600)),
+                                            codec=frame_codec.get_codec(os.environ.get('HCRIS_FRAME_CODEC', 'arrow')),
+                                            )
+# Column lookups by (category, feature) for each loaded frame, and bitsets of 
+# the features that hold data for each provider (see report_index.py)
+INDEX_CACHE = report_index.IndexCache()
+FEATURE_BITS = report_index.FeatureBits()
+
+ASSEMBLER = report_merge.ReportAssembler(PROVIDER_STORE, PROVIDER_CACHE,
+                                         data_version=os.environ.get('HCRIS_DATA_VERSION', ''),
+                                         max_workers=FETCH_WORKERS,
+                                         retries=FETCH_RETRIES,
+                                         features=FEATURE_BITS,
+                                         )
+
+# Bulk exports of every hospital matching the filters run as background jobs,
+# whose status and bundles are shared by all workers (see export_jobs.py)
+EXPORT_JOBS = export_jobs.ExportJobs(PROVIDER_STORE, os.path.join(CACHE_DIR, 'exports'),
+                                     max_workers=FETCH_WORKERS,
+                                     retries=FETCH_RETRIES,
+                                     max_jobs=int(os.environ.get('HCRIS_EXPORT_JOBS', 2)),
+                                     ttl=float(os.environ.get('HCRIS_EXPORT_TTL', 24 * 3600)),
+                                     stall_timeout=float(os.environ.get('HCRIS_EXPORT_STALL', 3600)),
+                                     )
+
+# Figures of the plot panels, keyed by a fingerprint of the query and shared
+# with the other workers and the long callback processes (see result_cache.py)
+RESULT_CACHE = result_cache.ResultCache(max_bytes=int(os.environ.get('HCRIS_RESULT_CACHE_MB', 64)) * 2**20,
+                                        disk=diskcache.Cache(os.path.join(CACHE_DIR, 'results'),
+                                                             size_limit=int(os.environ.get('HCRIS_RESULT_SPILL_MB', 1024)) * 2**20),
+                                        ttl=float(os.environ.get('HCRIS_CACHE_TTL', 6 * 3600)),
+                                        )
+
+# Selections of more hospitals than this are drawn as packed WebGL traces (see plot_traces.py)
+WEBGL_HOSPITALS = int(os.environ.get('HCRIS_WEBGL_HOSPITALS', 100))
+
+# Hospitals drawn as lines next to the percentile bands of plots 1 and 3 (see percentile_bands.py)
+BAND_OUTLIERS = int(os.environ.get('HCRIS_BAND_OUTLIERS', 5))
+
+# Derived columns of the expressions of the rate panel (see expressions.py)
+DERIVED_CACHE = expressions.DerivedCache(max_bytes=int(os.environ.get('HCRIS_DERIVED_CACHE_MB', 64)) * 2**20)
+
+NAME_COL = ('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')
+PRVDR_COL = ('PRVDR_NUM', 'Hospital Provider Number', 'HOSPITAL IDENTIFICATION INFORMATION', 'Hospital Provider Number (PRVDR_NUM)')
+FFY_COL = ('Beginning FFY', 'Beginning FFY', 'Beginning FFY', 'Beginning FFY')
+URL_COL = ('data url', 'data url', 'data url', 'data url')
+LAT_COL = ('Lat', 'Lat', 'Lat', 'Lat')
+LON_COL = ('Lon', 'Lon', 'Lon', 'Lon')
+
+
+# The 4-level column schema of the provider files is read lazily from
+# dataframe_data/provider_schema.json (see schema_manifest.py)
+
+#print(len(schema_manifest.load_columns()), 'HCRIS features')
+#print(len(set(app_data.directory().prvdrs)), 'CMS numbers')
+#print(len(app_data.hospital_names()), 'hospitals')
+#print(len(app_data.report_categories()), 'report categories:')
+#for cat in app_data.report_categories():
+#    print(cat)
+#print('\n')
 
-######################## SELECTION LISTS #####################################
+    
 
-HOSPITALS = gendat_df[('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')].tolist()
-CMS_NUMS = len(gendat_df[('PRVDR_NUM', 'Hospital Provider Number', 'HOSPITAL IDENTIFICATION INFORMATION', 'Hospital Provider Number (PRVDR_NUM)')].unique()) 
-# 
-beds = gendat_df[('S3_1_C2_27', 'Total Facility', 'NUMBER OF BEDS', 'Total Facility (S3_1_C2_27)')].tolist()
+################# DASH APP CONTROL FUNCTIONS #################################
 
-states = gendat_df[('S2_1_C2_2', 'Hospital State', '', 'Hospital State (S2_1_C2_2)')].tolist()
-htypes = gendat_df[('Hospital type (modified)', 'Hospital type (modified)', 'Hospital type (modified)', 'Hospital type (modified)')].tolist()
-ctypes = gendat_df[('S2_1_C1_21', 'Type of Control of Hospital (See Table I)', '', 'Type of Control of Hospital (See Table I) (S2_1_C1_21)')].tolist()
+def long_callback_version():
+    """
+    :return: The version of the data that cached long callback results depend on.
+    """
+    return ASSEMBLER.data_version + ':' + str(schema_manifest.load_manifest()['version'])
 
-states = ['NaN' if x is np.nan else x for x in states]
-htypes = ['NaN' if x is np.nan else x for x in htypes]
-ctypes = ['NaN' if x is np.nan else x for x in ctypes]
 
-HOSPITALS, beds, states, htypes, ctypes = (list(t) for t in zip(*sorted(zip(HOSPITALS, beds, states, htypes, ctypes))))
-HOSPITALS_SET = sorted(list(set(HOSPITALS)))
+def load_session(data):
+    """
+    :return: The DataFrame of reports referenced by the df_tab1 store, or None.
+             Reports that have expired from the cache are read again.
+    """
+    if data is None:
+        return None
+    
+    df = SESSION_CACHE.get(data['key'])
+    if df is None:
+        df, key, prvdrs, failed = ASSEMBLER.assemble(data['providers'])
+        if df is None:
+            return None
+        SESSION_CACHE.set(data['key'], df)
+    
+    return df
 
-ddfs = "100%"
 
-with open('dataframe_data/report_categories.csv', newline='') as csvfile:
-    categories = csv.reader(csvfile, delimiter=',')
-    for row in categories:
-        report_categories = row
-report_categories.sort()
+def load_index(data):
+    """
+    :return: The ColumnIndex of the reports referenced by the df_tab1 store, or None.
+    """
+    if data is None:
+        return None
+    
+    index = INDEX_CACHE.get(data['key'])
+    if index is None:
+        df = load_session(data)
+        if df is None:
+            return None
+        bits = ASSEMBLER.feature_bits(data['providers'])
+        if bits is None:
+            # Bitsets of providers evicted from the frame cache are not on disk
+            bits = FEATURE_BITS.of_frame(df)
+        index = INDEX_CACHE.set(data['key'], report_index.ColumnIndex(df.columns, bits, FEATURE_BITS))
+    
+    return index
 
 
-url = 'https://raw.githubusercontent.com/klocey/HCRIS-databuilder/master/provider_data/052043.csv'
+def load_message(num_IDs, failed):
+    """
+    :return: Text reporting how many hospitals were loaded and which providers failed.
+    """
+    txt = "Loaded " + str(num_IDs) + " hospitals"
+    if len(failed) > 0:
+        txt = txt + ". Could not load reports for CMS numbers: " + ', '.join(failed)
+    return txt
 
-main_df = pd.read_csv(url, index_col=[0], header=[0,1,2,3])
-main_df = pd.DataFrame(columns = main_df.columns)
 
-#print(main_df.shape[1], 'HCRIS features')
-#print(CMS_NUMS, 'CMS numbers')
-#print(len(list(set(HOSPITALS))), 'hospitals')
-#print(len(report_categories), 'report categories:')
-#for cat in report_categories:
-#    print(cat)
-#print('\n')
+def obs_pred_rsquare(obs, pred):
+    r2 = 1 - sum((obs - pred) ** 2) / sum((obs - np.mean(obs)) ** 2)
+    return r2
+
+
+def summary_traces(df, values, focal_h, mode):
+    """
+    :return: The percentile band traces of the hospitals in df other than the
+             focal hospital, and the outliers and focal hospital to draw as lines.
+    """
+    names = df[NAME_COL].to_numpy()
+    years = df[FFY_COL].to_numpy()
+    values = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+    
+    others = names != focal_h
+    table = percentile_bands.percentile_table(years[others], values[others])
+    
+    n = BAND_OUTLIERS if mode == 'Percentile bands and outliers' else 0
+    hospitals = percentile_bands.outliers(names[others], years[others], values[others], table, n)
+    if focal_h in names:
+        hospitals.append(focal_h)
+        return percentile_bands.band_traces(table, name='other hospitals'), hospitals
+    
+    return percentile_bands.band_traces(table), hospitals
 
-random.seed(42)
 
-COLORS = []
-for h in HOSPITALS:
-    if 'RUSH UNIVERSITY' in h:
-        clr = '#167e04'
+def comparison_traces(df, column, focal_h, compare, filters):
+    """
+    :return: The percentile band traces of the nation, or of the focal
+             hospital's state or hospital type, from the precomputed feature
+             distributions, or of the peers matching the state, hospital type
+             and control type filters, from the peer sketches, and a title
+             giving the focal hospital's percentile rank in its latest year.
+             None if there is nothing to compare to.
+    """
+    distributions = app_data.distributions()
+    sketches = app_data.sketches()
+    
+    info = app_data.directory().hospital(focal_h)
+    if compare == peer_sketches.COMPARISON and sketches is not None:
+        # Sketches of the peer group are merged once for the bands and the rank
+        mask = sketches.cell_mask(*filters)
+        merged = sketches.merged(mask, column)
+        name = 'peers matching the filters'
+        table = sketches.percentile_table(mask, column, percentile_bands.PERCENTILES, merged)
+        percentile_rank = lambda year, value: sketches.percentile_rank(mask, column, year, value, merged)
+    elif distributions is not None and compare in feature_distributions.COMPARISONS[1:]:
+        if compare == 'Nation':
+            group, name = 'nation', 'hospitals in the nation'
+        elif compare == 'State' and info['state'] is not None:
+            group, name = 'state:' + info['state'], 'hospitals in ' + info['state']
+        elif compare == 'Hospital type' and info['htype'] is not None:
+            group, name = 'type:' + info['htype'], info['htype'] + ' hospitals'
+        else:
+            return None
+        table = distributions.percentile_table(group, column, percentile_bands.PERCENTILES)
+        percentile_rank = lambda year, value: distributions.percentile_rank(group, column, year, value)
     else:
-        clr = '#' + "%06x" % random.randint(0, 0xFFFFFF)
-    COLORS.append(clr)
+        return None
+    
+    if table is None:
+        return None
+    traces = percentile_bands.band_traces(table, color='#7f7f7f', name=name)
+    
+    # Percentile rank of the focal hospital in the latest year it reported
+    focal = df[df[NAME_COL] == focal_h]
+    values = pd.to_numeric(focal[column], errors='coerce').to_numpy(dtype=float)
+    years = pd.to_numeric(focal[FFY_COL], errors='coerce').to_numpy(dtype=float)
+    
+    # Reports without a Beginning FFY cannot be ranked
+    known = np.flatnonzero(np.isfinite(years))
+    title = None
+    for i in known[np.argsort(years[known])[::-1]]:
+        ranked = percentile_rank(int(years[i]), values[i])
+        if ranked is not None:
+            rank, count = ranked
+            title = (info['label'] + ': percentile rank ' + str(int(round(rank))) + ' among ' + 
+                     '{:,}'.format(count) + ' reports of ' + name + ' in ' + str(int(years[i])))
+            break
     
+    return traces, title
 
-################# DASH APP CONTROL FUNCTIONS #################################
 
-def obs_pred_rsquare(obs, pred):
-    r2 = 1 - sum((obs - pred) ** 2) / sum((obs - np.mean(obs)) ** 2)
-    return r2
+def distributions_version():
+    """
+    :return: The build time of the feature distributions, or '' if they have not been built.
+    """
+    distributions = app_data.distributions()
+    return distributions.version if distributions is not None else ''
+
+
+def derived_column(data, expression):
+    """
+    :return: The values of an Expression for every report referenced by the
+             df_tab1 store, cached by session key, data version and expression.
+    """
+    key = (data['key'], long_callback_version(), expression.text)
+    values = DERIVED_CACHE.get(key)
+    if values is None:
+        df = load_session(data)
+        index = load_index(data)
+        panel = expressions.Panel(df, index.codes, df[NAME_COL], df[FFY_COL])
+        values = DERIVED_CACHE.set(key, expression.evaluate(panel))
+    return values
+
+
+def message_figure(message):
+    """
+    :return: An empty figure of the rate panel, titled with a message.
+    """
+    fig = go.Figure(data=go.Scatter(x = [0], y = [0]))
+    fig.update_layout(title=dict(text=message, font=dict(size=14, color="rgb(38, 38, 38)")),
+                      showlegend=False,
+                      margin=dict(l=100, r=10, b=10, t=60),
+                      paper_bgcolor="#f0f0f0",
+                      plot_bgcolor="#f0f0f0",
+                      )
+    return fig
+
+
+def sketches_version():
+    """
+    :return: The build time of the peer sketches, or '' if they have not been built.
+    """
+    sketches = app_data.sketches()
+    return sketches.version if sketches is not None else ''
     
 
 
@@ -227,9 +461,9 @@ def generate_control_card1():
                                 html.P("Select hospital types",style={'font-size': 16,}),
                                 dcc.Dropdown(
                                     id="hospital_type1",
-                                    options=[{"label": i, "value": i} for i in sorted(list(set(htypes)))],
+                                    options=[{"label": i, "value": i} for i in app_data.distinct_values('htypes')],
                                     multi=True,
-                                    value=sorted(list(set(htypes))),
+                                    value=app_data.distinct_values('htypes'),
                                     style={
                                         'font-size': 16,
                                         },
@@ -270,9 +504,9 @@ def generate_control_card1():
                                 html.P("Select hospital ownership types",style={'font-size': 16,}),
                                 dcc.Dropdown(
                                     id="control_type1",
-                                    options=[{"label": i, "value": i} for i in sorted(list(set(ctypes)))],
+                                    options=[{"label": i, "value": i} for i in app_data.distinct_values('ctypes')],
                                     multi=True,
-                                    value=sorted(list(set(ctypes))),
+                                    value=app_data.distinct_values('ctypes'),
                                     style={
                                         'font-size': 16,
                                         },
@@ -314,9 +548,9 @@ def generate_control_card1():
                                        style={'font-size': 16,}),
                                 dcc.Dropdown(
                                     id="states-select1",
-                                    options=[{"label": i, "value": i} for i in sorted(list(set(states)))],
+                                    options=[{"label": i, "value": i} for i in app_data.distinct_values('states')],
                                     multi=True,
-                                    value=sorted(list(set(states))),
+                                    value=app_data.distinct_values('states'),
                                     style={
                                         'font-size': 16,
                                         }
@@ -353,11 +587,11 @@ def generate_control_card1():
                 ),
             dbc.Modal(
                 [dbc.ModalBody([
-                                html.P("This app returns data for the hospitals you choose and, because hospital names often change, loads data for any hospitals with CMS numbers matching those of the hospitals you selected. Note: If you are using the web-application, avoiding loading more than 90 hospitals at a time. Otherwise, the application may timeout.",
+                                html.P("This app returns data for the hospitals you choose and, because hospital names often change, loads data for any hospitals with CMS numbers matching those of the hospitals you selected. Note: If you are using the web-application, avoiding loading more than 90 hospitals at a time. Otherwise, the application may timeout. To download the reports of every hospital that matches your filters, use the bulk export below the download button.",
                                        style={'font-size': 16,}),
                                 dcc.Dropdown(
                                     id="hospital-select1",
-                                    options=[{"label": i, "value": i} for i in HOSPITALS_SET],
+                                    options=[{"label": i, "value": i} for i in app_data.hospital_names()],
                                     multi=True,
                                     value=None,
                                     optionHeight=50,
@@ -366,6 +600,34 @@ def generate_control_card1():
                                         }
                                 ),
                                 html.Br(), 
+                                html.P("Or select the hospitals most similar to one hospital in beds, discharges, revenue, operating expense, type and state, among those matching your filters.",
+                                       style={'font-size': 16,}),
+                                dcc.Dropdown(
+                                    id="peer-hospital1",
+                                    options=[{"label": i, "value": i} for i in app_data.hospital_names()],
+                                    value=None,
+                                    placeholder='Select a hospital to find its peers',
+                                    optionHeight=50,
+                                    style={
+                                        'width': '100%',
+                                        'font-size': 14,
+                                        }
+                                ),
+                                html.Div(
+                                    children=[
+                                        html.P("Number of peers", style={'font-size': 14, 'display': 'inline-block'}),
+                                        dcc.Input(id="peer-count1", type='number', value=10, min=1, max=100, step=1,
+                                                  style={'width': '10%', 'margin-left': '2%', 'font-size': 14}),
+                                        dbc.Button("Find peers", id="peer-btn1",
+                                                   style={"background-color": "#2a8cff",
+                                                          'width': '25%',
+                                                          'font-size': 12,
+                                                          'margin-left': '2%',
+                                                          }),
+                                        ],
+                                    style={'margin-top': '1%'},
+                                    ),
+                                html.P(id="peer-status1", style={'font-size': 14,}),
                                 ]),
                                 dbc.ModalFooter(
                                 dbc.Button("Save & Close", id="close-centered2", className="ml-auto",
@@ -405,12 +667,32 @@ def generate_control_card1():
                        id="btn1",
                        style={
                            "background-color": "#2a8cff",
-                           'width': '80%',
+                           'width': '60%',
                            'font-size': 12,
                            'display': 'inline-block',
                            'margin-left': '10%',
                            },
                 ),
+            dbc.Button("Cancel",
+                       id="cancel-btn1",
+                       disabled=True,
+                       style={
+                           'width': '18%',
+                           'font-size': 12,
+                           'display': 'inline-block',
+                           'margin-left': '2%',
+                           },
+                ),
+            dbc.Progress(id="load-progress",
+                         value=0,
+                         max=1,
+                         style={
+                             'width': '80%',
+                             'margin-left': '10%',
+                             'margin-top': '1%',
+                             'visibility': 'hidden',
+                             },
+                ),
             
             html.Br(),
             html.Br(),
@@ -435,17 +717,62 @@ def generate_control_card1():
                             },
                         ),
                     
-                    html.Button("Download reports", id="download-btn",
-                        style={'width': '80%',
-                            'margin-left': '10%',
-                            },
+                    # Posted to the /export route, which streams the file
+                    html.Form([
+                        dcc.Input(id="export-providers", type="hidden", name="providers", value=""),
+                        html.Select([
+                            html.Option("CSV", value="csv"),
+                            html.Option("Parquet", value="parquet"),
+                            html.Option("Excel", value="xlsx"),
+                            ],
+                            id="export-format",
+                            name="format",
+                            style={'width': '25%',
+                                'margin-left': '10%',
+                                },
+                            ),
+                        html.Button("Download reports", id="download-btn", type="submit",
+                            style={'width': '55%',
+                                },
+                            ),
+                        ],
+                        action=app.get_relative_path("/export"),
+                        method="POST",
                         ),
-                    dcc.Download(id="data-download"),
                     
                     html.Br(),
                     html.Br(),
                     ],
             ), 
+            
+            # Runs in the background; the interval polls its progress
+            html.Div([
+                dcc.Dropdown(
+                    id="bulk-export-format",
+                    options=[{"label": "CSV", "value": "csv"}, {"label": "Parquet", "value": "parquet"}],
+                    value="csv",
+                    clearable=False,
+                    style={'width': '25%',
+                           'font-size': 12,
+                           'display': 'inline-block',
+                           'vertical-align': 'middle',
+                           },
+                    ),
+                html.Button("Export all matching hospitals", id="bulk-export-btn",
+                    style={'width': '75%',
+                        },
+                    ),
+                html.Div(id="bulk-export-status", style={'fontSize': 14, 'textAlign': 'center'}),
+                html.A("Download bundle", id="bulk-export-link", href="",
+                       style={'display': 'none'},
+                       ),
+                dcc.Store(id="bulk-export-job"),
+                dcc.Interval(id="bulk-export-interval", interval=2000, disabled=True),
+                ],
+                style={'width': '80%',
+                       'margin-left': '10%',
+                       },
+                ),
         ],
     )
 
@@ -467,7 +794,7 @@ def generate_control_card3():
                 children=[
                     dcc.Dropdown(
                         id="categories-select2",
-                        options=[{"label": i, "value": i} for i in report_categories],
+                        options=app_data.category_options(),
                         value=None,
                         optionHeight=65,
                         style={
@@ -490,7 +817,7 @@ def generate_control_card3():
                 children=[
                     dcc.Dropdown(
                         id="categories-select22",
-                        options=[{"label": i, "value": i} for i in report_categories],
+                        options=app_data.category_options(),
                         value=None,
                         optionHeight=65,
                         style={
@@ -513,7 +840,7 @@ def generate_control_card3():
                 children=[
                     dcc.Dropdown(
                             id='x_transform',
-                            options=[{"label": i, "value": i} for i in ['linear', 'log10', 'square root']],
+                            options=[{"label": i, "value": i} for i in transforms.OPTIONS],
                             multi=False, value='linear',
                             style={'width': '100%', 
                                     'font-size': 13,
@@ -537,7 +864,7 @@ def generate_control_card3():
                 children=[
                     dcc.Dropdown(
                         id="categories-select2-2",
-                        options=[{"label": i, "value": i} for i in report_categories],
+                        options=app_data.category_options(),
                         value=None,
                         optionHeight=65,
                         style={
@@ -560,7 +887,7 @@ def generate_control_card3():
                 children=[
                     dcc.Dropdown(
                         id="categories-select22-2",
-                        options=[{"label": i, "value": i} for i in report_categories],
+                        options=app_data.category_options(),
                         value=None,
                         optionHeight=65,
                         style={
@@ -583,7 +910,7 @@ def generate_control_card3():
                 children=[
                     dcc.Dropdown(
                             id='y_transform',
-                            options=[{"label": i, "value": i} for i in ['linear', 'log10', 'square root']],
+                            options=[{"label": i, "value": i} for i in transforms.OPTIONS],
                             multi=False, value='linear',
                             style={'width': '100%', 
                                     'font-size': 13,
@@ -727,7 +1054,7 @@ def generate_control_card5():
                 children=[
                 dcc.Dropdown(
                     id="categories-select3",
-                    options=[{"label": i, "value": i} for i in report_categories],
+                    options=app_data.category_options(),
                     value=None,
                     placeholder='Select a category',
                     optionHeight=65,
@@ -751,7 +1078,7 @@ def generate_control_card5():
                 children=[
                     dcc.Dropdown(
                         id="categories-select33",
-                        options=[{"label": i, "value": i} for i in report_categories],
+                        options=app_data.category_options(),
                         value=None,
                         placeholder='Select a feature',
                         optionHeight=65,
@@ -778,7 +1105,7 @@ def generate_control_card5():
                 children=[
                     dcc.Dropdown(
                         id="categories-select3-2",
-                        options=[{"label": i, "value": i} for i in report_categories],
+                        options=app_data.category_options(),
                         value=None,
                         optionHeight=65,
                         placeholder='Select a category',
@@ -802,7 +1129,7 @@ def generate_control_card5():
                 children=[
                     dcc.Dropdown(
                         id="categories-select33-2",
-                        options=[{"label": i, "value": i} for i in report_categories],
+                        options=app_data.category_options(),
                         value=None,
                         optionHeight=65,
                         placeholder='Select a feature',
@@ -821,6 +1148,33 @@ def generate_control_card5():
                     'margin-left': '1%',
                     },
                 ),
+            
+            html.P("Or write an expression of feature codes, such as (S3_1_C2_27 + S3_1_C2_28) / G3_C1_3 * 1000. " + 
+                   "Use sum(a, b) to add features counting missing values as zero, and lag(a, 1) for a feature " + 
+                   "one year earlier. An expression replaces the numerator and denominator."),
+            
+            html.Div(
+                children=[
+                    dcc.Input(
+                        id="expression3",
+                        type='text',
+                        value='',
+                        placeholder='Expression of feature codes (optional)',
+                        style={
+                            'width': '100%', 
+                            'font-size': 13,
+                            'display': 'inline-block',
+                            'border-radius': '15px',
+                            'padding': '5px',
+                            },
+                        ),
+                    ],
+                style={
+                    'width': '81%', 
+                    'display': 'inline-block',
+                    'margin-left': '1%',
+                    },
+                ),
             ],
         )
 
@@ -830,318 +1184,429 @@ def generate_control_card5():
 #########################################################################################    
 
 
-app.layout = html.Div([
+@lru_cache(maxsize=None)
+def serve_layout():
+    """
+    :return: The app layout, built on the first page load rather than at import.
+    """
+    return html.Div([
     
-    dcc.Store(id='df_tab1', storage_type='memory'),
+        dcc.Store(id='df_tab1', storage_type='memory'),
     
-    html.Div(
-        id='url_ls',
-        style={'display': 'none'}
-        ),
+        html.Div(
+            id='prvdr_ls',
+            style={'display': 'none'}
+            ),
     
-    # Banner
-    html.Div(
-            style={'background-color': '#f9f9f9'},
-            id="banner1",
-            className="banner",
-            children=[html.Img(src=app.get_asset_url("RUSH_full_color.jpg"), 
-                               style={'textAlign': 'left'}),
-                      html.Img(src=app.get_asset_url("plotly_logo.png"), 
-                               style={'textAlign': 'right'})],
+        # Banner
+        html.Div(
+                style={'background-color': '#f9f9f9'},
+                id="banner1",
+                className="banner",
+                children=[html.Img(src=app.get_asset_url("RUSH_full_color.jpg"), 
+                                   style={'textAlign': 'left'}),
+                          html.Img(src=app.get_asset_url("plotly_logo.png"), 
+                                   style={'textAlign': 'right'})],
 
-        ),
+            ),
         
-    # Left column
-    html.Div(
-            id="left-column1",
-            className="three columns",
-            children=[description_card1(), 
-                      generate_control_card1(),
+        # Left column
+        html.Div(
+                id="left-column1",
+                className="three columns",
+                children=[description_card1(), 
+                          generate_control_card1(),
                       
-                      html.Button("Search the crosswalk",
-                                         id="open-centered5",
-                                         style={
-                                             #"background-color": "#2a8cff",
-                                             'width': '80%',
-                                             'margin-left': '10%',
-                                             'font-size': 12,
-                                             'display': 'inline-block',
-                                             },
-                                  ),
-                      dbc.Modal(
-                                  [dbc.ModalBody([
-                                                  html.P("This table can be sorted and filtered using any column or combination of columns. Just click the arrows or start typing in a filter cell. Click on the pink 'AA' to select whether you prefer case sensitive filtering. ",
-                                                         style={'font-size': 16,
+                          html.Button("Search the crosswalk",
+                                             id="open-centered5",
+                                             style={
+                                                 #"background-color": "#2a8cff",
+                                                 'width': '80%',
+                                                 'margin-left': '10%',
+                                                 'font-size': 12,
+                                                 'display': 'inline-block',
+                                                 },
+                                      ),
+                          dbc.Modal(
+                                      [dbc.ModalBody([
+                                                      html.P("This table can be sorted and filtered using any column or combination of columns. Just click the arrows or start typing in a filter cell and press Enter. Click on the pink 'AA' to select whether you prefer case sensitive filtering. ",
+                                                             style={'font-size': 16,
+                                                                    },
+                                                             ),
+                                                      dash_table.DataTable(
+                                                          id='crosswalk_table',
+                                                          columns = [{'id': c, 'name': c} for c in app_data.crosswalk().columns],
+                                                      
+                                                          page_action='custom',
+                                                          page_current=0,
+                                                          page_size=100,
+                                                          sort_action="custom",
+                                                          sort_mode="multi",
+                                                          sort_by=[],
+                                                          filter_action="custom",
+                                                          filter_query='',
+                                                      
+                                                          style_table={'overflowY': 'auto',
+                                                                       'horizontalAligment':'center',
+                                                                       },
+                                                          ),
+                                                      html.Br(), 
+                                                      html.Button("Download table", id="crosswalk-download-btn",
+                                                                  style={'font-size': 12,
+                                                                         },
+                                                                  ),
+                                                      dcc.Download(id="crosswalk-download"),
+                                                      ],
+                                          ),
+                                          dbc.ModalFooter(
+                                              dbc.Button("Close", id="close-centered5", 
+                                                         className="ml-auto", 
+                                                         style={'font-size': 13,
+                                                                'width': '30%',
                                                                 },
                                                          ),
-                                                  html.Div(id='crosswalk_table'),
-                                                  html.Br(), 
-                                                  ],
+                                          style={
+                                              "background-color": "#A0A0A0",
+                                              "display": "flex",
+                                              "justify-content": "center",
+                                              "align-items": "center",
+                                              },
+                                          ),
+                                          ],
+                                      id="modal-centered5",
+                                      is_open=False,
+                                      centered=True,
+                                      autoFocus=True,
+                                      #size="xl",
+                                      fullscreen=True,
+                                      keyboard=True,
+                                      fade=True,
+                                      backdrop=True,
                                       ),
-                                      dbc.ModalFooter(
-                                          dbc.Button("Close", id="close-centered5", 
-                                                     className="ml-auto", 
-                                                     style={'font-size': 13,
-                                                            'width': '30%',
-                                                            },
-                                                     ),
-                                      style={
-                                          "background-color": "#A0A0A0",
-                                          "display": "flex",
-                                          "justify-content": "center",
-                                          "align-items": "center",
-                                          },
-                                      ),
-                                      ],
-                                  id="modal-centered5",
-                                  is_open=False,
-                                  centered=True,
-                                  autoFocus=True,
-                                  #size="xl",
-                                  fullscreen=True,
-                                  keyboard=True,
-                                  fade=True,
-                                  backdrop=True,
-                                  ),
                       
-                      ],
-            style={'width': '24%', 'display': 'inline-block',
-                                 'border-radius': '15px',
-                                 'box-shadow': '1px 1px 1px grey',
-                                 'background-color': '#f0f0f0',
-                                 'padding': '10px',
-            },
-        ),
+                          ],
+                style={'width': '24%', 'display': 'inline-block',
+                                     'border-radius': '15px',
+                                     'box-shadow': '1px 1px 1px grey',
+                                     'background-color': '#f0f0f0',
+                                     'padding': '10px',
+                },
+            ),
     
     
     
-    # Right column 1
-    html.Div(
-            id="right-column1",
-            className="eight columns",
-            children=[
+        # Right column 1
+        html.Div(
+                id="right-column1",
+                className="eight columns",
+                children=[
                 
-                html.Div(
-                    id="map1",
-                    children=[
-                        html.B("Map of selected hospitals"),
+                    html.Div(
+                        id="map1",
+                        children=[
+                            html.B("Map of selected hospitals"),
                         
-                        dcc.Loading(
-                            id="loading-map1",
-                            type="default",
-                            fullscreen=False,
-                            children=[dcc.Graph(id="map_plot1"),],),
-                    ],
-                    style={'width': '107%',
-                                 'border-radius': '15px',
-                                 'box-shadow': '1px 1px 1px grey',
-                                 'background-color': '#f0f0f0',
-                                 'padding': '10px',
-                                 'margin-bottom': '1%',
-                            },
-                ),
+                            dcc.Loading(
+                                id="loading-map1",
+                                type="default",
+                                fullscreen=False,
+                                children=[dcc.Graph(id="map_plot1"),],),
+                        ],
+                        style={'width': '107%',
+                                     'border-radius': '15px',
+                                     'box-shadow': '1px 1px 1px grey',
+                                     'background-color': '#f0f0f0',
+                                     'padding': '10px',
+                                     'margin-bottom': '1%',
+                                },
+                    ),
                 
                 
-                html.Div(
-                    id="cost_report1",
-                    children=[
-                        html.H5("Examine Cost Report Features Across Fiscal Years"),
+                    html.Div(
+                        id="cost_report1",
+                        children=[
+                            html.H5("Examine Cost Report Features Across Fiscal Years"),
                         
-                        html.Div(
-                            children=[
-                                dcc.Dropdown(
-                                    id="categories-select1",
-                                    options=[{"label": i, "value": i} for i in report_categories],
-                                    value=None,
-                                    placeholder='Select a category',
-                                    optionHeight=75,
-                                    style={
-                                        'width': '100%', 
-                                        'font-size': 13,
-                                        'display': 'inline-block',
-                                        'border-radius': '15px',
-                                        'padding': '0px',
-                                        },
-                                    ),
-                                ],
-                            style={
-                                'width': '45%', 
-                                'display': 'inline-block',
-                                },
-                            ),
+                            html.Div(
+                                children=[
+                                    dcc.Dropdown(
+                                        id="categories-select1",
+                                        options=app_data.category_options(),
+                                        value=None,
+                                        placeholder='Select a category',
+                                        optionHeight=75,
+                                        style={
+                                            'width': '100%', 
+                                            'font-size': 13,
+                                            'display': 'inline-block',
+                                            'border-radius': '15px',
+                                            'padding': '0px',
+                                            },
+                                        ),
+                                    ],
+                                style={
+                                    'width': '45%', 
+                                    'display': 'inline-block',
+                                    },
+                                ),
                         
-                        html.Div(
-                            children=[
-                                dcc.Dropdown(
-                                    id="categories-select11",
-                                    options=[{"label": i, "value": i} for i in report_categories],
-                                    value=None,
-                                    placeholder='Select a feature',
-                                    optionHeight=75,
-                                    style={
-                                        'width': '100%', 
-                                        'font-size': 13,
-                                        'display': 'inline-block',
-                                        'border-radius': '15px',
-                                        'padding': '0px',
-                                        },
-                                    ),
-                                ],
-                            style={
-                                'width': '45%', 
-                                'display': 'inline-block',
-                                'margin-left': '1%',
-                                },
-                            ),
+                            html.Div(
+                                children=[
+                                    dcc.Dropdown(
+                                        id="categories-select11",
+                                        options=app_data.category_options(),
+                                        value=None,
+                                        placeholder='Select a feature',
+                                        optionHeight=75,
+                                        style={
+                                            'width': '100%', 
+                                            'font-size': 13,
+                                            'display': 'inline-block',
+                                            'border-radius': '15px',
+                                            'padding': '0px',
+                                            },
+                                        ),
+                                    ],
+                                style={
+                                    'width': '45%', 
+                                    'display': 'inline-block',
+                                    'margin-left': '1%',
+                                    },
+                                ),
                             
-                        html.Div(
-                            children=[  
-                                dcc.Dropdown(
-                                    id='hospital-select1b',
-                                    options=[{"label": i, "value": i} for i in []],
-                                    value=None,
-                                    placeholder='Select a focal hospital (optional)',
-                                    optionHeight=75,
-                                    style={
-                                        'width': '100%', 
-                                        'font-size': 13,
-                                        'display': 'inline-block',
-                                        'border-radius': '15px',
-                                        'padding': '0px',
-                                        },
-                                    ),
-                                ],
-                            style={
-                                'width': '45%', 
-                                'display': 'inline-block',
-                                },
-                            ),
+                            html.Div(
+                                children=[  
+                                    dcc.Dropdown(
+                                        id='hospital-select1b',
+                                        options=[{"label": i, "value": i} for i in []],
+                                        value=None,
+                                        placeholder='Select a focal hospital (optional)',
+                                        optionHeight=75,
+                                        style={
+                                            'width': '100%', 
+                                            'font-size': 13,
+                                            'display': 'inline-block',
+                                            'border-radius': '15px',
+                                            'padding': '0px',
+                                            },
+                                        ),
+                                    ],
+                                style={
+                                    'width': '30%', 
+                                    'display': 'inline-block',
+                                    },
+                                ),
                                 
-                        html.Div(
-                            children=[
-                                dbc.Button("Run", id="run-btn1",
-                                    style={'width': '100%', 
-                                           'font-size': 13,
-                                           'background-color': '#2a8cff',
-                                           'display': 'inline-block',
-                                           'border-radius': '15px',
-                                           'padding': '0px',
-                                        },
-                                    ),
-                                ],
-                            style={
-                                'width': '20%', 
-                                'display': 'inline-block',
-                                'margin-left': '1%',
-                                'verticalAlign':'top',
-                                },
-                            ),
+                            html.Div(
+                                children=[
+                                    dcc.Dropdown(
+                                        id='plot1-mode',
+                                        options=[{"label": i, "value": i} for i in percentile_bands.MODES],
+                                        value='All hospitals',
+                                        clearable=False,
+                                        optionHeight=50,
+                                        style={
+                                            'width': '100%', 
+                                            'font-size': 13,
+                                            'display': 'inline-block',
+                                            'border-radius': '15px',
+                                            'padding': '0px',
+                                            },
+                                        ),
+                                    ],
+                                style={
+                                    'width': '25%', 
+                                    'display': 'inline-block',
+                                    'margin-left': '1%',
+                                    },
+                                ),
+                                
+                            html.Div(
+                                children=[
+                                    dcc.Dropdown(
+                                        id='compare-select1',
+                                        options=[{"label": i, "value": i} for i in feature_distributions.COMPARISONS + [peer_sketches.COMPARISON]],
+                                        value='No comparison',
+                                        clearable=False,
+                                        optionHeight=50,
+                                        style={
+                                            'width': '100%', 
+                                            'font-size': 13,
+                                            'display': 'inline-block',
+                                            'border-radius': '15px',
+                                            'padding': '0px',
+                                            },
+                                        ),
+                                    ],
+                                style={
+                                    'width': '22%', 
+                                    'display': 'inline-block',
+                                    'margin-left': '1%',
+                                    },
+                                ),
+                                
+                            html.Div(
+                                children=[
+                                    dbc.Button("Run", id="run-btn1",
+                                        style={'width': '100%', 
+                                               'font-size': 13,
+                                               'background-color': '#2a8cff',
+                                               'display': 'inline-block',
+                                               'border-radius': '15px',
+                                               'padding': '0px',
+                                            },
+                                        ),
+                                    ],
+                                style={
+                                    'width': '15%', 
+                                    'display': 'inline-block',
+                                    'margin-left': '1%',
+                                    'verticalAlign':'top',
+                                    },
+                                ),
                         
-                        dcc.Graph(id="cost_report_plot1"),
-                    ],
-                    style={'width': '107%', 'display': 'inline-block',
-                                 'border-radius': '15px',
-                                 'box-shadow': '1px 1px 1px grey',
-                                 'background-color': '#f0f0f0',
-                                 'padding': '10px',
-                            },
-                ),
-                html.Br(),
-                html.Br(),
-            ],
-        ),
+                            dcc.Graph(id="cost_report_plot1"),
+                        ],
+                        style={'width': '107%', 'display': 'inline-block',
+                                     'border-radius': '15px',
+                                     'box-shadow': '1px 1px 1px grey',
+                                     'background-color': '#f0f0f0',
+                                     'padding': '10px',
+                                },
+                    ),
+                    html.Br(),
+                    html.Br(),
+                ],
+            ),
     
-    # Left column
-    html.Div(
-            id="left-column2",
-            className="eleven columns",
-            children=[
+        # Left column
+        html.Div(
+                id="left-column2",
+                className="eleven columns",
+                children=[
                 
-                html.Div(
-                    id="cost_report2",
-                    children=[
-                        generate_control_card3(),
-                        dcc.Graph(id="cost_report_plot2"),
-                        generate_control_card4(),
-                        ],
-                    style={
-                        'width': '105%',
-                        'display': 'inline-block',
-                        'border-radius': '15px',
-                        'box-shadow': '1px 1px 1px grey',
-                        'background-color': '#f0f0f0',
-                        'padding': '10px',
-                        'margin-bottom': '1%',
-                        },
-                ),
-                html.Br(),
+                    html.Div(
+                        id="cost_report2",
+                        children=[
+                            generate_control_card3(),
+                            dcc.Graph(id="cost_report_plot2"),
+                            generate_control_card4(),
+                            ],
+                        style={
+                            'width': '105%',
+                            'display': 'inline-block',
+                            'border-radius': '15px',
+                            'box-shadow': '1px 1px 1px grey',
+                            'background-color': '#f0f0f0',
+                            'padding': '10px',
+                            'margin-bottom': '1%',
+                            },
+                    ),
+                    html.Br(),
                 
                 
-                html.Div(
-                    id="cost_report3",
-                    children=[
-                        generate_control_card5(),
-                        dcc.Graph(id="cost_report_plot3"),
+                    html.Div(
+                        id="cost_report3",
+                        children=[
+                            generate_control_card5(),
+                            dcc.Graph(id="cost_report_plot3"),
                         
-                        html.Div(
-                            children=[
-                                dcc.Dropdown(
-                                    id='hospital-select1d',
-                                    options=[{"label": i, "value": i} for i in []],
-                                    value=None,
-                                    placeholder='Select a focal hospital (optional)',
-                                    optionHeight=75,
-                                    style={
-                                        'width': '100%', 
-                                        'font-size': 13,
-                                        'display': 'inline-block',
-                                        'border-radius': '15px',
-                                        'padding': '0px',
-                                        },
-                                    ),
-                                ],
-                            style={
-                                'width': '30%', 
-                                'display': 'inline-block',
-                                },
-                            ),
+                            html.Div(
+                                children=[
+                                    dcc.Dropdown(
+                                        id='hospital-select1d',
+                                        options=[{"label": i, "value": i} for i in []],
+                                        value=None,
+                                        placeholder='Select a focal hospital (optional)',
+                                        optionHeight=75,
+                                        style={
+                                            'width': '100%', 
+                                            'font-size': 13,
+                                            'display': 'inline-block',
+                                            'border-radius': '15px',
+                                            'padding': '0px',
+                                            },
+                                        ),
+                                    ],
+                                style={
+                                    'width': '30%', 
+                                    'display': 'inline-block',
+                                    },
+                                ),
                         
-                        html.Div(
-                            children=[
-                                dbc.Button("Run", id="run-btn3",
-                                    style={'width': '100%', 
-                                           'font-size': 13,
-                                           'background-color': '#2a8cff',
-                                           'display': 'inline-block',
-                                           'border-radius': '15px',
-                                           'padding': '0px',
-                                        },
-                                    ),
-                                ],
-                            style={
-                                'width': '15%', 
-                                'display': 'inline-block',
-                                'margin-left': '1%',
-                                'verticalAlign':'top',
-                                },
-                            ),
-                        ],
+                            html.Div(
+                                children=[
+                                    dcc.Dropdown(
+                                        id='plot3-mode',
+                                        options=[{"label": i, "value": i} for i in percentile_bands.MODES],
+                                        value='All hospitals',
+                                        clearable=False,
+                                        optionHeight=50,
+                                        style={
+                                            'width': '100%', 
+                                            'font-size': 13,
+                                            'display': 'inline-block',
+                                            'border-radius': '15px',
+                                            'padding': '0px',
+                                            },
+                                        ),
+                                    ],
+                                style={
+                                    'width': '30%', 
+                                    'display': 'inline-block',
+                                    'margin-left': '1%',
+                                    },
+                                ),
+                        
+                            html.Div(
+                                children=[
+                                    dbc.Button("Run", id="run-btn3",
+                                        style={'width': '100%', 
+                                               'font-size': 13,
+                                               'background-color': '#2a8cff',
+                                               'display': 'inline-block',
+                                               'border-radius': '15px',
+                                               'padding': '0px',
+                                            },
+                                        ),
+                                    ],
+                                style={
+                                    'width': '15%', 
+                                    'display': 'inline-block',
+                                    'margin-left': '1%',
+                                    'verticalAlign':'top',
+                                    },
+                                ),
+                            ],
                     
-                    style={
-                        'width': '105%',
-                        'display': 'inline-block',
-                        'border-radius': '15px',
-                        'box-shadow': '1px 1px 1px grey',
-                        'background-color': '#f0f0f0',
-                        'padding': '10px',
-                        'margin-bottom': '1%',
-                        },
+                        style={
+                            'width': '105%',
+                            'display': 'inline-block',
+                            'border-radius': '15px',
+                            'box-shadow': '1px 1px 1px grey',
+                            'background-color': '#f0f0f0',
+                            'padding': '10px',
+                            'margin-bottom': '1%',
+                            },
+                    ),
+                    ],
                 ),
-                ],
-            ),
 
-    ],
-)
+        ],
+    )
+
+
+app.layout = serve_layout
+
+
+def preload():
+    """
+    Load the data assets and build the layout, e.g. in the gunicorn master
+    before it forks its workers.
+    """
+    app_data.preload()
+    FEATURE_BITS.load()
+    serve_layout()
 
   
 ##############################   Callbacks   ############################################
@@ -1190,35 +1655,77 @@ def toggle_modal1(n1, n2, is_open):
     return is_open
 
 @app.callback(
-    [Output("modal-centered5", "is_open"),
-     Output("crosswalk_table", "children"),
-     ],
+    Output("modal-centered5", "is_open"),
     [Input("open-centered5", "n_clicks"), Input("close-centered5", "n_clicks")],
     [State("modal-centered5", "is_open")],
 )
 def toggle_modal5(n1, n2, is_open):
-    
-    dashT = dash_table.DataTable(
-        data = crosswalk_df.to_dict('records'),
-        columns = [{'id': c, 'name': c} for c in crosswalk_df.columns],
-        
-        export_format="csv",
-        page_action='native',
-        page_size=100,
-        sort_action="native",
-        sort_mode="multi",
-        filter_action="native",
-        
-        style_table={'overflowY': 'auto',
-                     'horizontalAligment':'center',
-                     },
-    )
-    
     if n1 or n2:
-        return not is_open, dashT
-    return is_open, dashT
+        return not is_open
+    return is_open
 
 
+@app.callback(
+    [Output("crosswalk_table", "data"),
+     Output("crosswalk_table", "page_count"),
+     ],
+    [Input("crosswalk_table", "page_current"),
+     Input("crosswalk_table", "page_size"),
+     Input("crosswalk_table", "sort_by"),
+     Input("crosswalk_table", "filter_query"),
+     ],
+)
+def update_crosswalk_table(page_current, page_size, sort_by, filter_query):
+    return app_data.crosswalk_table().page(page_current or 0, page_size, filter_query, sort_by)
+
+
+@app.callback(
+    Output("crosswalk-download", "data"),
+    Input("crosswalk-download-btn", "n_clicks"),
+    [State("crosswalk_table", "sort_by"),
+     State("crosswalk_table", "filter_query"),
+     ],
+    prevent_initial_call=True,
+)
+def download_crosswalk(n_clicks, sort_by, filter_query):
+    # The whole filtered and sorted table, not just the page on screen
+    table = app_data.crosswalk_table()
+    rows = table.query(filter_query, sort_by)
+    return dcc.send_data_frame(table.frame.iloc[rows].to_csv, "crosswalk.csv", index=False)
+
+
+
+@app.callback(
+    [Output("hospital-select1", "value"),
+     Output("peer-status1", "children")],
+    Input("peer-btn1", "n_clicks"),
+    [State("peer-hospital1", "value"),
+     State("peer-count1", "value"),
+     State("hospital-select1", "options"),
+     ],
+    prevent_initial_call=True,
+)
+def find_peers(n_clicks, focal_h, k, hospital_options):
+    # Nearest hospitals in the focal hospital's latest year (see peer_finder.py)
+    finder = app_data.peer_index()
+    if finder is None:
+        return dash.no_update, "Peer search is not available: run peer_finder.py to build it."
+    if focal_h is None:
+        return dash.no_update, "Select a hospital to find its peers."
+    
+    allowed = set(h['value'] for h in hospital_options or [])
+    found = finder.nearest(app_data.directory().hospital(focal_h)['prvdr'], int(k or 10), allowed)
+    if found is None:
+        return dash.no_update, "No reports of " + focal_h + " hold the features peers are found by."
+    
+    # The focal hospital is only kept when it matches the filters too
+    year, peers = found
+    txt = ("Selected the " + str(len(peers)) + " nearest peers of " + focal_h + " in FFY " + str(year) + 
+           ", among the hospitals matching your filters.")
+    if focal_h in allowed:
+        peers = [focal_h] + peers
+    return peers, txt
+
 
 @app.callback( # Updated number of beds text
     Output('Filterbeds1', 'children'),
@@ -1239,27 +1746,12 @@ def update_output1(value):
     )
 def update_output3(value, df):
     
-    df2 = main_df.iloc[:, (main_df.columns.get_level_values(2)==value)]
-    sub_cat = df2.columns.get_level_values(3).tolist()
-    del df2
-    
-    if df is not None:
-        
-        df = pd.read_json(df)
-        df.dropna(axis=1, how='all', inplace=True)
-        cols1 = list(df)
-        cols2 = []
-        for c in cols1:
-            s = c.split("', ")[-1]
-            s = s[1:-2]
-            cols2.append(s)
-            
-        sub_categories = []
-        for c in sub_cat:
-            if c in cols2:
-                sub_categories.append(c)
+    # Features with data for any loaded provider, shared by all dropdowns
+    index = load_index(df)
+    if index is not None:
+        sub_categories = index.category_features(value)
     else:
-        sub_categories = sub_cat
+        sub_categories = list(schema_manifest.category_features(value))
     
     return [{"label": i, "value": i} for i in sub_categories]
 
@@ -1289,30 +1781,11 @@ def update_output4(available_options):
     )
 def update_hospitals(bed_range, states_vals, htype_vals, ctype_vals):
     
-    low, high = bed_range
-    hospitals = []
-    for i, h in enumerate(HOSPITALS):
-        b = beds[i]
-        s = states[i]
-        ht = htypes[i]
-        ct = ctypes[i]
-        
-        if low == 1:
-            b = 1
-        
-        if b >= low and b <= high:
-            if s in states_vals:
-                if ct in ctype_vals:
-                    for htv in htype_vals:
-                        if htv in ht: 
-                            hospitals.append(h)
-            
-    hospitals = sorted(list(set(hospitals)))
-    return [{"label": i, "value": i} for i in hospitals]
+    return app_data.directory().filter(bed_range, states_vals, htype_vals, ctype_vals)
 
 
 @app.callback(
-    [Output('url_ls', "children"),
+    [Output('prvdr_ls', "children"),
      Output('hospital-select1b', 'options'),
      Output('hospital-select1c', 'options'),
      Output('hospital-select1d', 'options'),
@@ -1321,7 +1794,7 @@ def update_hospitals(bed_range, states_vals, htype_vals, ctype_vals):
     [State("hospital-select1", "value"),
      State("hospital-select1", "options"),],
     )
-def get_urls(btn1, hospitals, hospital_options):
+def get_prvdrs(btn1, hospitals, hospital_options):
     
     #start = timeit.default_timer()
     
@@ -1343,96 +1816,70 @@ def get_urls(btn1, hospitals, hospital_options):
         ls1 = [{"label": i, "value": i} for i in ['No focal hospital']]
         return None, ls1, ls1, ls1
     
-    url_ls = []
+    prvdr_ls = []
     for i, val in enumerate(hospitals):
         
         prvdr = re.sub('\ |\?|\.|\!|\/|\;|\:', '', val)
         prvdr = prvdr[prvdr.find("(")+1:prvdr.find(")")]
-        
-        url = 'https://raw.githubusercontent.com/klocey/HCRIS-databuilder/master/provider_data/' + prvdr + '.csv'
-        url_ls.append(url)
+        prvdr_ls.append(prvdr)
     
     #txt = ', ' + str(len(hospitals)) + ' selected'
     hospitals = ['No focal hospital'] + hospitals
     ls1 = [{"label": i, "value": i} for i in hospitals]
     
     #ex_time = timeit.default_timer() - start
-    #print("get_urls executed in "+str(ex_time))
+    #print("get_prvdrs executed in "+str(ex_time))
     
-    return url_ls, ls1, ls1, ls1
+    return prvdr_ls, ls1, ls1, ls1
     
 
-@app.callback(
+@app.long_callback(
     [Output('df_tab1', "data"),
      Output("text1", 'children'),],
     [
-     Input('url_ls', 'children'),
-     Input('df_tab1', "data"),
+     Input('prvdr_ls', 'children'),
      ],
+    [State('df_tab1', "data")],
+    running=[
+        (Output("btn1", "disabled"), True, False),
+        (Output("cancel-btn1", "disabled"), False, True),
+        (Output("load-progress", "style"), 
+         {'width': '80%', 'margin-left': '10%', 'margin-top': '1%', 'visibility': 'visible'},
+         {'width': '80%', 'margin-left': '10%', 'margin-top': '1%', 'visibility': 'hidden'}),
+        ],
+    cancel=[Input("cancel-btn1", "n_clicks")],
+    progress=[Output("load-progress", "value"),
+              Output("load-progress", "max"),
+              Output("load-progress", "label")],
+    progress_default=[0, 1, ""],
+    manager=load_callback_manager,
     )
-def update_df1_tab1(urls, df):
+def update_df1_tab1(set_progress, prvdrs, data):
     
     #start = timeit.default_timer()
     
-    if urls is None or urls is []:
+    if prvdrs is None or prvdrs == []:
         return None, ""
     
-    elif df is None:
-        
-        for i, url in enumerate(urls):
-            
-            tdf = pd.read_csv(url, header=[0,1,2,3], index_col=[0])
-            tdf[('data url', 'data url', 'data url', 'data url')] = [url] * tdf.shape[0]
-            
-            if i == 0:
-                df = tdf.copy(deep=True)
-            else:
-                df = pd.concat([df, tdf]) 
-        
-        df.dropna(axis=1, how='all', inplace=True)
-        df.reset_index(drop=True, inplace=True)
-                
-        #ex_time = timeit.default_timer() - start
-        #print("update_df1_tab1 executed in "+str(ex_time))
-        
-        #num_h = len(df[('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')].unique())
-        num_IDs = len(df[('PRVDR_NUM', 'Hospital Provider Number', 'HOSPITAL IDENTIFICATION INFORMATION', 'Hospital Provider Number (PRVDR_NUM)')].unique())
-        
-        return df.to_json(), "Loaded " + str(num_IDs) + " hospitals"
-
-    else:
-        df = pd.read_json(df)
-        df = df[df["('data url', 'data url', 'data url', 'data url')"].isin(urls)]
-        df_urls = df["('data url', 'data url', 'data url', 'data url')"].unique()
-        
-        url_ls = list(set(urls)-set(df_urls))
-        
-        if len(url_ls) > 0:
-            df2 = 0
-            for i, url in enumerate(url_ls):
-                tdf = pd.read_csv(url, header=[0,1,2,3], index_col=[0])
-                tdf[('data url', 'data url', 'data url', 'data url')] = [url] * tdf.shape[0]
-                
-                if i == 0:
-                    df2 = tdf.copy(deep=True)
-                else:
-                    df2 = pd.concat([df2, tdf]) 
-            
-            df2 = df2.to_json()
-            df2 = pd.read_json(df2)
-            df = pd.concat([df, df2])
-            del df2
-        
-        df.dropna(axis=1, how='all', inplace=True)
-        df.reset_index(drop=True, inplace=True)
-        
-        #ex_time = timeit.default_timer() - start
-        #print("update_df1_tab1 executed in "+str(ex_time))
-        
-        #num_h = len(df["('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')"].unique())
-        num_IDs = len(df["('PRVDR_NUM', 'Hospital Provider Number', 'HOSPITAL IDENTIFICATION INFORMATION', 'Hospital Provider Number (PRVDR_NUM)')"].unique())
-        
-        return df.to_json(), "Loaded " + str(num_IDs) + " hospitals"
+    # Providers that stay selected come from the per-provider frame cache; 
+    # only added providers are read
+    df, key, prvdrs, failed = ASSEMBLER.assemble(prvdrs, 
+        progress=lambda n, total: set_progress([n, total, "Loaded " + str(n) + "/" + str(total) + " providers"]))
+    if df is None:
+        return None, load_message(0, failed)
+    
+    if data is None or data['key'] != key:
+        SESSION_CACHE.set(key, df)
+        bits = ASSEMBLER.feature_bits(prvdrs)
+        INDEX_CACHE.set(key, report_index.ColumnIndex(df.columns, bits, FEATURE_BITS))
+    
+    #ex_time = timeit.default_timer() - start
+    #print("update_df1_tab1 executed in "+str(ex_time))
+    
+    #num_h = len(df[NAME_COL].unique())
+    num_IDs = len(df[PRVDR_COL].unique())
+    
+    return {'key': key, 'providers': prvdrs}, load_message(num_IDs, failed)
 
 
 @app.callback(
@@ -1473,19 +1920,21 @@ def update_map_plot1(df, h):
     if df is None:
         return figure#, ', 0 Selected'
     
-    df = pd.read_json(df)
+    df = load_session(df)
+    if df is None:
+        return figure
     
-    num_h = len(df["('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')"].unique())
+    num_h = len(df[NAME_COL].unique())
     
     features = list(df)
-    if "('Lon', 'Lon', 'Lon', 'Lon')" not in features or "('Lat', 'Lat', 'Lat', 'Lat')" not in features:
+    if LON_COL not in features or LAT_COL not in features:
         return figure#,  ', ' + str(num_h) + ' Selected'
     
     figure = go.Figure()
     figure.add_trace(go.Scattermapbox(
-        lon = df["('Lon', 'Lon', 'Lon', 'Lon')"],
-        lat = df["('Lat', 'Lat', 'Lat', 'Lat')"],
-        text = df["('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')"],
+        lon = df[LON_COL],
+        lat = df[LAT_COL],
+        text = df[NAME_COL],
                
         marker = dict(
             size = 10,
@@ -1522,36 +1971,81 @@ def update_map_plot1(df, h):
 
 
 @app.callback(
-    Output("data-download", "data"),
-    Input("download-btn", "n_clicks"),
-    [State('df_tab1', "data")],
+    Output("export-providers", "value"),
+    [Input('df_tab1', "data")],
+)
+def update_download(df):
+    # The export route reads the reports of these providers itself
+    if df is None:
+        return ''
+    return ','.join(df['providers'])
+
+
+@app.callback(
+    Output("bulk-export-job", "data"),
+    Input("bulk-export-btn", "n_clicks"),
+    [State('beds1', 'value'),
+     State('states-select1', 'value'),
+     State('hospital_type1', 'value'),
+     State('control_type1', 'value'),
+     State("bulk-export-format", "value"),
+     ],
+    prevent_initial_call=True,
+)
+def start_bulk_export(n_clicks, bed_range, states_vals, htype_vals, ctype_vals, fmt):
+    hospitals = export_jobs.matching_hospitals(app_data.directory(), bed_range, states_vals, htype_vals, ctype_vals)
+    return EXPORT_JOBS.submit(hospitals, fmt)
+
+
+@app.callback(
+    [Output("bulk-export-status", "children"),
+     Output("bulk-export-link", "href"),
+     Output("bulk-export-link", "style"),
+     Output("bulk-export-interval", "disabled")],
+    [Input("bulk-export-interval", "n_intervals"),
+     Input("bulk-export-job", "data")],
     prevent_initial_call=True,
 )
-def update_download(n_clicks, df):
+def update_bulk_export(n_intervals, job_id):
+    hidden = {'display': 'none'}
+    status = EXPORT_JOBS.status(job_id) if job_id else None
+    if status is None:
+        return "", "", hidden, True
     
-    #start = timeit.default_timer()
+    if status['state'] == 'failed':
+        return "Export failed: " + str(status['error']), "", hidden, True
     
-    if df is None:
-        return dcc.send_data_frame(main_df.to_csv, "cost_reports.csv")
-            
-    df = pd.read_json(df)
-    if df.shape[0] == 0:
-        return dcc.send_data_frame(main_df.to_csv, "cost_reports.csv")
-        
-    else:
-        tdf = main_df.copy(deep=True)
-        cols = list(df)
-        
-        for i, c in enumerate(cols):
-            vals = df[c].tolist()
-            
-            c = list(eval(c))
-            tdf[(c[0], c[1], c[2], c[3])] = vals
+    txt = "Exported " + str(status['done']) + " of " + str(status['total']) + " CMS numbers"
+    if len(status['failed']) > 0:
+        txt = txt + ". Could not read: " + ', '.join(status['failed'])
+    if status['state'] != 'done':
+        return txt, "", hidden, False
     
-    #ex_time = timeit.default_timer() - start
-    #print("update_download executed in "+str(ex_time))
+    href = app.get_relative_path("/export/jobs/" + job_id)
+    return txt, href, {'display': 'block', 'textAlign': 'center'}, True
 
-    return dcc.send_data_frame(tdf.to_csv, "cost_reports.csv")
+
+@server.route("/export/jobs/<job_id>")
+def bulk_export_bundle(job_id):
+    if export_jobs.JOB_PATTERN.match(job_id) is None:
+        flask.abort(404)
+    path = EXPORT_JOBS.bundle(job_id)
+    if path is None:
+        flask.abort(404)
+    return flask.send_file(path, mimetype='application/zip', as_attachment=True,
+                           download_name='cost_reports_' + job_id[:8] + '.zip')
+
+
+@server.route("/export", methods=["POST"])
+def export_reports():
+    prvdrs = [p for p in flask.request.form.get('providers', '').split(',') if re.fullmatch('[0-9A-Za-z]+', p)]
+    fmt = flask.request.form.get('format', 'csv')
+    if fmt not in report_export.FORMATS:
+        flask.abort(400)
+
+    content, mimetype, filename = report_export.export(ASSEMBLER, prvdrs, fmt)
+    return flask.Response(flask.stream_with_context(content), mimetype=mimetype,
+                          headers={'Content-Disposition': 'attachment; filename=' + filename})
     
 
     
@@ -1565,27 +2059,12 @@ def update_download(n_clicks, df):
     )
 def update_output7(value, df):
     
-    df2 = main_df.iloc[:, (main_df.columns.get_level_values(2)==value)]
-    sub_cat = df2.columns.get_level_values(3).tolist()
-    del df2
-    
-    if df is not None:
-        df = pd.read_json(df)
-        df.dropna(how='all', axis=1, inplace=True)
-        
-        cols1 = list(df)
-        cols2 = []
-        for c in cols1:
-            s = c.split("', ")[-1]
-            s = s[1:-2]
-            cols2.append(s)
-            
-        sub_categories = []
-        for c in sub_cat:
-            if c in cols2:
-                sub_categories.append(c)
+    # Features with data for any loaded provider, shared by all dropdowns
+    index = load_index(df)
+    if index is not None:
+        sub_categories = index.category_features(value)
     else:
-        sub_categories = sub_cat
+        sub_categories = list(schema_manifest.category_features(value))
     
     
     return [{"label": i, "value": i} for i in sub_categories]
@@ -1615,27 +2094,12 @@ def update_output8(available_options):
     )
 def update_output9(value, df):
 
-    df2 = main_df.iloc[:, (main_df.columns.get_level_values(2)==value)]
-    sub_cat = df2.columns.get_level_values(3).tolist()
-    del df2
-    
-    if df is not None:
-        df = pd.read_json(df)
-        df.dropna(how='all', axis=1, inplace=True)
-        
-        cols1 = list(df)
-        cols2 = []
-        for c in cols1:
-            s = c.split("', ")[-1]
-            s = s[1:-2]
-            cols2.append(s)
-            
-        sub_categories = []
-        for c in sub_cat:
-            if c in cols2:
-                sub_categories.append(c)
+    # Features with data for any loaded provider, shared by all dropdowns
+    index = load_index(df)
+    if index is not None:
+        sub_categories = index.category_features(value)
     else:
-        sub_categories = sub_cat
+        sub_categories = list(schema_manifest.category_features(value))
     
     
     return [{"label": i, "value": i} for i in sub_categories]
@@ -1665,30 +2129,15 @@ def update_output10(available_options):
     )
 def update_output11(value, df):
     
-    df2 = main_df.iloc[:, (main_df.columns.get_level_values(2)==value)]
-    sub_cat = df2.columns.get_level_values(3).tolist()
-    del df2
-    
-    if df is not None:
-        df = pd.read_json(df)
-        df.dropna(how='all', axis=1, inplace=True)
-        
-        cols1 = list(df)
-        cols2 = []
-        for c in cols1:
-            s = c.split("', ")[-1]
-            s = s[1:-2]
-            cols2.append(s)
-            
-        sub_categories = []
-        for c in sub_cat:
-            if c in cols2:
-                sub_categories.append(c)
+    # Features with data for any loaded provider, shared by all dropdowns
+    index = load_index(df)
+    if index is not None:
+        sub_categories = index.category_features(value)
     else:
-        sub_categories = sub_cat
+        sub_categories = list(schema_manifest.category_features(value))
     
     
-    return [{"label": i, "value": i} for i in sub_cat]
+    return [{"label": i, "value": i} for i in sub_categories]
 
 
 @app.callback( # Select sub-category
@@ -1713,30 +2162,15 @@ def update_output12(available_options):
     )
 def update_output13(value, df):
     
-    df2 = main_df.iloc[:, (main_df.columns.get_level_values(2)==value)]
-    sub_cat = df2.columns.get_level_values(3).tolist()
-    del df2
-    
-    if df is not None:
-        df = pd.read_json(df)
-        df.dropna(how='all', axis=1, inplace=True)
-        
-        cols1 = list(df)
-        cols2 = []
-        for c in cols1:
-            s = c.split("', ")[-1]
-            s = s[1:-2]
-            cols2.append(s)
-            
-        sub_categories = []
-        for c in sub_cat:
-            if c in cols2:
-                sub_categories.append(c)
+    # Features with data for any loaded provider, shared by all dropdowns
+    index = load_index(df)
+    if index is not None:
+        sub_categories = index.category_features(value)
     else:
-        sub_categories = sub_cat
+        sub_categories = list(schema_manifest.category_features(value))
     
     
-    return [{"label": i, "value": i} for i in sub_cat]
+    return [{"label": i, "value": i} for i in sub_categories]
 
 
 @app.callback( # Select sub-category
@@ -1759,9 +2193,14 @@ def update_output14(available_options):
      State('categories-select1', 'value'),
      State('categories-select11', 'value'),
      State('hospital-select1b', 'value'),
+     State('plot1-mode', 'value'),
+     State('compare-select1', 'value'),
+     State('states-select1', 'value'),
+     State('hospital_type1', 'value'),
+     State('control_type1', 'value'),
      ],
     )
-def update_cost_report_plot1(n_clicks, df, var1, var2, focal_h):
+def update_cost_report_plot1(n_clicks, df, var1, var2, focal_h, mode, compare, states_vals, htype_vals, ctype_vals):
     
     if df is None or var1 is None or var1 is None:
         fig = go.Figure(data=go.Scatter(x = [0], y = [0]))
@@ -1785,8 +2224,21 @@ def update_cost_report_plot1(n_clicks, df, var1, var2, focal_h):
         return fig
          
     
-    df = pd.read_json(df)
-    if df.shape[0] == 0:
+    # The filters only change the figure when they define its peer group
+    filters = [sorted(v or []) for v in (states_vals, htype_vals, ctype_vals)]
+    peers = filters + [sketches_version()] if compare == peer_sketches.COMPARISON else None
+    key = result_cache.fingerprint('plot1', df['key'], long_callback_version(), var1, var2, focal_h, mode,
+                                   compare, distributions_version(), peers)
+    figure = RESULT_CACHE.get(key)
+    if figure is not None:
+        return figure
+    
+    index = load_index(df)
+    df = load_session(df)
+    if df is not None:
+        column = index.column(var1, var2)
+    
+    if df is None or df.shape[0] == 0 or column is None:
         fig = go.Figure(data=go.Scatter(x = [0], y = [0]))
 
         fig.update_yaxes(title_font=dict(size=14, 
@@ -1809,7 +2261,7 @@ def update_cost_report_plot1(n_clicks, df, var1, var2, focal_h):
         
     
     fig_data = []
-    x = "('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')"
+    x = NAME_COL
     hospitals = sorted(df[x].unique())
     
     try:
@@ -1818,51 +2270,43 @@ def update_cost_report_plot1(n_clicks, df, var1, var2, focal_h):
     except:
         pass
     
+    # Grey out the other hospitals when the focal hospital is plotted
+    highlight = focal_h != 'No focal hospital' and focal_h in hospitals
+    
+    # In the summary modes the other hospitals are drawn as percentile bands,
+    # and only the outliers and the focal hospital as lines
+    if mode in percentile_bands.MODES[1:]:
+        fig_data, hospitals = summary_traces(df, df[column], focal_h, mode)
+        highlight = False
+    
+    # Pack large selections into WebGL traces
+    large = len(hospitals) > WEBGL_HOSPITALS
+    series = []
+    
     for i, hospital in enumerate(hospitals):
             
         sub_df = df[df[x] == hospital]
         
-        sub_df.sort_values(by=["('Beginning FFY', 'Beginning FFY', 'Beginning FFY', 'Beginning FFY')"],
-                                ascending=True, inplace=True)
+        sub_df = sub_df.sort_values(by=[FFY_COL], ascending=True)
            
-        dates = sub_df["('Beginning FFY', 'Beginning FFY', 'Beginning FFY', 'Beginning FFY')"]
-         
-        str_ = var1 + "', '" + var2 + "')"
-        column = [col for col in sub_df.columns if col.endswith(str_)]  
-        
-        if len(column) == 0:
-            fig = go.Figure(data=go.Scatter(x = [0], y = [0]))
-
-            fig.update_yaxes(title_font=dict(size=14, 
-                                             color="rgb(38, 38, 38)"))
-            fig.update_xaxes(title_font=dict(size=14, 
-                                             color="rgb(38, 38, 38)"))
-
-            fig.update_layout(title_font=dict(size=14, 
-                              color="rgb(38, 38, 38)", 
-                              ),
-                              showlegend=True,
-                              height=452,
-                              margin=dict(l=100, r=10, b=10, t=10),
-                              paper_bgcolor="#f0f0f0",
-                              plot_bgcolor="#f0f0f0",
-                              )
-            
-            return fig
-        
+        dates = sub_df[FFY_COL]
         
-        column = column[0]
         obs_y = sub_df[column].tolist()     
         hospital = str(hospital)
         
-        hi = HOSPITALS.index(hospital)
-        if hospital == focal_h or focal_h == 'No focal hospital' or focal_h not in hospitals:
-            clr = COLORS[hi]
+        info = app_data.directory().hospital(hospital)
+        if hospital == focal_h or not highlight:
+            clr = info['color']
         else:
             clr = '#cccccc'
         
-        if len(hospital) > 30:
-            hospital = hospital[0:20] + ' ... ' + hospital[-8:]
+        if large:
+            series.append(plot_traces.Series(info['label'], clr, dates, obs_y,
+                                             plot_traces.hover_text(info['label'], dates),
+                                             focal=highlight and hospital == focal_h))
+            continue
+        
+        hospital = info['label']
         
         fig_data.append(
                     go.Scatter(
@@ -1873,83 +2317,103 @@ def update_cost_report_plot1(n_clicks, df, var1, var2, focal_h):
                         marker=dict(color=clr),
                     )
                 )
+    
+    if large:
+        fig_data = plot_traces.packed_traces(series, 'lines+markers')
+    
+    # Bands of the nation, or of the focal hospital's state or type, from the
+    # precomputed distributions of all hospitals (see feature_distributions.py),
+    # or of the peers matching the filters (see peer_sketches.py)
+    comparison = comparison_traces(df, column, focal_h, compare, filters)
+    if comparison is not None:
+        fig_data = comparison[0] + fig_data
+    
+    txt_ = '<b>' + var1 + '<b>'
+    var2b = re.sub("\(.*?\)|\[.*?\]","", var2)
+    
+    if len(var2b) > 40:
+        var_ls = []
+        for j in range(0, len(var2b), 40):
+            var_ls.append(var2b[j : j + 40])
         
-        txt_ = '<b>' + var1 + '<b>'
-        var2b = re.sub("\(.*?\)|\[.*?\]","", var2)
         
-        if len(var2b) > 40:
-            var_ls = []
-            for j in range(0, len(var2b), 40):
-                var_ls.append(var2b[j : j + 40])
-            
-            
-            for j in var_ls:
-                txt_ = txt_ + '<br>' + j 
-        else:
-            txt_ = txt_ + '<br>' + var2b 
-            
-        figure = go.Figure(
-            data=fig_data,
-            layout=go.Layout(
-                transition = {'duration': 500},
-                xaxis=dict(
-                    title=dict(
-                        text="<b>Beginning Federal Fiscal Year</b>",
-                        font=dict(
-                            family='"Open Sans", "HelveticaNeue", "Helvetica Neue",'
-                            " Helvetica, Arial, sans-serif",
-                            size=18,
-                        ),
+        for j in var_ls:
+            txt_ = txt_ + '<br>' + j 
+    else:
+        txt_ = txt_ + '<br>' + var2b 
+        
+    figure = go.Figure(
+        data=fig_data,
+        layout=go.Layout(
+            transition = None if large else {'duration': 500},
+            xaxis=dict(
+                title=dict(
+                    text="<b>Beginning Federal Fiscal Year</b>",
+                    font=dict(
+                        family='"Open Sans", "HelveticaNeue", "Helvetica Neue",'
+                        " Helvetica, Arial, sans-serif",
+                        size=18,
                     ),
-                    #rangemode="tozero",
-                    zeroline=False,
-                    showticklabels=True,
                 ),
-                
-                yaxis=dict(
-                    title=dict(
-                        text=txt_,
-                        font=dict(
-                            family='"Open Sans", "HelveticaNeue", "Helvetica Neue",'
-                            " Helvetica, Arial, sans-serif",
-                            size=14,
-                            
-                        ),
+                #rangemode="tozero",
+                zeroline=False,
+                showticklabels=True,
+            ),
+            
+            yaxis=dict(
+                title=dict(
+                    text=txt_,
+                    font=dict(
+                        family='"Open Sans", "HelveticaNeue", "Helvetica Neue",'
+                        " Helvetica, Arial, sans-serif",
+                        size=14,
+                        
                     ),
-                    #rangemode="tozero",
-                    zeroline=False,
-                    showticklabels=True,
-                    
                 ),
+                #rangemode="tozero",
+                zeroline=False,
+                showticklabels=True,
                 
-                margin=dict(l=100, r=30, b=10, t=40),
-                showlegend=True,
-                height=452,
-                paper_bgcolor="#f0f0f0",
-                plot_bgcolor="#f0f0f0",
             ),
+            
+            margin=dict(l=100, r=30, b=10, t=40),
+            showlegend=True,
+            height=452,
+            paper_bgcolor="#f0f0f0",
+            plot_bgcolor="#f0f0f0",
+        ),
+    )
+    
+    figure.update_layout(
+        legend=dict(
+            traceorder="normal",
+            font=dict(
+                size=10,
+                color="rgb(38, 38, 38)"
+            ),
+            
         )
-        
+    )    
+    
+    if comparison is not None and comparison[1] is not None:
         figure.update_layout(
-            legend=dict(
-                traceorder="normal",
-                font=dict(
-                    size=10,
-                    color="rgb(38, 38, 38)"
+            title=comparison[1],
+            font=dict(
+                size=10,
+                color="rgb(38, 38, 38)"
                 ),
-                
             )
-        )    
+    
+    RESULT_CACHE.set(key, figure)
     
     del df
     del hospitals
     del fig_data
-    del dates
     del x
     return figure
 
 
-@app.callback( # Update Line plot
+@app.long_callback( # Update Line plot
     Output("cost_report_plot2", "figure"),
     [Input("run-btn2", "n_clicks")],
     [State('categories-select2', 'value'),
@@ -1962,6 +2426,9 @@ def update_cost_report_plot1(n_clicks, df, var1, var2, focal_h):
      State('hospital-select1c', 'value'),
      State("df_tab1", "data"),
      State('year-1', 'value')],
+    running=[(Output("run-btn2", "disabled"), True, False)],
+    # Results are cached by the query, not by the click that asked for it
+    cache_args_to_ignore=[0],
     )
 def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscale, model, focal_h, df, yr1):
     
@@ -1987,22 +2454,32 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
         return fig
             
     
-    df = pd.read_json(df)
+    key = result_cache.fingerprint('plot2', df['key'], long_callback_version(), xvar1, xvar2, yvar1, yvar2,
+                                   xscale, yscale, model, focal_h, yr1)
+    figure = RESULT_CACHE.get(key)
+    if figure is not None:
+        return figure
     
-    if yr1 == 'All Federal Fiscal Years':
+    index = load_index(df)
+    df = load_session(df)
+    
+    if df is None:
+        pass
+    elif yr1 == 'All Federal Fiscal Years':
         pass
     else:
-        df = df[df["('Beginning FFY', 'Beginning FFY', 'Beginning FFY', 'Beginning FFY')"] == int(yr1)]
+        df = df[df[FFY_COL] == int(yr1)]
     
     fig_data = []
     
-    str_1 = xvar1 + "', '" + xvar2 + "')"
-    str_2 = yvar1 + "', '" + yvar2 + "')"
+    str_1 = (xvar1, xvar2)
+    str_2 = (yvar1, yvar2)
     
-    column1 = [col for col in df.columns if col.endswith(str_1)]
-    column2 = [col for col in df.columns if col.endswith(str_2)]
+    if df is not None:
+        column1 = index.column(*str_1)
+        column2 = index.column(*str_2)
     
-    if len(column1) == 0 or len(column2) == 0:
+    if df is None or column1 is None or column2 is None:
         
         fig = go.Figure(data=go.Scatter(x = [0], y = [0]))
         
@@ -2021,7 +2498,15 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
         return fig
     
     
-    hospitals = sorted(df["('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')"].unique())                 
+    # One domain mask and one transform per axis, over the pooled reports; the
+    # traces of each hospital and the regression share the transformed values
+    tx, ty, keep = transforms.transform_xy(pd.to_numeric(df[column1], errors='coerce'),
+                                           pd.to_numeric(df[column2], errors='coerce'),
+                                           xscale, yscale)
+    names = df[NAME_COL].to_numpy()[keep]
+    dates = df[FFY_COL].to_numpy()[keep]
+    
+    hospitals = sorted(df[NAME_COL].unique())                 
     
     try:
         hospitals.remove(focal_h)
@@ -2029,148 +2514,39 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
     except:
         pass
     
+    # Grey out the other hospitals when the focal hospital is plotted
+    highlight = focal_h != 'No focal hospital' and focal_h in hospitals
+    
+    # Pack large selections into WebGL traces
+    large = len(hospitals) > WEBGL_HOSPITALS
+    Scatter = go.Scattergl if large else go.Scatter
+    series = []
+    
     fig_data = []
-    for i, hospital in enumerate(hospitals):
-        
-        tdf = df[df["('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')"] == hospital]
-        
-        column1 = [col for col in tdf.columns if col.endswith(str_1)]
-        column2 = [col for col in tdf.columns if col.endswith(str_2)]
-        
-        column1 = column1[0]
-        x = tdf[column1].tolist()
-        
-        column2 = column2[0]
-        y = tdf[column2].tolist()
-        
-        dates = tdf["('Beginning FFY', 'Beginning FFY', 'Beginning FFY', 'Beginning FFY')"]
-        
-        names = tdf["('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')"]
-        
-        text = names + '<br>' + dates.astype(str)
-        
-        x, y, dates, names = map(list, zip(*sorted(zip(x, y, dates, names), reverse=False)))
-        
-        # 1. linear-linear
-        
-        # 2. 
-        if xscale == 'log10' and yscale == 'log10':
-            x2, y2, dates2 = [], [], []
-            for i, val in enumerate(x):
-                if x[i] > 0 and y[i] > 0:
-                    x2.append(x[i])
-                    y2.append(y[i])
-                    dates2.append(dates[i])
-                    
-            x = np.log10(x2).tolist()
-            y = np.log10(y2).tolist()
-            dates = list(dates2)
-        
-        # 3.
-        elif xscale == 'square root' and yscale == 'square root':
-            x2, y2, dates2 = [], [], []
-            for i, val in enumerate(x):
-                if x[i] >= 0 and y[i] >= 0:
-                    x2.append(x[i])
-                    y2.append(y[i])
-                    dates2.append(dates[i])
-                    
-            x = np.sqrt(x2).tolist()
-            y = np.sqrt(y2).tolist()
-            dates = list(dates2)
-
-        # 4.
-        elif xscale == 'log10' and yscale == 'linear':
-            x2, y2, dates2 = [], [], []
-            for i, val in enumerate(x):
-                if x[i] > 0:
-                    x2.append(x[i])
-                    y2.append(y[i])
-                    dates2.append(dates[i])
-                    
-            x = np.log10(x2).tolist()
-            y = list(y2)
-            dates = list(dates2)
-        
-        # 5.
-        elif yscale == 'log10' and xscale == 'linear':
-            x2, y2, dates2 = [], [], []
-            for i, val in enumerate(x):
-                if y[i] > 0:
-                    x2.append(x[i])
-                    y2.append(y[i])
-                    dates2.append(dates[i])
-                    
-            x = list(x2)
-            y = np.log10(y2)
-            dates = list(dates2)
+    for hospital in hospitals:
         
-        # 6.
-        elif xscale == 'square root' and yscale == 'linear':
-            x2, y2, dates2 = [], [], []
-            for i, val in enumerate(x):
-                if x[i] >= 0:
-                    x2.append(x[i])
-                    y2.append(y[i])
-                    dates2.append(dates[i])
-                    
-            x = np.sqrt(x2).tolist()
-            y = list(y2)
-            dates = list(dates2)
+        rows = np.flatnonzero(names == hospital)
+        rows = rows[np.lexsort((ty[rows], tx[rows]))]
         
-        # 7.
-        elif yscale == 'square root' and xscale == 'linear':
-            x2, y2, dates2 = [], [], []
-            for i, val in enumerate(x):
-                if y[i] >= 0:
-                    x2.append(x[i])
-                    y2.append(y[i])
-                    dates2.append(dates[i])
-                    
-            x = list(x2)
-            y = np.sqrt(y2).tolist()
-            dates = list(dates2)
-            
-        # 8. 
-        elif xscale == 'log10' and yscale == 'square root':
-            x2, y2, dates2 = [], [], []
-            for i, val in enumerate(x):
-                if x[i] > 0 and y[i] >= 0:
-                    x2.append(x[i])
-                    y2.append(y[i])
-                    dates2.append(dates[i])
-                    
-            x = np.log10(x2).tolist()
-            y = np.sqrt(y2).tolist()
-            dates = list(dates2)
-          
-        # 9.
-        elif yscale == 'log10' and xscale == 'square root':
-            x2, y2, dates2 = [], [], []
-            for i, val in enumerate(x):
-                if x[i] >= 0 and y[i] > 0:
-                    x2.append(x[i])
-                    y2.append(y[i])
-                    dates2.append(dates[i])
-                    
-            x = np.sqrt(x2).tolist()
-            y = np.log10(y2).tolist()
-            dates = list(dates2)
+        text = [hospital + '<br>' + str(d) for d in dates[rows]]
             
-            
-        hi = HOSPITALS.index(hospital)
-        if hospital == focal_h or focal_h == 'No focal hospital' or focal_h not in hospitals:
-            clr = COLORS[hi]
+        info = app_data.directory().hospital(hospital)
+        if hospital == focal_h or not highlight:
+            clr = info['color']
         else:
             clr = '#b3b3b3'
         
-        if len(hospital) > 30:
-            hospital = hospital[0:20] + ' ... ' + hospital[-8:]
+        if large:
+            series.append(plot_traces.Series(info['label'], clr, tx[rows], ty[rows], text,
+                                             focal=highlight and hospital == focal_h))
+            continue
+        
+        hospital = info['label']
         
         fig_data.append(
                     go.Scatter(
-                        x=x,
-                        y=y,
+                        x=tx[rows],
+                        y=ty[rows],
                         name=hospital,
                         mode='markers',
                         marker=dict(color=clr),
@@ -2178,150 +2554,10 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
                     )
                 )
     
-    column1 = [col for col in df.columns if col.endswith(str_1)]
-    column2 = [col for col in df.columns if col.endswith(str_2)]
-    
-    dates = df["('Beginning FFY', 'Beginning FFY', 'Beginning FFY', 'Beginning FFY')"].tolist()
+    if large:
+        fig_data = plot_traces.packed_traces(series, 'markers')
     
-    column1 = column1[0]
-    x = df[column1].tolist()
-    
-    column2 = column2[0]
-    y = df[column2].tolist()
-    
-    # 1. linear-linear
-    
-    # 2. 
-    if xscale == 'log10' and yscale == 'log10':
-        x2, y2, dates2 = [], [], []
-        for i, val in enumerate(x):
-            if x[i] > 0 and y[i] > 0:
-                x2.append(x[i])
-                y2.append(y[i])
-                dates2.append(dates[i])
-                
-        x = np.log10(x2).tolist()
-        y = np.log10(y2).tolist()
-        dates = list(dates2)
-    
-    # 3.
-    elif xscale == 'square root' and yscale == 'square root':
-        x2, y2, dates2 = [], [], []
-        for i, val in enumerate(x):
-            if x[i] >= 0 and y[i] >= 0:
-                x2.append(x[i])
-                y2.append(y[i])
-                dates2.append(dates[i])
-                
-        x = np.sqrt(x2).tolist()
-        y = np.sqrt(y2).tolist()
-        dates = list(dates2)
-
-    # 4.
-    elif xscale == 'log10' and yscale == 'linear':
-        x2, y2, dates2 = [], [], []
-        for i, val in enumerate(x):
-            if x[i] > 0:
-                x2.append(x[i])
-                y2.append(y[i])
-                dates2.append(dates[i])
-                
-        x = np.log10(x2).tolist()
-        y = list(y2)
-        dates = list(dates2)
-    
-    # 5.
-    elif yscale == 'log10' and xscale == 'linear':
-        x2, y2, dates2 = [], [], []
-        for i, val in enumerate(x):
-            if y[i] > 0:
-                x2.append(x[i])
-                y2.append(y[i])
-                dates2.append(dates[i])
-                
-        x = list(x2)
-        y = np.log10(y2)
-        dates = list(dates2)
-    
-    # 6.
-    elif xscale == 'square root' and yscale == 'linear':
-        x2, y2, dates2 = [], [], []
-        for i, val in enumerate(x):
-            if x[i] >= 0:
-                x2.append(x[i])
-                y2.append(y[i])
-                dates2.append(dates[i])
-                
-        x = np.sqrt(x2).tolist()
-        y = list(y2)
-        dates = list(dates2)
-    
-    # 7.
-    elif yscale == 'square root' and xscale == 'linear':
-        x2, y2, dates2 = [], [], []
-        for i, val in enumerate(x):
-            if y[i] >= 0:
-                x2.append(x[i])
-                y2.append(y[i])
-                dates2.append(dates[i])
-                
-        x = list(x2)
-        y = np.sqrt(y2).tolist()
-        dates = list(dates2)
-        
-    # 8. 
-    elif xscale == 'log10' and yscale == 'square root':
-        x2, y2, dates2 = [], [], []
-        for i, val in enumerate(x):
-            if x[i] > 0 and y[i] >= 0:
-                x2.append(x[i])
-                y2.append(y[i])
-                dates2.append(dates[i])
-                
-        x = np.log10(x2).tolist()
-        y = np.sqrt(y2).tolist()
-        dates = list(dates2)
-      
-    # 9.
-    elif yscale == 'log10' and xscale == 'square root':
-        x2, y2, dates2 = [], [], []
-        for i, val in enumerate(x):
-            if x[i] >= 0 and y[i] > 0:
-                x2.append(x[i])
-                y2.append(y[i])
-                dates2.append(dates[i])
-                
-        x = np.sqrt(x2).tolist()
-        y = np.log10(y2).tolist()
-        dates = list(dates2)
-        
-        
-    tdf = pd.DataFrame(columns = ['x', 'y'])
-    tdf['x'] = x
-    tdf['y'] = y
-    tdf['dates'] = dates
-    tdf.dropna(how='any', inplace=True)
-    tdf.sort_values(by='x', inplace=True, ascending=True)
-    
-    x = tdf['x']
-    y = tdf['y']
-    dates = tdf['dates'].tolist()
-        
-    ty = []
-    r2 = ''
-        
-    if x.tolist() == [] or y.tolist() == []:
-        slope, intercept, r_value, p_value, std_err = np.nan, np.nan, np.nan, np.nan, np.nan
-        r2 = np.nan
-    
-        
-    tdf.replace([np.inf, -np.inf], np.nan, inplace=True)
-    tdf.dropna(how='any', inplace=True)
-        
-    x_o = tdf['x'].values.tolist()
-    y_o = tdf['y'].values.tolist()
-    
-    if x_o is None or y_o is None or len(x_o) == 0 or len(y_o) == 0:
+    if len(tx) == 0:
         
         fig = go.Figure(data=go.Scatter(x = [0], y = [0]))
         
@@ -2342,18 +2578,10 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
         
         return fig
         
-    x_o, y_o = zip(*sorted(zip(x_o, y_o)))
-    
-    x_o = np.array(x_o)
-    y_o = np.array(y_o)
-    
-    #Create single dimension
-    x = x_o[:, np.newaxis]
-    y = y_o[:, np.newaxis]
-
-    inds = x.ravel().argsort()  # Sort x values and get index
-    x = x.ravel()[inds].reshape(-1, 1)
-    y = y[inds] #Sort y according to x sorted index
+    # Sorted by x, then y
+    order = np.lexsort((ty, tx))
+    x_o = tx[order]
+    y_o = ty[order]
     
     d = int()
     if model == 'linear': d = 1
@@ -2361,11 +2589,8 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
     elif model == 'cubic': d = 3
     else: d = 1
     
-    polynomial_features = PolynomialFeatures(degree = d)
-    xp = polynomial_features.fit_transform(x)
-        
-    model = sm.OLS(y, xp).fit()
-    ypred = model.predict(xp)
+    model = regression.fit_polynomial(x_o, y_o, d)
+    ypred = model.fittedvalues
     ypred = ypred.tolist()
     
     poly_coefs = model.params[1:].tolist()
@@ -2424,9 +2649,8 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
     #print('SD:', np.nanstd(np.array(y_o)/np.array(x_o)))
     #print('SE:', stats.sem(np.array(y_o)/np.array(x_o)), '\n')
     
-    st, data, ss2 = summary_table(model, alpha=0.05)
-    predict_mean_ci_low, predict_mean_ci_upp = data[:, 4:6].T
-    predict_ci_low, predict_ci_upp = data[:, 6:8].T
+    predict_mean_ci_low, predict_mean_ci_upp = model.mean_ci_low, model.mean_ci_upp
+    predict_ci_low, predict_ci_upp = model.obs_ci_low, model.obs_ci_upp
     
     outlier_y = []
     outlier_x = []
@@ -2442,7 +2666,7 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
             
     clr = "#3399ff"
     
-    fig_data.append(go.Scatter(
+    fig_data.append(Scatter(
                         x = nonoutlier_x,
                         y = nonoutlier_y,
                         name = 'Non-outliers',
@@ -2455,7 +2679,7 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
                     )
                 )
                 
-    fig_data.append(go.Scatter(
+    fig_data.append(Scatter(
             x = outlier_x,
             y = outlier_y,
             name = 'Outliers',
@@ -2469,7 +2693,7 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
     )
     
     fig_data.append(
-                go.Scatter(
+                Scatter(
                     x = x_o,
                     y = ypred,
                     mode = "lines",
@@ -2480,7 +2704,7 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
             )
     
     fig_data.append(
-        go.Scatter(
+        Scatter(
             x = x_o,
             y = predict_mean_ci_upp,
             mode = "lines",
@@ -2491,7 +2715,7 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
     )
     
     fig_data.append(
-        go.Scatter(
+        Scatter(
             x = x_o,
             y = predict_mean_ci_low,
             mode = "lines",
@@ -2502,7 +2726,7 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
     )
     
     fig_data.append(
-        go.Scatter(
+        Scatter(
             x = x_o,
             y = predict_ci_upp,
             mode = "lines",
@@ -2513,7 +2737,7 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
     )
     
     fig_data.append(
-        go.Scatter(
+        Scatter(
             x = x_o,
             y = predict_ci_low,
             mode = "lines",
@@ -2551,7 +2775,7 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
     figure = go.Figure(
         data=fig_data,
         layout=go.Layout(
-            transition = {'duration': 500},
+            transition = None if large else {'duration': 500},
             xaxis=dict(
                 title=dict(
                     text=txt1,
@@ -2588,7 +2812,7 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
         ),
     )
         
-    if x.tolist() != [] and y.tolist() != []:
+    if len(x_o) > 0:
         figure.update_layout(
             title="Adjusted r<sup>2</sup>: " + str(round(r2, 3)) + ', Model equation: ' + eqn,
             font=dict(
@@ -2608,14 +2832,13 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
         )
     )    
     
-    del tdf
+    RESULT_CACHE.set(key, figure)
+    
     del df
     del hospitals
     del fig_data
     del dates
     del names
-    del y
-    del x
     del txt1
     del txt2
     return figure
@@ -2632,11 +2855,23 @@ def update_cost_report_plot2(n_clicks, xvar1, xvar2, yvar1, yvar2, xscale, yscal
      State('categories-select3-2', 'value'),
      State('categories-select33-2', 'value'),
      State('hospital-select1d', 'value'),
+     State('plot3-mode', 'value'),
+     State('expression3', 'value'),
      ],
 )
-def update_cost_report_plot3(n_clicks, df, numer1, numer2, denom1, denom2, focal_h):
+def update_cost_report_plot3(n_clicks, df, numer1, numer2, denom1, denom2, focal_h, mode, expression):
+    
+    # An expression of feature codes replaces the ratio of the dropdowns
+    if expression is not None and expression.strip() != '':
+        try:
+            expression = expressions.parse(expression)
+        except expressions.ExpressionError as e:
+            return message_figure(str(e))
+    else:
+        expression = None
     
-    if df is None or numer1 is None or numer2 is None or denom1 is None or denom2 is None or denom2 == 'NUMBER OF BEDS':
+    ratio = not (numer1 is None or numer2 is None or denom1 is None or denom2 is None or denom2 == 'NUMBER OF BEDS')
+    if df is None or (expression is None and not ratio):
             
         fig = go.Figure(data=go.Scatter(x = [0], y = [0]))
         
@@ -2657,17 +2892,31 @@ def update_cost_report_plot3(n_clicks, df, numer1, numer2, denom1, denom2, focal
         return fig
             
     
-    df = pd.read_json(df)
+    if expression is not None:
+        numer1 = numer2 = denom1 = denom2 = None
+    key = result_cache.fingerprint('plot3', df['key'], long_callback_version(), numer1, numer2, denom1, denom2,
+                                   focal_h, mode, expression.text if expression is not None else None)
+    figure = RESULT_CACHE.get(key)
+    if figure is not None:
+        return figure
     
-    fig_data = []
+    data = df
+    index = load_index(df)
+    df = load_session(df)
     
-    numer = numer1 + "', '" + numer2 + "')"
-    denom = denom1 + "', '" + denom2 + "')"
+    fig_data = []
     
-    column1 = [col for col in df.columns if col.endswith(numer)]
-    column2 = [col for col in df.columns if col.endswith(denom)]
+    column1 = column2 = None
+    if df is not None and expression is not None:
+        try:
+            values = derived_column(data, expression)
+        except expressions.ExpressionError as e:
+            return message_figure(str(e))
+    elif df is not None:
+        column1 = index.column(numer1, numer2)
+        column2 = index.column(denom1, denom2)
     
-    if len(column1) == 0 or len(column2) == 0:
+    if df is None or (expression is None and (column1 is None or column2 is None)):
         
         fig = go.Figure(data=go.Scatter(x = [0], y = [0]))
         
@@ -2688,7 +2937,7 @@ def update_cost_report_plot3(n_clicks, df, numer1, numer2, denom1, denom2, focal
         return fig
     
     
-    hospitals = sorted(df["('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')"].unique())                 
+    hospitals = sorted(df[NAME_COL].unique())                 
     
     try:
         hospitals.remove(focal_h)
@@ -2696,38 +2945,57 @@ def update_cost_report_plot3(n_clicks, df, numer1, numer2, denom1, denom2, focal
     except:
         pass
     
-    fig_data = []
+    # Grey out the other hospitals when the focal hospital is plotted
+    highlight = focal_h != 'No focal hospital' and focal_h in hospitals
+    
+    # The rate of every report, computed over the whole frame at once
+    if expression is None:
+        values = pd.to_numeric(df[column1], errors='coerce') / pd.to_numeric(df[column2], errors='coerce')
+    else:
+        values = pd.Series(values, index=df.index)
+    
+    # In the summary modes the other hospitals are drawn as percentile bands,
+    # and only the outliers and the focal hospital as lines
+    if mode in percentile_bands.MODES[1:]:
+        fig_data, hospitals = summary_traces(df, values, focal_h, mode)
+        highlight = False
+    
+    # Pack large selections into WebGL traces
+    large = len(hospitals) > WEBGL_HOSPITALS
+    series = []
+    
+    name_var = NAME_COL
+    date_var = FFY_COL
+    all_names = df[name_var].to_numpy()
+    
     for hospital in hospitals:
         
-        name_var = "('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')"
-        tdf = df[df[name_var] == hospital]
-        
-        date_var = "('Beginning FFY', 'Beginning FFY', 'Beginning FFY', 'Beginning FFY')"
-        tdf.sort_values(by=date_var, inplace=True, ascending=True)
-        
-        column1 = [col for col in tdf.columns if col.endswith(numer)]
-        column2 = [col for col in tdf.columns if col.endswith(denom)]
-        
-        column1 = column1[0]
-        column2 = column2[0]
-        tdf['y'] = tdf[column1]/tdf[column2]
-        tdf = tdf.filter(items=['y', date_var, name_var], axis=1)
+        rows = np.flatnonzero(all_names == hospital)
+        tdf = pd.DataFrame({'y': values.to_numpy()[rows],
+                            'dates': df[date_var].to_numpy()[rows],
+                            'names': all_names[rows],
+                            })
+        tdf = tdf.sort_values(by='dates', ascending=True)
         tdf.dropna(how='any', inplace=True)
         
-        dates = tdf["('Beginning FFY', 'Beginning FFY', 'Beginning FFY', 'Beginning FFY')"]
-        names = tdf["('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')"]
+        dates = tdf['dates']
+        names = tdf['names']
         y = tdf['y']
         
         text = names + '<br>' + dates.astype(str)
         
-        hi = HOSPITALS.index(hospital)
-        if hospital == focal_h or focal_h == 'No focal hospital' or focal_h not in hospitals:
-            clr = COLORS[hi]
+        info = app_data.directory().hospital(hospital)
+        if hospital == focal_h or not highlight:
+            clr = info['color']
         else:
             clr = '#cccccc'
         
-        if len(hospital) > 30:
-            hospital = hospital[0:20] + ' ... ' + hospital[-8:]
+        if large:
+            series.append(plot_traces.Series(info['label'], clr, dates, y, text,
+                                             focal=highlight and hospital == focal_h))
+            continue
+        
+        hospital = info['label']
             
         fig_data.append(
                     go.Scatter(
@@ -2740,13 +3008,20 @@ def update_cost_report_plot3(n_clicks, df, numer1, numer2, denom1, denom2, focal
                     )
                 )
     
-    numer2 = re.sub("\(.*?\)|\[.*?\]","", numer2)
-    denom2 = re.sub("\(.*?\)|\[.*?\]","", denom2)
+    if large:
+        fig_data = plot_traces.packed_traces(series, 'lines+markers')
+    
+    if expression is None:
+        numer2 = re.sub("\(.*?\)|\[.*?\]","", numer2)
+        denom2 = re.sub("\(.*?\)|\[.*?\]","", denom2)
+        y_title = "<b>" + numer2 + ' /<br>' + denom2 + "</b>"
+    else:
+        y_title = "<b>" + '<br>'.join(textwrap.wrap(expression.text, 40)) + "</b>"
     
     figure = go.Figure(
         data=fig_data,
         layout=go.Layout(
-            transition = {'duration': 500},
+            transition = None if large else {'duration': 500},
             xaxis=dict(
                 title=dict(
                     text="<b>Beginning Federal Fiscal Year</b>",
@@ -2763,7 +3038,7 @@ def update_cost_report_plot3(n_clicks, df, numer1, numer2, denom1, denom2, focal
                 
             yaxis=dict(
                 title=dict(
-                    text= "<b>" + numer2 + ' /<br>' + denom2 + "</b>",
+                    text= y_title,
                     font=dict(
                         family='"Open Sans", "HelveticaNeue", "Helvetica Neue",'
                         " Helvetica, Arial, sans-serif",
@@ -2795,15 +3070,11 @@ def update_cost_report_plot3(n_clicks, df, numer1, numer2, denom1, denom2, focal
         )
     )    
     
-    del tdf
+    RESULT_CACHE.set(key, figure)
+    
     del df
     del hospitals
     del fig_data
-    del dates
-    del names
-    del y
-    del date_var
-    del name_var
     return figure
 
 
@@ -0,0 +1,212 @@
+"""
+Data assets of the Rush Hospital Cost Reports application.
+
+Each asset is loaded on first use and kept for the life of the process, so
+importing app.py does not read any data and gunicorn workers can start serving
+right away. The general hospital data and the crosswalk are first read when the
+layout is built, on the first page load, or by preload() in the gunicorn master
+before it forks its workers (see gunicorn.conf.py).
+
+The app only needs a few columns of the general hospital data. To write them as
+a compact, memory-mappable hospital directory, run:
+
+    python app_data.py
+
+When that directory exists, the general data pickle is not read at all.
+
+The distributions of every feature over all hospitals, which the comparisons
+of the feature-over-time panel read, are built offline by
+feature_distributions.py, and the sketches of the peer groups of the hospital
+filters by peer_sketches.py. The feature vectors that nearest peers are found
+by are built by peer_finder.py.
+"""
+
+import csv
+import os
+import sys
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import crosswalk_index
+import feature_distributions
+import hospital_directory
+import peer_finder
+import peer_sketches
+import schema_manifest
+
+
+GENDAT_PATH = 'dataframe_data/GenDat4App_p4.pkl'
+CATEGORIES_PATH = 'dataframe_data/report_categories.csv'
+DIRECTORY_PATH = 'dataframe_data/hospital_directory'
+
+NAME_COL = ('Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num', 'Curated Name and Num')
+PRVDR_COL = ('PRVDR_NUM', 'Hospital Provider Number', 'HOSPITAL IDENTIFICATION INFORMATION', 'Hospital Provider Number (PRVDR_NUM)')
+BEDS_COL = ('S3_1_C2_27', 'Total Facility', 'NUMBER OF BEDS', 'Total Facility (S3_1_C2_27)')
+STATE_COL = ('S2_1_C2_2', 'Hospital State', '', 'Hospital State (S2_1_C2_2)')
+HTYPE_COL = ('Hospital type (modified)', 'Hospital type (modified)', 'Hospital type (modified)', 'Hospital type (modified)')
+CTYPE_COL = ('S2_1_C1_21', 'Type of Control of Hospital (See Table I)', '', 'Type of Control of Hospital (See Table I) (S2_1_C1_21)')
+
+
+def general_data():
+    """
+    :return: The general hospital data, with missing states, hospital types
+             and control types set to 'Not given'.
+    """
+    gendat_df = pd.read_pickle(GENDAT_PATH)
+    for col in [STATE_COL, HTYPE_COL, CTYPE_COL]:
+        gendat_df[col] = gendat_df[col].replace(np.nan, 'Not given')
+    return gendat_df
+
+
+def hospital_lists():
+    """
+    :return: A dict of the names, provider numbers, beds, states, hospital
+             types and control types of all hospitals, as lists sorted by name.
+    """
+    gendat_df = general_data()
+    names = gendat_df[NAME_COL].tolist()
+    prvdrs = gendat_df[PRVDR_COL].tolist()
+    beds = gendat_df[BEDS_COL].tolist()
+
+    states = ['NaN' if x is np.nan else x for x in gendat_df[STATE_COL].tolist()]
+    htypes = ['NaN' if x is np.nan else x for x in gendat_df[HTYPE_COL].tolist()]
+    ctypes = ['NaN' if x is np.nan else x for x in gendat_df[CTYPE_COL].tolist()]
+
+    lists = (list(t) for t in zip(*sorted(zip(names, prvdrs, beds, states, htypes, ctypes))))
+    return dict(zip(['names', 'prvdrs', 'beds', 'states', 'htypes', 'ctypes'], lists))
+
+
+def build_directory():
+    """
+    :return: A HospitalDirectory built from the general hospital data.
+    """
+    lists = hospital_lists()
+    return hospital_directory.HospitalDirectory.from_lists(lists['names'], lists['prvdrs'], lists['beds'],
+                                                           lists['states'], lists['htypes'], lists['ctypes'])
+
+
+@lru_cache(maxsize=None)
+def directory():
+    """
+    :return: The HospitalDirectory of all hospitals, memory-mapped from
+             DIRECTORY_PATH when it has been written.
+    """
+    if os.path.isdir(DIRECTORY_PATH):
+        return hospital_directory.HospitalDirectory.load(DIRECTORY_PATH)
+    return build_directory()
+
+
+def hospital_names():
+    """
+    :return: The sorted, distinct curated names of all hospitals.
+    """
+    return directory().names
+
+
+def distinct_values(name):
+    """
+    :return: The sorted, distinct values of 'states', 'htypes' or 'ctypes'.
+    """
+    return directory().categories[name]
+
+
+@lru_cache(maxsize=None)
+def crosswalk():
+    """
+    :return: The crosswalk of feature codes, descriptions and categories, as
+             shown in the crosswalk table.
+    """
+    crosswalk_df = pd.read_csv(schema_manifest.CROSSWALK_PATH)
+    crosswalk_df.drop(labels=['WORKSHEET', 'DATA_TYPE', '96_FIELD_NAME', 'WKSHT CD', 'LINE', 'COLUMN'], axis=1, inplace=True)
+
+    crosswalk_df.rename(columns={"TYPE": "Category",
+                                 "SUBTYPE": 'Sub-category',
+                                 "10_FIELD_NAME": 'Feature code',
+                                 "FIELD DESCRIPTION ": "Feature description",
+                                 },
+                        inplace=True,
+                        )
+    return crosswalk_df
+
+
+@lru_cache(maxsize=None)
+def crosswalk_table():
+    """
+    :return: The CrosswalkIndex serving the crosswalk table.
+    """
+    return crosswalk_index.CrosswalkIndex(crosswalk())
+
+
+@lru_cache(maxsize=None)
+def report_categories():
+    """
+    :return: The sorted report categories.
+    """
+    with open(CATEGORIES_PATH, newline='') as csvfile:
+        categories = csv.reader(csvfile, delimiter=',')
+        for row in categories:
+            report_categories = row
+    return sorted(report_categories)
+
+
+@lru_cache(maxsize=None)
+def category_options():
+    """
+    :return: Dropdown options of the report categories, shared by every category dropdown.
+    """
+    return [{"label": i, "value": i} for i in report_categories()]
+
+
+@lru_cache(maxsize=None)
+def distributions():
+    """
+    :return: The FeatureDistributions memory-mapped from
+             feature_distributions.DISTRIBUTIONS_PATH, or None if they have
+             not been built.
+    """
+    if os.path.isdir(feature_distributions.DISTRIBUTIONS_PATH):
+        return feature_distributions.FeatureDistributions.load(feature_distributions.DISTRIBUTIONS_PATH)
+    return None
+
+
+@lru_cache(maxsize=None)
+def sketches():
+    """
+    :return: The PeerSketches memory-mapped from peer_sketches.SKETCHES_PATH,
+             or None if they have not been built.
+    """
+    if os.path.isdir(peer_sketches.SKETCHES_PATH):
+        return peer_sketches.PeerSketches.load(peer_sketches.SKETCHES_PATH)
+    return None
+
+
+@lru_cache(maxsize=None)
+def peer_index():
+    """
+    :return: The PeerFinder memory-mapped from peer_finder.PEERS_PATH, or None
+             if it has not been built.
+    """
+    if os.path.isdir(peer_finder.PEERS_PATH):
+        return peer_finder.PeerFinder.load(peer_finder.PEERS_PATH)
+    return None
+
+
+def preload():
+    """
+    Load every data asset, so that processes forked afterwards share them.
+    """
+    directory()
+    distributions()
+    sketches()
+    peer_index()
+    crosswalk_table()
+    category_options()
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else DIRECTORY_PATH
+    d = build_directory()
+    d.save(path)
+    print(len(d.name_codes), 'hospitals written to', path)
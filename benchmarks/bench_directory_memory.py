@@ -0,0 +1,121 @@
+"""
+Measure the per-worker memory of the hospital directory under a forking server.
+
+Two setups are compared, each with 4 forked workers that filter the hospital
+options 20 times:
+
+    pickle   each worker unpickles the general hospital data and builds the
+             hospital lists and directory from it, as app.py did before the
+             compact directory
+    compact  the master loads the memory-mapped compact directory before
+             forking, as with gunicorn's preload_app
+
+For each worker the resident (RSS), proportional (PSS) and private (USS)
+memory are read from /proc/self/smaps_rollup, so this runs on Linux only.
+Without a general data pickle, a synthetic one is made with N_HOSPITALS
+hospitals. Run from the root of the repository:
+
+    python benchmarks/bench_directory_memory.py [N_HOSPITALS]
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app_data
+import schema_manifest
+
+
+def synthetic_general_data(n_hospitals, path, density=0.15, seed=0):
+    """
+    Write a general data pickle of n_hospitals made-up hospitals over the
+    columns of the schema manifest.
+    """
+    rng = np.random.default_rng(seed)
+    data = {}
+    for c in schema_manifest.load_manifest()['columns'][5:]:
+        vals = np.round(rng.lognormal(8, 2, n_hospitals), 2)
+        vals[rng.random(n_hospitals) > density] = np.nan
+        data[tuple(c[:4])] = vals
+
+    frame = pd.DataFrame(data)
+    frame[app_data.NAME_COL] = ['HOSPITAL %d (%06d)' % (i, i) for i in range(n_hospitals)]
+    frame[app_data.PRVDR_COL] = ['%06d' % i for i in range(n_hospitals)]
+    frame[app_data.BEDS_COL] = rng.integers(1, 2800, n_hospitals).astype(float)
+    frame[app_data.STATE_COL] = rng.choice(['IL', 'CA', 'NY', 'TX', 'WI'], n_hospitals)
+    frame[app_data.HTYPE_COL] = rng.choice(['Short Term', 'Critical Access', 'Psychiatric'], n_hospitals)
+    frame[app_data.CTYPE_COL] = rng.choice(['Voluntary Nonprofit-Church', 'Governmental-City'], n_hospitals)
+    frame.to_pickle(path)
+
+
+def memory():
+    """
+    :return: A dict of the RSS, PSS and USS of this process, in MB.
+    """
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ['Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:']:
+                fields[parts[0][:-1]] = int(parts[1]) / 1024
+    return {'RSS': fields['Rss'], 'PSS': fields['Pss'], 'USS': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+def work(d):
+    args = (d.categories['states'], d.categories['htypes'], d.categories['ctypes'])
+    for low in range(1, 400, 20):
+        d.filter([low, 2800], *args)
+
+
+def run_workers(mode, n_workers=4):
+    """
+    :return: The memory of each of n_workers forked workers.
+    """
+    d = app_data.directory() if mode == 'compact' else None
+
+    pipes = []
+    for i in range(n_workers):
+        r, w = os.pipe()
+        if os.fork() == 0:
+            os.close(r)
+            if mode == 'pickle':
+                # What each worker held before: the data frame, the lists and the directory
+                kept = (app_data.general_data(), app_data.hospital_lists(), app_data.build_directory())
+                d = kept[2]
+            work(d)
+            os.write(w, json.dumps(memory()).encode('utf-8'))
+            os._exit(0)
+        os.close(w)
+        pipes.append(r)
+
+    results = []
+    for r in pipes:
+        with os.fdopen(r) as f:
+            results.append(json.loads(f.read()))
+        os.wait()
+    return results
+
+
+def run(n_hospitals):
+    with tempfile.TemporaryDirectory() as tmp:
+        if not os.path.exists(app_data.GENDAT_PATH):
+            app_data.GENDAT_PATH = os.path.join(tmp, 'gendat.pkl')
+            synthetic_general_data(n_hospitals, app_data.GENDAT_PATH)
+        app_data.DIRECTORY_PATH = os.path.join(tmp, 'hospital_directory')
+        app_data.build_directory().save(app_data.DIRECTORY_PATH)
+
+        print('general data:', os.path.getsize(app_data.GENDAT_PATH) / 2**20, 'MB pickled')
+        print('%10s %14s %14s %14s' % ('setup', 'RSS (MB)', 'PSS (MB)', 'USS (MB)'))
+        for mode in ['pickle', 'compact']:
+            results = run_workers(mode)
+            print('%10s %14.1f %14.1f %14.1f' % tuple([mode] + [np.mean([m[k] for m in results])
+                                                               for k in ['RSS', 'PSS', 'USS']]))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 6900)
@@ -0,0 +1,82 @@
+"""
+Compare the frame codecs in frame_codec.py on synthetic cost report frames.
+
+Each synthetic hospital has 12 fiscal years of reports over the columns of the
+schema manifest, with roughly the sparsity of real provider files. For 10, 90
+and 500 hospitals, reports encode and decode times, encoded size, and whether
+the decoded frame has the original columns and dtypes. Run from the root of
+the repository:
+
+    python benchmarks/bench_frame_codec.py [N_HOSPITALS ...]
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import frame_codec
+import schema_manifest
+
+
+def synthetic_reports(n_hospitals, density=0.15, seed=0):
+    """
+    :return: A DataFrame of 12 years of reports for n_hospitals made-up hospitals.
+    """
+    rng = np.random.default_rng(seed)
+    manifest = schema_manifest.load_manifest()['columns']
+    n = n_hospitals * 12
+
+    # Each hospital reports the same subset of features in every year
+    reported = rng.random((n_hospitals, len(manifest))) < density
+    reported = np.repeat(reported, 12, axis=0)
+
+    data = {}
+    for j, c in enumerate(manifest):
+        col = tuple(c[:4])
+        if c[4] == 'str':
+            vals = np.array(['TEXT %d' % (i // 12) for i in range(n)], dtype=object)
+            vals[~reported[:, j]] = None
+        else:
+            vals = np.round(rng.lognormal(8, 2, n), 2)
+            vals[~reported[:, j]] = np.nan
+        data[col] = vals
+
+    frame = pd.DataFrame(data)
+    frame[('Curated Name and Num',) * 4] = ['HOSPITAL %d (%06d)' % (i // 12, i // 12) for i in range(n)]
+    frame[('Beginning FFY',) * 4] = np.tile(np.arange(2010, 2022), n_hospitals)
+    frame[('data url',) * 4] = ['provider_data/%06d.parquet' % (i // 12) for i in range(n)]
+    frame.dropna(axis=1, how='all', inplace=True)
+    return frame
+
+
+def exact(a, b):
+    """
+    :return: True if b has the columns, dtypes and values of a.
+    """
+    try:
+        pd.testing.assert_frame_equal(a, b)
+        return True
+    except AssertionError:
+        return False
+
+
+def run(sizes, repeat=3):
+    print('%10s %12s %12s %12s %12s %8s' % ('hospitals', 'codec', 'encode (s)', 'decode (s)', 'size (MB)', 'exact'))
+    for n in sizes:
+        frame = synthetic_reports(n)
+        for name in ['json', 'pickle', 'arrow', 'arrow-zstd']:
+            codec = frame_codec.get_codec(name)
+            data = codec.encode(frame)
+            t_enc = min(timeit.repeat(lambda: codec.encode(frame), number=1, repeat=repeat))
+            t_dec = min(timeit.repeat(lambda: codec.decode(data), number=1, repeat=repeat))
+            print('%10d %12s %12.3f %12.3f %12.1f %8s' % (n, name, t_enc, t_dec, len(data) / 2**20,
+                                                        exact(frame, codec.decode(data))))
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [10, 90, 500]
+    run(sizes)
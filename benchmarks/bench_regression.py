@@ -0,0 +1,93 @@
+"""
+Compare the polynomial fits of regression.py with statsmodels' OLS and
+summary_table, which plot 2 used before.
+
+For 1,000, 10,000 and 100,000 points of skewed, cost report like data, and for
+linear, quadratic and cubic fits, reports the time each takes to fit and compute
+the intervals, and the largest relative difference between the two in the
+coefficients, adjusted r², fitted values and interval bounds. statsmodels and
+scikit-learn are no longer requirements of the app, only of its development
+requirements, which have to be installed to run the comparison. Run from the root of the
+repository:
+
+    pip install -r requirements-dev.txt
+    python benchmarks/bench_regression.py [N_POINTS ...]
+"""
+
+import importlib.util
+import os
+import sys
+import timeit
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import regression
+
+
+def synthetic_points(n, seed=0):
+    """
+    :return: x and y values of n made-up hospitals, sorted by x.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.sort(rng.lognormal(8, 1.5, n))
+    y = 500 + 1.5 * x - 2e-6 * x**2 + rng.normal(0, 0.2, n) * x
+    return x, y
+
+
+def statsmodels_fit(x, y, degree):
+    """
+    :return: The coefficients, adjusted r², fitted values and interval bounds
+             as plot 2 computed them with statsmodels.
+    """
+    import statsmodels.api as sm
+    from sklearn.preprocessing import PolynomialFeatures
+    from statsmodels.stats.outliers_influence import summary_table
+
+    xp = PolynomialFeatures(degree=degree).fit_transform(x[:, np.newaxis])
+    model = sm.OLS(y, xp).fit()
+    st, data, ss2 = summary_table(model, alpha=0.05)
+    return model.params, model.rsquared_adj, model.predict(xp), data[:, 4:8].T, model.ssr
+
+
+def numpy_fit(x, y, degree):
+    """
+    :return: The same results as statsmodels_fit, from regression.py.
+    """
+    model = regression.fit_polynomial(x, y, degree)
+    bounds = [model.mean_ci_low, model.mean_ci_upp, model.obs_ci_low, model.obs_ci_upp]
+    return model.params, model.rsquared_adj, model.fittedvalues, np.array(bounds), model.scale * model.df_resid
+
+
+def difference(a, b):
+    """
+    :return: The largest difference between a and b relative to the size of b.
+    """
+    a = np.atleast_1d(np.asarray(a, dtype=float))
+    b = np.atleast_1d(np.asarray(b, dtype=float))
+    return np.max(np.abs(a - b) / np.maximum(np.abs(b), np.finfo(float).tiny))
+
+
+def run(sizes, repeat=3):
+    if importlib.util.find_spec('statsmodels') is None or importlib.util.find_spec('sklearn') is None:
+        sys.exit('Install the development requirements (pip install -r requirements-dev.txt) to compare with statsmodels')
+
+    # statsmodels warns of the nearly collinear cubic designs
+    warnings.simplefilter('ignore')
+
+    print('%10s %10s %16s %14s %10s %10s %10s %10s %10s' % ('points', 'model', 'statsmodels (s)', 'regression (s)',
+                                                            'coefs', 'adj r2', 'fitted', 'intervals', 'ssr ratio'))
+    for n in sizes:
+        x, y = synthetic_points(n)
+        for degree, name in [(1, 'linear'), (2, 'quadratic'), (3, 'cubic')]:
+            t_sm = min(timeit.repeat(lambda: statsmodels_fit(x, y, degree), number=1, repeat=repeat))
+            t_np = min(timeit.repeat(lambda: numpy_fit(x, y, degree), number=1, repeat=repeat))
+            ours, theirs = numpy_fit(x, y, degree), statsmodels_fit(x, y, degree)
+            diffs = [difference(a, b) for a, b in zip(ours[:4], theirs[:4])]
+            print('%10d %10s %16.4f %14.4f %10.1e %10.1e %10.1e %10.1e %10.6f' % ((n, name, t_sm, t_np) + tuple(diffs)
+                                                                                  + (ours[4] / theirs[4],)))
+
+
+if __name__ == "__main__":
+    run([int(n) for n in sys.argv[1:]] or [1000, 10000, 100000])
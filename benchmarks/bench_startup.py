@@ -0,0 +1,97 @@
+"""
+Time the startup of the app and the resident memory after each phase.
+
+Each run starts a fresh Python process, as a dyno restart or a recycled
+gunicorn worker would, and goes through these phases in order:
+
+    libraries        import dash, pandas, numpy and plotly
+    import app       import app.py (all gunicorn needs before serving)
+    first layout     the first page load: builds the layout and loads the
+                     general hospital data and the crosswalk
+    hospital filter  the first update of the hospital options
+    crosswalk page   the first page of the crosswalk table
+    regression       the first polynomial fit of plot 2
+
+The median over the runs is reported for each phase. Run from the root of the
+repository:
+
+    python benchmarks/bench_startup.py [N_RUNS]
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import json, os, resource, time
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        # ru_maxrss is the peak, in kilobytes on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+phases = []
+def phase(name, start):
+    phases.append((name, time.perf_counter() - start, rss_mb()))
+
+t = time.perf_counter()
+import dash, dash_bootstrap_components, numpy, pandas, plotly.graph_objects
+phase('libraries', t)
+
+t = time.perf_counter()
+import app
+phase('import app', t)
+
+t = time.perf_counter()
+response = app.server.test_client().get('/_dash-layout')
+assert response.status_code == 200
+phase('first layout', t)
+
+t = time.perf_counter()
+app.update_hospitals([1, 2800], app.app_data.distinct_values('states'),
+                     app.app_data.distinct_values('htypes'), app.app_data.distinct_values('ctypes'))
+phase('hospital filter', t)
+
+t = time.perf_counter()
+app.update_crosswalk_table(0, 100, [], '')
+phase('crosswalk page', t)
+
+t = time.perf_counter()
+app.regression.fit_polynomial(numpy.arange(100.0), numpy.arange(100.0), 3)
+phase('regression', t)
+
+print(json.dumps(phases))
+'''
+
+
+def run_once(cache_dir):
+    env = dict(os.environ, HCRIS_CACHE_DIR=cache_dir)
+    out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env, check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(n_runs=5):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        runs = [run_once(cache_dir) for i in range(n_runs)]
+
+    print('%18s %12s %12s %12s' % ('phase', 'time (s)', 'total (s)', 'RSS (MB)'))
+    total = 0
+    for i, (name, _, _) in enumerate(runs[0]):
+        t = statistics.median(r[i][1] for r in runs)
+        rss = statistics.median(r[i][2] for r in runs)
+        total += t
+        print('%18s %12.3f %12.3f %12.1f' % (name, t, total, rss))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,194 @@
+"""
+Server-side query engine for the crosswalk table.
+
+The crosswalk DataTable pages, sorts and filters on the server, so each
+interaction sends one page of rows to the browser. Queries arrive as the
+DataTable's filter_query and sort_by properties. A token index over every
+column narrows a 'contains' filter to the rows holding tokens that contain the
+query's tokens, before the filter itself is checked on those rows only. Sort
+ranks are computed once per column.
+"""
+
+import re
+from collections import defaultdict
+
+import numpy as np
+
+
+TOKEN = re.compile('[a-z0-9_]+')
+
+# DataTable filter operators, longest first so that e.g. 'icontains' is not read as 'contains'
+OPERATORS = ['datestartswith', 'scontains', 'icontains', 'contains', 'seq', 'ieq', 'sne', 'ine',
+             'eq', 'ne', 'ge', 'le', 'gt', 'lt', '>=', '<=', '!=', '=', '>', '<']
+SYMBOLS = {'eq': '=', 'ne': '!=', 'ge': '>=', 'le': '<=', 'gt': '>', 'lt': '<'}
+
+
+def split_conditions(filter_query):
+    """
+    :return: The parts of filter_query between ' && ', not counting those
+             inside quoted values.
+    """
+    parts = []
+    start = 0
+    quote = None
+    i = 0
+    while i < len(filter_query):
+        ch = filter_query[i]
+        if quote is not None:
+            if ch == '\\':
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in '"\'`' and filter_query[i - 1:i] in ('', ' '):
+            # Quotes only open at the start of a value, not inside a word like it's
+            quote = ch
+        elif filter_query.startswith(' && ', i):
+            parts.append(filter_query[start:i])
+            start = i + 4
+            i += 3
+        i += 1
+    parts.append(filter_query[start:])
+    return parts
+
+
+def split_filter_query(filter_query):
+    """
+    Parse a DataTable filter_query such as '{Category} icontains beds && {Feature code} = S3_1_C2_27'.
+
+    :return: A list of (column, operator, value, case_sensitive) conditions,
+             where case_sensitive is None for operators without a case prefix.
+    """
+    conditions = []
+    if not filter_query:
+        return conditions
+
+    for part in split_conditions(filter_query):
+        match = re.match(r'\s*\{(.+?)\}\s*(.*)$', part)
+        if match is None:
+            continue
+        column, rest = match.groups()
+
+        for op in OPERATORS:
+            if rest.startswith(op):
+                value = rest[len(op):].strip()
+                break
+        else:
+            continue
+
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'`':
+            value = value[1:-1].replace('\\' + value[0], value[0])
+
+        case = None
+        if op[0] in 'is' and op not in ['datestartswith']:
+            case, op = op[0] == 's', op[1:]
+        conditions.append((column, SYMBOLS.get(op, op), value, case))
+    return conditions
+
+
+class CrosswalkIndex(object):
+    """
+    Token index and sort orders over the text columns of a DataFrame.
+    """
+
+    def __init__(self, frame, case_sensitive=True):
+        self.frame = frame.reset_index(drop=True)
+        self.columns = list(frame.columns)
+        self.case_sensitive = case_sensitive
+        self.values = {}
+        self.lower = {}
+        self.postings = {}
+        self.ranks = {}
+        self.blank = {}
+
+        for col in self.columns:
+            values = self.frame[col].fillna('').astype(str).tolist()
+            lower = [v.lower() for v in values]
+            self.values[col] = np.array(values, dtype=object)
+            self.lower[col] = np.array(lower, dtype=object)
+
+            postings = defaultdict(list)
+            for i, v in enumerate(lower):
+                for token in set(TOKEN.findall(v)):
+                    postings[token].append(i)
+            self.postings[col] = {t: np.array(ids) for t, ids in postings.items()}
+
+            # Equal values share a rank, so that ties fall through to the next sort column
+            self.ranks[col] = np.unique(self.values[col], return_inverse=True)[1]
+            self.blank[col] = self.values[col] == ''
+
+    def candidates(self, col, value):
+        """
+        :return: Row ids that may contain value in col: those with, for every
+                 token of value, a token containing it. None means every row.
+        """
+        rows = None
+        for token in set(TOKEN.findall(value.lower())):
+            ids = [p for t, p in self.postings[col].items() if token in t]
+            ids = np.unique(np.concatenate(ids)) if len(ids) > 0 else np.array([], dtype=np.int64)
+            rows = ids if rows is None else np.intersect1d(rows, ids, assume_unique=True)
+        return rows
+
+    def match(self, rows, col, op, value, case):
+        """
+        :return: The rows among rows whose value in col passes the condition.
+        """
+        if case is None:
+            case = self.case_sensitive
+        values = self.values[col][rows] if case else self.lower[col][rows]
+        if not case:
+            value = value.lower()
+
+        if op == 'contains':
+            keep = [value in v for v in values]
+        elif op == 'datestartswith':
+            keep = [v.startswith(value) for v in values]
+        elif op == '=':
+            keep = values == value
+        elif op == '!=':
+            keep = values != value
+        elif op == '>=':
+            keep = values >= value
+        elif op == '<=':
+            keep = values <= value
+        elif op == '>':
+            keep = values > value
+        else:
+            keep = values < value
+        return rows[np.asarray(keep, dtype=bool)]
+
+    def query(self, filter_query=None, sort_by=None):
+        """
+        :return: The row ids that pass filter_query, in the order given by sort_by.
+        """
+        rows = np.arange(self.frame.shape[0])
+        for col, op, value, case in split_filter_query(filter_query):
+            if col not in self.values:
+                continue
+            if op == 'contains':
+                found = self.candidates(col, value)
+                if found is not None:
+                    rows = np.intersect1d(rows, found, assume_unique=True)
+            rows = self.match(rows, col, op, value, case)
+
+        keys = []
+        for s in reversed(sort_by or []):
+            col = s['column_id']
+            if col in self.ranks:
+                ranks = self.ranks[col][rows]
+                if s['direction'] == 'desc':
+                    ranks = -ranks
+                # Blank cells sort last in either direction
+                keys.append(np.where(self.blank[col][rows], len(self.blank[col]), ranks))
+        if len(keys) > 0:
+            rows = rows[np.lexsort(keys)]
+        return rows
+
+    def page(self, page_current, page_size, filter_query=None, sort_by=None):
+        """
+        :return: The records of one page of the query result, and the number of pages.
+        """
+        rows = self.query(filter_query, sort_by)
+        page_count = max(1, -(-len(rows) // page_size))
+        start = page_current * page_size
+        records = self.frame.iloc[rows[start:start + page_size]].to_dict('records')
+        return records, page_count
@@ -0,0 +1,249 @@
+"""
+Background bulk exports of the cost reports of every hospital matching the
+hospital filters.
+
+An export of a whole state, or of the whole country, takes far longer than a
+request may run, so it runs as a job on a thread of the worker that receives
+it. The job reads the provider files from the data store a batch at a time and
+writes each one into a zip bundle, as CSV or Parquet, next to a hospitals.csv
+listing the hospitals that matched the filters. Neither the bundle nor the
+frames of the providers go through the frame caches.
+
+Each job keeps a status file and its bundle in a directory of its own under
+the jobs directory, which all gunicorn workers share, so any worker can report
+the progress of a job and serve its bundle when it is done. A job whose worker
+died, or that has not been updated for stall_timeout seconds, is reported as
+failed when its status is read. Jobs are removed ttl seconds after they were
+last updated.
+"""
+
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import provider_store
+import report_export
+
+
+JOB_PATTERN = re.compile('^[0-9a-f]{32}$')
+
+FORMATS = ['csv', 'parquet']
+
+
+def matching_hospitals(directory, bed_range, states, htypes, ctypes):
+    """
+    :return: The metadata records of the hospitals that pass the hospital
+             filters, with their beds, sorted by provider number and name.
+             A hospital listed in several rows of the directory is taken from
+             the first of them.
+    """
+    hospitals = {}
+    for row in np.flatnonzero(directory.mask(bed_range, states, htypes, ctypes)):
+        record = directory.record(row)
+        if (record['prvdr'], record['name']) in hospitals:
+            continue
+        record['beds'] = directory.beds[row]
+        hospitals[(record['prvdr'], record['name'])] = record
+    return [hospitals[key] for key in sorted(hospitals)]
+
+
+def process_alive(pid):
+    """
+    :return: True if a process with id pid is running on this host.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def provider_bytes(frame, fmt):
+    """
+    :return: The bytes of a provider file holding frame, in format fmt.
+    """
+    if fmt == 'csv':
+        return frame.to_csv().encode('utf-8')
+
+    text = (frame.dtypes == object).values
+    schema = report_export.arrow_schema(frame.columns, text)
+    sink = pa.BufferOutputStream()
+    pq.write_table(report_export.arrow_table([frame], frame.columns, text, schema), sink, compression='zstd')
+    return sink.getvalue().to_pybytes()
+
+
+class ExportJobs(object):
+    """
+    Runs bulk exports in the background and keeps their status and bundles on disk.
+    """
+
+    def __init__(self, store, jobs_dir, max_workers=8, retries=2, batch_size=16, max_jobs=2, ttl=24 * 3600,
+                 stall_timeout=3600):
+        self.store = store
+        self.jobs_dir = jobs_dir
+        self.max_workers = max_workers
+        self.retries = retries
+        self.batch_size = batch_size
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.stall_timeout = stall_timeout
+
+        # Started on the first submit, so that a preloading gunicorn master
+        # does not fork its workers with the executor's threads missing
+        self._executor = None
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(jobs_dir):
+            os.makedirs(jobs_dir, exist_ok=True)
+
+    def path(self, job_id, name=''):
+        if JOB_PATTERN.match(job_id) is None:
+            raise ValueError('Invalid export job: ' + repr(job_id))
+        return os.path.join(self.jobs_dir, job_id, name)
+
+    def status(self, job_id):
+        """
+        :return: The status of a job as a dict, or None for an unknown job.
+                 A queued or running job whose worker is gone, or a running
+                 job not updated for stall_timeout seconds, is marked failed.
+        """
+        try:
+            with open(self.path(job_id, 'status.json')) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if status['state'] in ['queued', 'running']:
+            error = self.stalled(status)
+            if error is not None:
+                status['state'] = 'failed'
+                status['error'] = error
+                self._write_status(job_id, status)
+        return status
+
+    def stalled(self, status):
+        """
+        :return: Why an unfinished job can no longer finish, or None.
+        """
+        if status.get('host') == socket.gethostname() and not process_alive(status.get('pid', 0)):
+            return 'the worker running the export stopped'
+        if status['state'] == 'running' and time.time() - status['updated'] > self.stall_timeout:
+            return 'the export made no progress for ' + str(int(self.stall_timeout)) + ' seconds'
+        return None
+
+    def bundle(self, job_id):
+        """
+        :return: The path of the bundle of a finished job, or None.
+        """
+        status = self.status(job_id)
+        if status is None or status['state'] != 'done':
+            return None
+        return self.path(job_id, 'bundle.zip')
+
+    def submit(self, hospitals, fmt):
+        """
+        Start exporting the reports of the hospitals, a list of records from
+        matching_hospitals, as a zip bundle of fmt files.
+
+        :return: The id of the new job.
+        """
+        if fmt not in FORMATS:
+            raise ValueError('Unknown bulk export format ' + repr(fmt) + ', expected one of ' + ', '.join(FORMATS))
+        self.cleanup()
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.path(job_id))
+        prvdrs = sorted(set(h['prvdr'] for h in hospitals))
+        self._write_status(job_id, {'job': job_id, 'state': 'queued', 'format': fmt,
+                                    'hospitals': len(hospitals), 'total': len(prvdrs), 'done': 0,
+                                    'failed': [], 'error': None, 'created': time.time(),
+                                    'host': socket.gethostname(), 'pid': os.getpid()})
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_jobs)
+            self._executor.submit(self.run, job_id, hospitals, prvdrs, fmt)
+        return job_id
+
+    def run(self, job_id, hospitals, prvdrs, fmt):
+        """
+        Write the bundle of a job, updating its status after each batch of providers.
+        """
+        status = self.status(job_id)
+        status['state'] = 'running'
+        self._write_status(job_id, status)
+
+        partial = self.path(job_id, 'bundle.zip.part')
+        try:
+            with zipfile.ZipFile(partial, 'w', zipfile.ZIP_DEFLATED) as bundle:
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                writer.writerow(['CMS number', 'Hospital', 'State', 'Hospital type', 'Control type', 'Beds'])
+                for h in hospitals:
+                    beds = '' if np.isnan(h['beds']) else int(h['beds'])
+                    writer.writerow([h['prvdr'], h['name'], h['state'], h['htype'], h['ctype'], beds])
+                bundle.writestr('hospitals.csv', buf.getvalue())
+
+                for i in range(0, len(prvdrs), self.batch_size):
+                    frames, failed = provider_store.fetch_providers(self.store, prvdrs[i:i + self.batch_size],
+                                                                    max_workers=self.max_workers,
+                                                                    retries=self.retries,
+                                                                    )
+                    for prvdr in sorted(frames):
+                        # Parquet files are already compressed
+                        compress = zipfile.ZIP_DEFLATED if fmt == 'csv' else zipfile.ZIP_STORED
+                        bundle.writestr('reports/' + prvdr + '.' + fmt, provider_bytes(frames[prvdr], fmt),
+                                        compress_type=compress)
+                    del frames
+
+                    status['done'] = min(i + self.batch_size, len(prvdrs))
+                    status['failed'] = status['failed'] + failed
+                    self._write_status(job_id, status)
+
+            os.replace(partial, self.path(job_id, 'bundle.zip'))
+            status['state'] = 'done'
+
+        except Exception as e:
+            status['state'] = 'failed'
+            status['error'] = str(e)
+            if os.path.exists(partial):
+                os.remove(partial)
+
+        self._write_status(job_id, status)
+
+    def _write_status(self, job_id, status):
+        status['updated'] = time.time()
+        tmp = self.path(job_id, 'status.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(status, f)
+        os.replace(tmp, self.path(job_id, 'status.json'))
+
+    def cleanup(self):
+        """
+        Remove the jobs that have not been updated for ttl seconds.
+        """
+        now = time.time()
+        for name in os.listdir(self.jobs_dir):
+            if JOB_PATTERN.match(name) is None:
+                continue
+            try:
+                mtime = os.stat(self.path(name, 'status.json')).st_mtime
+            except OSError:
+                mtime = os.stat(self.path(name)).st_mtime
+            if now - mtime > self.ttl:
+                shutil.rmtree(self.path(name), ignore_errors=True)
@@ -0,0 +1,377 @@
+"""
+Derived variables of the rate panel (plot 3), written as expressions of
+feature codes.
+
+The numerator and denominator dropdowns build one ratio of two features. An
+expression can combine any number of them, by the codes that end their labels
+(the first column level), with numbers, + - * / and parentheses:
+
+    (S3_1_C2_27 + S3_1_C2_28) / G3_C1_3 * 1000
+
+Two functions are also understood: sum(a, b, ...) adds its arguments counting
+missing values as zero (+ leaves the result missing), and lag(a, n) is the
+value of a in the same hospital's report n Beginning FFYs earlier, for changes
+over time such as (G3_C1_3 - lag(G3_C1_3, 1)) / lag(G3_C1_3, 1).
+
+An expression is parsed once into a tree, and compiled into a function of
+numpy arrays that evaluates it over every report of the loaded hospitals at
+once. Results that are not finite, such as ratios to zero, are missing. The
+derived columns are cached by the session key of the reports, the data version
+and the canonical text of the expression, so that the same expression written
+with other spacing or parentheses is evaluated once.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+FUNCTIONS = ['lag', 'sum']
+
+TOKEN = re.compile(r'\s*(?:(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|'
+                   r'(?P<name>[A-Za-z_][A-Za-z0-9_]*)|(?P<op>[-+*/(),]))')
+
+# Binding strength of each operator; unary minus binds tighter than * and /
+PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2, 'neg': 3}
+
+
+class ExpressionError(ValueError):
+    """
+    An expression that cannot be parsed or evaluated over the loaded reports.
+    """
+
+
+def tokenize(text):
+    """
+    :return: A list of the (kind, text, position) of the tokens of text.
+    """
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            position += len(text[position:]) - len(text[position:].lstrip())
+            raise ExpressionError('Unexpected character ' + repr(text[position]) +
+                                  ' at position ' + str(position + 1))
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind), match.start(kind)))
+        position = match.end()
+    return tokens
+
+
+class Parser(object):
+    """
+    Recursive descent parser of expressions into trees of tuples:
+    ('number', value), ('code', code), ('neg', a), (op, a, b),
+    ('sum', [a, ...]) and ('lag', a, n).
+    """
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.i = 0
+
+    def peek(self):
+        if self.i < len(self.tokens):
+            return self.tokens[self.i]
+        return (None, None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise ExpressionError('Unexpected end of expression')
+        self.i += 1
+        return token
+
+    def expect(self, op):
+        kind, text, position = self.next()
+        if text != op:
+            raise ExpressionError('Expected ' + repr(op) + ' at position ' + str(position + 1))
+
+    def parse(self):
+        if len(self.tokens) == 0:
+            raise ExpressionError('The expression is empty')
+        node = self.expression()
+        kind, text, position = self.peek()
+        if kind is not None:
+            raise ExpressionError('Unexpected ' + repr(text) + ' at position ' + str(position + 1))
+        return node
+
+    def expression(self):
+        node = self.term()
+        while self.peek()[1] in ('+', '-'):
+            op = self.next()[1]
+            node = (op, node, self.term())
+        return node
+
+    def term(self):
+        node = self.unary()
+        while self.peek()[1] in ('*', '/'):
+            op = self.next()[1]
+            node = (op, node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek()[1] == '-':
+            self.next()
+            return ('neg', self.unary())
+        if self.peek()[1] == '+':
+            self.next()
+            return self.unary()
+        return self.primary()
+
+    def primary(self):
+        kind, text, position = self.next()
+        if kind == 'number':
+            return ('number', float(text))
+        if kind == 'name' and text.lower() in FUNCTIONS and self.peek()[1] == '(':
+            return self.function(text.lower(), position)
+        if kind == 'name':
+            return ('code', text)
+        if text == '(':
+            node = self.expression()
+            self.expect(')')
+            return node
+        raise ExpressionError('Unexpected ' + repr(text) + ' at position ' + str(position + 1))
+
+    def function(self, name, position):
+        self.expect('(')
+        args = [self.expression()]
+        while self.peek()[1] == ',':
+            self.next()
+            args.append(self.expression())
+        self.expect(')')
+
+        if name == 'sum':
+            return ('sum', args)
+
+        # lag(a) is lag(a, 1); the number of years must be a whole number
+        if len(args) == 1:
+            args.append(('number', 1.0))
+        years = args[1][1] if len(args) == 2 and args[1][0] == 'number' else None
+        if years is None or years != int(years):
+            raise ExpressionError('lag at position ' + str(position + 1) +
+                                  ' takes a feature and a whole number of years')
+        return ('lag', args[0], int(years))
+
+
+def format_number(value):
+    text = repr(value)
+    return text[:-2] if text.endswith('.0') else text
+
+
+def canonical(node, parent=0, right=False):
+    """
+    :return: The text of an expression tree, with single spaces around binary
+             operators and only the parentheses its precedence needs.
+    """
+    kind = node[0]
+    if kind == 'number':
+        return format_number(node[1])
+    if kind == 'code':
+        return node[1]
+    if kind == 'sum':
+        return 'sum(' + ', '.join(canonical(a) for a in node[1]) + ')'
+    if kind == 'lag':
+        return 'lag(' + canonical(node[1]) + ', ' + str(node[2]) + ')'
+
+    precedence = PRECEDENCE[kind]
+    if kind == 'neg':
+        text = '-' + canonical(node[1], precedence)
+    else:
+        text = canonical(node[1], precedence) + ' ' + kind + ' ' + canonical(node[2], precedence, True)
+
+    # Right operands of the same precedence keep their parentheses, as
+    # a - (b - c) and a / (b * c) differ from a - b - c and a / b * c
+    if precedence < parent or (right and precedence == parent):
+        return '(' + text + ')'
+    return text
+
+
+def codes(node):
+    """
+    :return: The set of feature codes an expression tree reads.
+    """
+    kind = node[0]
+    if kind == 'code':
+        return {node[1]}
+    if kind == 'number':
+        return set()
+    if kind == 'sum':
+        return set().union(*[codes(a) for a in node[1]])
+    return set().union(*[codes(a) for a in node[1:] if isinstance(a, tuple)])
+
+
+def compile_node(node):
+    """
+    :return: A function of a Panel returning the values of an expression tree
+             for every report of the panel.
+    """
+    kind = node[0]
+    if kind == 'number':
+        value = node[1]
+        return lambda panel: np.full(panel.size, value)
+    if kind == 'code':
+        code = node[1]
+        return lambda panel: panel.values(code)
+    if kind == 'neg':
+        a = compile_node(node[1])
+        return lambda panel: -a(panel)
+    if kind == 'sum':
+        args = [compile_node(a) for a in node[1]]
+        return lambda panel: sum_missing([a(panel) for a in args])
+    if kind == 'lag':
+        a, years = compile_node(node[1]), node[2]
+        return lambda panel: panel.lag(a(panel), years)
+
+    a, b = compile_node(node[1]), compile_node(node[2])
+    operator = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide}[kind]
+    return lambda panel: operator(a(panel), b(panel))
+
+
+def sum_missing(arrays):
+    """
+    :return: The sum of arrays counting missing values as zero, missing where
+             every array is missing.
+    """
+    stacked = np.vstack(arrays)
+    total = np.nansum(stacked, axis=0)
+    total[np.all(np.isnan(stacked), axis=0)] = np.nan
+    return total
+
+
+class Expression(object):
+    """
+    A parsed and compiled expression, with its canonical text and the
+    feature codes it reads.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.text = canonical(node)
+        self.codes = sorted(codes(node))
+        self.function = compile_node(node)
+
+    def evaluate(self, panel):
+        """
+        :return: The values of the expression for every report of a Panel,
+                 with NaN where it is missing or not finite.
+        """
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            values = np.asarray(self.function(panel), dtype=float)
+        values[~np.isfinite(values)] = np.nan
+        return values
+
+
+@lru_cache(maxsize=256)
+def parse(text):
+    """
+    :return: The Expression of text, parsed and compiled once.
+    """
+    return Expression(Parser(text).parse())
+
+
+class Panel(object):
+    """
+    The reports of the loaded hospitals, as columns of values by feature code,
+    and the hospital and Beginning FFY of each report.
+    """
+
+    def __init__(self, frame, positions, hospitals, years):
+        self.frame = frame
+        self.positions = positions
+        self.size = frame.shape[0]
+        self.hospitals = pd.factorize(np.asarray(hospitals))[0].astype(np.int64)
+        self.years = pd.to_numeric(pd.Series(np.asarray(years)), errors='coerce').to_numpy(dtype=float)
+        self._values = {}
+        self._order = None
+
+    def values(self, code):
+        """
+        :return: The numeric values of the column of a feature code.
+        """
+        if code not in self._values:
+            i = self.positions.get(code)
+            if i is None:
+                raise ExpressionError('Feature ' + code + ' is not in the loaded reports')
+            column = self.frame.iloc[:, i]
+            self._values[code] = pd.to_numeric(column, errors='coerce').to_numpy(dtype=float)
+        return self._values[code]
+
+    def report_keys(self, years):
+        # A key of hospital and year for each report, -1 where the year is missing
+        known = np.isfinite(years) & (years >= self.first)
+        keys = self.hospitals * self.span + np.nan_to_num(years - self.first)
+        return np.where(known, keys, -1).astype(np.int64)
+
+    def lag(self, values, years):
+        """
+        :return: For each report, values of the same hospital's report
+                 Beginning years earlier, or NaN if it has none.
+        """
+        if self._order is None:
+            # Reports sorted by their keys, looked up once for every lag
+            known = self.years[np.isfinite(self.years)]
+            self.first = known.min() if len(known) > 0 else 0
+            self.span = int(known.max() - self.first) + 1 if len(known) > 0 else 1
+            keys = self.report_keys(self.years)
+            self._order = np.argsort(keys, kind='stable')
+            self._keys = keys[self._order]
+
+        wanted = self.report_keys(self.years - years)
+        found = np.minimum(np.searchsorted(self._keys, wanted), self.size - 1)
+        hit = (wanted >= 0) & (self._keys[found] == wanted)
+
+        lagged = np.full(self.size, np.nan)
+        lagged[hit] = values[self._order[found[hit]]]
+        return lagged
+
+
+class DerivedCache(object):
+    """
+    LRU cache of derived columns bounded by bytes, keyed by the session key of
+    the reports, the data version and the canonical text of an expression.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self._columns = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: The derived column stored under key, or None.
+        """
+        with self._lock:
+            values = self._columns.get(key)
+            if values is not None:
+                self._columns.move_to_end(key)
+            return values
+
+    def set(self, key, values):
+        """
+        Store a derived column under key, dropping the least recently used columns.
+
+        :return: values
+        """
+        if values.nbytes > self.max_bytes:
+            return values
+
+        # Columns are shared by the callbacks that read them
+        values.flags.writeable = False
+        with self._lock:
+            old = self._columns.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+            self._columns[key] = values
+            self._nbytes += values.nbytes
+
+            while self._nbytes > self.max_bytes:
+                evicted_key, evicted = self._columns.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+        return values
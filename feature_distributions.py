@@ -0,0 +1,284 @@
+"""
+Precomputed distributions of every feature over all hospitals, by fiscal year.
+
+Comparing a hospital to the whole country would mean loading the reports of
+every hospital. Instead, an offline build reads every provider file once and
+keeps, for each group of hospitals, numeric feature and Beginning FFY, the
+number of reports, their mean and their quantiles at every fifth percentile.
+The groups are the nation, each state and each hospital type. Quantiles and
+percentile ranks for the focal hospital then come from a few rows of these
+arrays, without loading any other hospital.
+
+Only the cells that hold data are stored, sorted by a key of group, feature
+and year, as .npy files loaded with memory-mapping. To build the distributions
+from the provider store the app reads from, run:
+
+    python feature_distributions.py [OUTPUT_DIR]
+"""
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import provider_store
+import report_export
+import schema_manifest
+
+
+DISTRIBUTIONS_PATH = 'dataframe_data/feature_distributions'
+
+FFY_COL = ('Beginning FFY', 'Beginning FFY', 'Beginning FFY', 'Beginning FFY')
+
+# Percentiles at which the quantiles of each cell are kept. Percentile ranks
+# are interpolated between them; a finer grid multiplies the size of the files
+# by the number of groups, features and years
+GRID = np.arange(0, 101, 5)
+
+ARRAYS = ['keys', 'counts', 'means', 'quantiles']
+
+# Groups the focal hospital can be compared to in the feature-over-time panel
+COMPARISONS = ['No comparison', 'Nation', 'State', 'Hospital type']
+
+
+def numeric_columns():
+    """
+    :return: The numeric feature columns of the schema manifest.
+    """
+    manifest = schema_manifest.load_manifest()['columns']
+    return [tuple(c[:4]) for c in manifest if c[4] != 'str' and tuple(c[:4]) != FFY_COL]
+
+
+def summarize(keys, values, grid=GRID):
+    """
+    :return: The distinct keys, and the counts, means and quantiles at each
+             percentile of grid of the values of each key.
+    """
+    order = np.lexsort((values, keys))
+    keys = keys[order]
+    values = values[order]
+
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    means = np.add.reduceat(values, starts) / counts
+
+    # Linear interpolation between the closest ranks, as numpy.percentile
+    position = starts[:, np.newaxis] + (counts[:, np.newaxis] - 1) * grid[np.newaxis, :] / 100
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    frac = position - low
+    quantiles = values[low] * (1 - frac) + values[high] * frac
+    return keys[starts], counts.astype(np.int32), means, quantiles.astype(np.float32)
+
+
+def provider_codes(directory):
+    """
+    :return: The sorted provider numbers of the hospital directory, and an
+             array of the state, hospital type and control type codes of each,
+             from its first row in the directory.
+    """
+    rows = {}
+    for row, prvdr in enumerate(directory.prvdrs):
+        rows.setdefault(prvdr.decode('utf-8'), row)
+    prvdrs = sorted(rows)
+
+    first = np.array([rows[prvdr] for prvdr in prvdrs], dtype=np.int64)
+    codes = np.stack([directory.state_codes[first], directory.htype_codes[first], directory.ctype_codes[first]], axis=1)
+    return prvdrs, codes.astype(np.int32)
+
+
+def report_values(store, prvdrs, columns, max_workers=16, retries=2, batch_size=64):
+    """
+    Read the reports of prvdrs from store, a batch at a time.
+
+    :return: Arrays of every finite value in the given numeric columns, in
+             reports with a Beginning FFY: the position of its column, its
+             Beginning FFY, the position of its provider in prvdrs, and the value.
+    """
+    text = np.zeros(len(columns), dtype=bool)
+    index = pd.MultiIndex.from_tuples(columns)
+    position = {prvdr: i for i, prvdr in enumerate(prvdrs)}
+
+    features, years, providers, values = [], [], [], []
+    for i in range(0, len(prvdrs), batch_size):
+        frames, failed = provider_store.fetch_providers(store, prvdrs[i:i + batch_size],
+                                                        max_workers=max_workers, retries=retries)
+        for prvdr, frame in frames.items():
+            matrix = report_export.typed_values(frame, index, text)[0]
+            ffy = pd.to_numeric(frame[FFY_COL], errors='coerce').to_numpy()
+            rows, cols = np.nonzero(np.isfinite(matrix) & np.isfinite(ffy)[:, np.newaxis])
+
+            features.append(cols.astype(np.int32))
+            years.append(ffy[rows].astype(np.int32))
+            providers.append(np.full(len(rows), position[prvdr], dtype=np.int32))
+            values.append(matrix[rows, cols])
+
+    if len(values) == 0:
+        raise ValueError('No provider reports could be read from ' + repr(store))
+    return np.concatenate(features), np.concatenate(years), np.concatenate(providers), np.concatenate(values)
+
+
+class FeatureDistributions(object):
+    """
+    Counts, means and quantiles of each feature by group of hospitals and fiscal year.
+    """
+
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        self.version = meta['built']
+
+        self.columns = {tuple(c): i for i, c in enumerate(meta['columns'])}
+        self.groups = {g: i for i, g in enumerate(meta['groups'])}
+        self.years = meta['years']
+        self.grid = np.asarray(meta['grid'])
+
+        self.keys = arrays['keys']
+        self.counts = arrays['counts']
+        self.means = arrays['means']
+        self.quantiles = arrays['quantiles']
+
+    @classmethod
+    def build(cls, store, directory, max_workers=16, retries=2, batch_size=64):
+        """
+        :return: The FeatureDistributions of the reports of every provider in
+                 the hospital directory, read from store.
+        """
+        columns = numeric_columns()
+        states = directory.categories['states']
+        htypes = directory.categories['htypes']
+        groups = ['nation'] + ['state:' + s for s in states] + ['type:' + t for t in htypes]
+
+        prvdrs, codes = provider_codes(directory)
+        features, years, providers, values = report_values(store, prvdrs, columns, max_workers, retries, batch_size)
+        state_codes = codes[providers, 0]
+        htype_codes = codes[providers, 1]
+
+        year_list = sorted(int(y) for y in np.unique(years))
+        year_codes = np.searchsorted(year_list, years)
+
+        # Group codes: 0 for the nation, then states, then hospital types;
+        # hospitals missing a state or type only count towards the nation
+        parts = []
+        for group_codes, offset in [(np.zeros(len(values), dtype=np.int32), 0),
+                                    (state_codes, 1),
+                                    (htype_codes, 1 + len(states))]:
+            known = group_codes >= 0
+            keys = cls.cell_key(group_codes[known] + offset, features[known], year_codes[known],
+                                len(columns), len(year_list))
+            parts.append(summarize(keys, values[known]))
+
+        arrays = {name: np.concatenate([p[i] for p in parts]) for i, name in enumerate(ARRAYS)}
+        meta = {'columns': [list(c) for c in columns], 'groups': groups, 'years': year_list,
+                'grid': GRID.tolist(), 'built': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        return cls(arrays, meta)
+
+    @staticmethod
+    def cell_key(group, feature, year, n_features, n_years):
+        return (np.asarray(group, dtype=np.int64) * n_features + feature) * n_years + year
+
+    def save(self, path):
+        """
+        Write the distributions as .npy files and a JSON file of their columns,
+        groups and years in the directory path.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for key, values in self.arrays.items():
+            np.save(os.path.join(path, key + '.npy'), np.asarray(values))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :return: The distributions saved in path, with their arrays memory-mapped.
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {key: np.load(os.path.join(path, key + '.npy'), mmap_mode='r') for key in ARRAYS}
+        return cls(arrays, meta)
+
+    def cells(self, group, column):
+        """
+        :return: The years holding data for a group and feature column, and the
+                 positions of their cells.
+        """
+        if group not in self.groups or tuple(column) not in self.columns:
+            return [], np.array([], dtype=np.int64)
+
+        n_years = len(self.years)
+        first = self.cell_key(self.groups[group], self.columns[tuple(column)], 0, len(self.columns), n_years)
+        start, stop = np.searchsorted(self.keys, [first, first + n_years])
+        positions = np.arange(start, stop)
+        return [self.years[int(k - first)] for k in self.keys[start:stop]], positions
+
+    def percentile_table(self, group, column, percentiles):
+        """
+        :return: A DataFrame of the given percentiles, which must be in the grid,
+                 of a feature column in each year, indexed by year, or None if
+                 the group has no data.
+        """
+        years, positions = self.cells(group, column)
+        if len(years) == 0:
+            return None
+        grid = np.searchsorted(self.grid, percentiles)
+        table = pd.DataFrame(np.asarray(self.quantiles[positions][:, grid], dtype=float),
+                             index=years, columns=percentiles)
+        table.index.name = 'year'
+        return table
+
+    def summary(self, group, column, year):
+        """
+        :return: A dict of the count, mean and quantiles of a feature column in
+                 a year, or None if the group has no data for it.
+        """
+        years, positions = self.cells(group, column)
+        if year not in years:
+            return None
+        i = positions[years.index(year)]
+        return {'count': int(self.counts[i]), 'mean': float(self.means[i]),
+                'quantiles': np.asarray(self.quantiles[i], dtype=float)}
+
+    def percentile_rank(self, group, column, year, value):
+        """
+        :return: The percentile rank of value among the reports of a group in a
+                 year, interpolated between the stored quantiles, and the number
+                 of reports, or None.
+        """
+        summary = self.summary(group, column, year)
+        if summary is None or not np.isfinite(value):
+            return None
+        return rank_in(summary['quantiles'], value, self.grid), summary['count']
+
+
+def rank_in(quantiles, value, grid=GRID):
+    """
+    :return: The percentile rank of value given the quantiles at each
+             percentile of grid. Values equal to a run of quantiles get the
+             middle of the run.
+    """
+    left = np.searchsorted(quantiles, value, side='left')
+    right = np.searchsorted(quantiles, value, side='right')
+    if left < right:
+        return float(grid[left:right].mean())
+    if left == 0:
+        return 0.0
+    if left == len(quantiles):
+        return 100.0
+
+    low, high = quantiles[left - 1], quantiles[left]
+    return float(grid[left - 1] + (value - low) / (high - low) * (grid[left] - grid[left - 1]))
+
+
+if __name__ == "__main__":
+    import app_data
+
+    path = sys.argv[1] if len(sys.argv) > 1 else DISTRIBUTIONS_PATH
+    d = FeatureDistributions.build(provider_store.default_store(), app_data.directory(),
+                                   max_workers=provider_store.default_workers())
+    d.save(path)
+    print(len(d.keys), 'distributions of', len(d.columns), 'features written to', path)
@@ -0,0 +1,229 @@
+"""
+Codecs for writing loaded cost report frames to bytes or files.
+
+The Arrow codec writes Arrow IPC (Feather v2) files, optionally compressed with
+zstd, and restores the exact column dtypes and the 4-level column MultiIndex.
+Object columns that Arrow cannot hold exactly, such as columns mixing numbers
+and strings, are pickled into the table metadata instead.
+Columns are converted to Arrow a dtype at a time from 2-D numpy arrays, and the
+column labels and row index are kept in the table metadata, since pyarrow's own
+conversion looks up each of thousands of MultiIndex columns one at a time. The
+JSON codec is the format the app used to pass frames between callbacks and is
+kept for comparison in benchmarks/bench_frame_codec.py.
+"""
+
+import io
+import json
+import pickle
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+class FrameCodec(object):
+    """
+    Interface for turning a DataFrame into bytes and back.
+    """
+    suffix = ''
+
+    def encode(self, frame):
+        raise NotImplementedError
+
+    def decode(self, data):
+        raise NotImplementedError
+
+    def write(self, frame, path):
+        with open(path, 'wb') as f:
+            f.write(self.encode(frame))
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return self.decode(f.read())
+
+
+def prepare(frame):
+    """
+    :return: A shallow copy of frame with positional column names, a dict of
+             the values of the object columns Arrow cannot hold exactly, by
+             position, which are left empty in the copy, and the positions of
+             the string columns whose missing values are NaN rather than None.
+    """
+    frame = frame.copy(deep=False)
+    frame.columns = [str(i) for i in range(frame.shape[1])]
+
+    pickled = {}
+    nan_strings = []
+    for i, dtype in enumerate(frame.dtypes):
+        if dtype != object:
+            continue
+
+        # Arrow keeps columns of strings, and turns their missing values into
+        # None; any other mix of types is pickled
+        col = frame.iloc[:, i]
+        values = col.to_numpy()
+        missing = values[pd.isna(values)]
+        if pd.api.types.infer_dtype(col, skipna=True) == 'string':
+            if all(v is None for v in missing):
+                continue
+            if all(isinstance(v, float) for v in missing):
+                nan_strings.append(i)
+                continue
+
+        pickled[i] = values
+        frame[str(i)] = pd.Series([None] * len(col), index=col.index, dtype=object)
+    return frame, pickled, nan_strings
+
+
+def to_table(frame):
+    """
+    :return: An Arrow table of frame, with its column labels and row index
+             described in the table metadata.
+    """
+    flat, pickled, nan_strings = prepare(frame)
+    dtypes = flat.dtypes.values
+
+    if flat.index.nlevels > 1 or not all(isinstance(dtype, np.dtype) for dtype in dtypes):
+        # Extension dtypes and row MultiIndexes go through pyarrow's pandas conversion
+        table = pa.Table.from_pandas(flat)
+        index = {'kind': 'pandas'}
+
+    else:
+        arrays = [None] * len(dtypes)
+        for dtype in set(dtypes):
+            positions = np.flatnonzero(dtypes == dtype)
+            values = flat.iloc[:, positions].to_numpy().T
+            for j, i in enumerate(positions):
+                arrays[i] = pa.array(values[j], from_pandas=True)
+        names = list(flat.columns)
+
+        if isinstance(flat.index, pd.RangeIndex):
+            index = {'kind': 'range', 'start': int(flat.index.start), 'stop': int(flat.index.stop),
+                     'step': int(flat.index.step), 'name': flat.index.name}
+        else:
+            arrays.append(pa.array(flat.index.values, from_pandas=True))
+            names.append('__index__')
+            index = {'kind': 'column', 'name': flat.index.name}
+        table = pa.Table.from_arrays(arrays, names=names)
+
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'columns'] = column_metadata(frame.columns)
+    metadata[b'index'] = json.dumps(index).encode('utf-8')
+    metadata[b'nan_strings'] = json.dumps(nan_strings).encode('utf-8')
+    if len(pickled) > 0:
+        metadata[b'pickled'] = pickle.dumps(pickled, protocol=pickle.HIGHEST_PROTOCOL)
+    return table.replace_schema_metadata(metadata)
+
+
+def to_frame(table):
+    """
+    :return: The DataFrame that to_table turned into table.
+    """
+    frame = table.to_pandas()
+    index = json.loads(table.schema.metadata[b'index'])
+
+    if index['kind'] == 'range':
+        frame.index = pd.RangeIndex(index['start'], index['stop'], index['step'], name=index['name'])
+    elif index['kind'] == 'column':
+        frame = frame.set_index('__index__')
+        frame.index.name = index['name']
+
+    metadata = table.schema.metadata
+    for i in json.loads(metadata.get(b'nan_strings', b'[]')):
+        col = frame.iloc[:, i]
+        frame[str(i)] = col.where(col.notna(), np.nan)
+    if b'pickled' in metadata:
+        for i, values in pickle.loads(metadata[b'pickled']).items():
+            frame[str(i)] = pd.Series(values, index=frame.index, dtype=object)
+    return restore_columns(frame, metadata[b'columns'])
+
+
+def column_metadata(columns):
+    """
+    :return: JSON bytes describing a column Index or MultiIndex.
+    """
+    if isinstance(columns, pd.MultiIndex):
+        labels = [list(c) for c in columns]
+    else:
+        labels = list(columns)
+    return json.dumps({'names': list(columns.names), 'labels': labels,
+                       'multi': isinstance(columns, pd.MultiIndex)}).encode('utf-8')
+
+
+def restore_columns(frame, metadata):
+    """
+    Put the column labels described by column_metadata back on frame.
+    """
+    meta = json.loads(metadata)
+    if meta['multi']:
+        frame.columns = pd.MultiIndex.from_tuples([tuple(c) for c in meta['labels']], names=meta['names'])
+    else:
+        frame.columns = pd.Index(meta['labels'], name=meta['names'][0])
+    return frame
+
+
+class ArrowCodec(FrameCodec):
+    """
+    Arrow IPC file format, with optional 'zstd' or 'lz4' compression.
+    """
+    suffix = '.arrow'
+
+    def __init__(self, compression=None):
+        self.compression = compression
+
+    def encode(self, frame):
+        table = to_table(frame)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_file(sink, table.schema,
+                             options=pa.ipc.IpcWriteOptions(compression=self.compression)) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    def decode(self, data):
+        return to_frame(pa.ipc.open_file(pa.BufferReader(data)).read_all())
+
+    def read(self, path):
+        # Memory map the file so uncompressed buffers are not copied on the way in
+        with pa.memory_map(path) as source:
+            return to_frame(pa.ipc.open_file(source).read_all())
+
+
+class PickleCodec(FrameCodec):
+    suffix = '.pkl'
+
+    def encode(self, frame):
+        return pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+class JSONCodec(FrameCodec):
+    """
+    DataFrame.to_json / pd.read_json. Loses dtypes and turns the column
+    MultiIndex into stringified tuples.
+    """
+    suffix = '.json'
+
+    def encode(self, frame):
+        return frame.to_json().encode('utf-8')
+
+    def decode(self, data):
+        return pd.read_json(io.BytesIO(data))
+
+
+CODECS = {
+    'arrow': ArrowCodec(),
+    'arrow-zstd': ArrowCodec('zstd'),
+    'pickle': PickleCodec(),
+    'json': JSONCodec(),
+    }
+
+
+def get_codec(name):
+    """
+    :return: The codec registered under name.
+    """
+    if name not in CODECS:
+        raise ValueError('Unknown frame codec ' + repr(name) + ', expected one of ' + ', '.join(sorted(CODECS)))
+    return CODECS[name]
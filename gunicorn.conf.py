@@ -0,0 +1,16 @@
+"""
+Gunicorn settings for the Rush Hospital Cost Reports application.
+
+Gunicorn reads this file from the working directory, so the Procfile command
+`gunicorn app:server` picks it up. The app is imported and its data assets are
+loaded once in the master process, before workers are forked, so that the
+workers share those pages instead of each loading its own copy. The number of
+workers is taken from WEB_CONCURRENCY, as set by Heroku.
+"""
+
+preload_app = True
+
+
+def when_ready(server):
+    import app
+    app.preload()
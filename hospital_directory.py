@@ -0,0 +1,209 @@
+"""
+Hospital directory used to filter the hospitals offered for selection.
+
+The bed counts, states, hospital types and control types of every hospital are
+held as NumPy arrays built once at startup: beds sorted for searchsorted, and
+the other dimensions as categorical codes. A filter is a boolean mask over the
+hospitals, so the options can follow the bed slider as it moves.
+
+Metadata records for each hospital, found by curated name or provider number,
+hold the color and label its plot traces use. Colors are derived from a hash of
+the name, so a hospital keeps its color across workers and restarts.
+
+A directory can be saved as a directory of .npy files holding only the columns
+the app uses. Loaded with memory-mapping before gunicorn forks its workers,
+its pages are shared by all workers instead of each holding its own copy of
+the general data.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+RUSH_COLOR = '#167e04'
+
+ARRAYS = ['name_blob', 'name_offsets', 'name_codes', 'prvdrs', 'beds', 'state_codes', 'htype_codes', 'ctype_codes']
+
+
+def hospital_color(name):
+    """
+    :return: The trace color of a hospital: Rush green for Rush University
+             Medical Center, otherwise a color derived from its name.
+    """
+    if 'RUSH UNIVERSITY' in name:
+        return RUSH_COLOR
+    return '#' + hashlib.md5(name.encode('utf-8')).hexdigest()[:6]
+
+
+def display_label(name):
+    """
+    :return: The name shortened for plot legends.
+    """
+    if len(name) > 30:
+        return name[0:20] + ' ... ' + name[-8:]
+    return name
+
+
+def hospital_record(name, prvdr=None, state=None, htype=None, ctype=None):
+    return {'name': name, 'prvdr': prvdr, 'state': state, 'htype': htype, 'ctype': ctype,
+            'color': hospital_color(name), 'label': display_label(name)}
+
+
+class HospitalDirectory(object):
+    """
+    Filterable arrays of the hospitals in the app's general data.
+
+    Per-hospital values are held in NumPy arrays: name and category codes,
+    provider numbers as bytes and beds as float32. A directory saved with save()
+    is loaded with its arrays memory-mapped, so gunicorn workers share them.
+    """
+
+    def __init__(self, arrays, categories):
+        self.arrays = arrays
+        self.categories = categories
+
+        blob, offsets = arrays['name_blob'], arrays['name_offsets']
+        self.names = [bytes(blob[offsets[i]:offsets[i + 1]]).decode('utf-8') for i in range(len(offsets) - 1)]
+
+        self.name_codes = arrays['name_codes']
+        self.prvdrs = arrays['prvdrs']
+        self.beds = arrays['beds']
+        self.state_codes = arrays['state_codes']
+        self.htype_codes = arrays['htype_codes']
+        self.ctype_codes = arrays['ctype_codes']
+
+        # First row of each name, for its metadata record
+        codes, rows = np.unique(self.name_codes, return_index=True)
+        self.first_row = np.zeros(len(self.names), dtype=np.int64)
+        self.first_row[codes] = rows
+
+        # NaN bed counts sort last, beyond the reach of any finite bound
+        self.bed_order = np.argsort(self.beds, kind='stable')
+        self.sorted_beds = self.beds[self.bed_order]
+
+    @classmethod
+    def from_lists(cls, names, prvdrs, beds, states, htypes, ctypes):
+        """
+        :return: A HospitalDirectory of per-hospital lists.
+        """
+        names = pd.Categorical(names)
+        encoded = [n.encode('utf-8') for n in names.categories]
+        arrays = {'name_blob': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                  'name_offsets': np.cumsum([0] + [len(n) for n in encoded]).astype(np.int64),
+                  'name_codes': names.codes.astype(np.int32),
+                  'prvdrs': np.array([str(p).encode('utf-8') for p in prvdrs]),
+                  'beds': np.asarray(beds, dtype=np.float32),
+                  }
+
+        categories = {}
+        for key, values in [('states', states), ('htypes', htypes), ('ctypes', ctypes)]:
+            values = pd.Categorical(values)
+            categories[key] = [str(c) for c in values.categories]
+            arrays[key[:-1] + '_codes'] = values.codes.astype(np.int16)
+        return cls(arrays, categories)
+
+    def save(self, path):
+        """
+        Write the directory as .npy files and a JSON file of categories in the directory path.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for key, values in self.arrays.items():
+            np.save(os.path.join(path, key + '.npy'), np.asarray(values))
+        with open(os.path.join(path, 'categories.json'), 'w') as f:
+            json.dump(self.categories, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :return: The directory saved in path, with its arrays memory-mapped.
+        """
+        with open(os.path.join(path, 'categories.json')) as f:
+            categories = json.load(f)
+        arrays = {key: np.load(os.path.join(path, key + '.npy'), mmap_mode='r') for key in ARRAYS}
+        return cls(arrays, categories)
+
+    def record(self, row):
+        name = self.names[self.name_codes[row]]
+        return hospital_record(name, self.prvdrs[row].decode('utf-8'),
+                               self.category(self.state_codes[row], 'states'),
+                               self.category(self.htype_codes[row], 'htypes'),
+                               self.category(self.ctype_codes[row], 'ctypes'))
+
+    def category(self, code, key):
+        if code < 0:
+            return None
+        return self.categories[key][code]
+
+    def hospital(self, name):
+        """
+        :return: The metadata record of a hospital, by curated name. Hospitals
+                 missing from the directory get a record with only a color and label.
+        """
+        i = bisect.bisect_left(self.names, name)
+        if i < len(self.names) and self.names[i] == name:
+            return self.record(self.first_row[i])
+        return hospital_record(name)
+
+    def provider(self, prvdr):
+        """
+        :return: The metadata record of a hospital, by provider number, or None.
+        """
+        rows = np.flatnonzero(self.prvdrs == str(prvdr).encode('utf-8'))
+        if len(rows) == 0:
+            return None
+        return self.hospital(self.names[self.name_codes[rows[0]]])
+
+    def bed_mask(self, low, high):
+        """
+        :return: A mask of the hospitals with low <= beds <= high. A lower
+                 bound of 1 keeps every hospital, including those without a
+                 bed count.
+        """
+        if low == 1:
+            return np.ones(len(self.beds), dtype=bool)
+
+        start = np.searchsorted(self.sorted_beds, low, side='left')
+        stop = np.searchsorted(self.sorted_beds, high, side='right')
+        mask = np.zeros(len(self.beds), dtype=bool)
+        mask[self.bed_order[start:stop]] = True
+        return mask
+
+    def category_mask(self, codes, allowed):
+        """
+        :return: A mask of the hospitals whose category code is set in allowed,
+                 a boolean array over the categories.
+        """
+        allowed = np.append(np.asarray(allowed, dtype=bool), False)
+        # Code -1 (missing) indexes the appended False
+        return allowed[codes]
+
+    def mask(self, bed_range, states, htypes, ctypes):
+        """
+        :return: A mask of the hospitals that pass every filter. Hospital types
+                 match as substrings.
+        """
+        states = states or []
+        htypes = htypes or []
+        ctypes = ctypes or []
+
+        low, high = bed_range
+        mask = self.bed_mask(low, high)
+        mask &= self.category_mask(self.state_codes, [c in states for c in self.categories['states']])
+        mask &= self.category_mask(self.ctype_codes, [c in ctypes for c in self.categories['ctypes']])
+        mask &= self.category_mask(self.htype_codes, [any(v in c for v in htypes)
+                                                      for c in self.categories['htypes']])
+        return mask
+
+    def filter(self, bed_range, states, htypes, ctypes):
+        """
+        :return: Dropdown options for the hospitals that pass every filter,
+                 sorted by name.
+        """
+        mask = self.mask(bed_range, states, htypes, ctypes)
+        return [{"label": self.names[i], "value": self.names[i]} for i in np.unique(self.name_codes[mask])]
@@ -0,0 +1,229 @@
+"""
+Nearest peers of a hospital by size, volume, finances, type and state.
+
+Hospitals are compared in each Beginning FFY by a vector of a few key
+features: beds, discharges, gross and net patient revenue and operating
+expense, each log-scaled and standardized over the hospitals reporting that
+year, with missing features at the year's mean. One-hot codes of the hospital
+type and state are appended, scaled so that a hospital of another type or
+state is as far as one standard deviation of one feature.
+
+An offline build reads every provider file once and writes the vectors of all
+hospitals and years as .npy files, sorted by year. The app memory-maps them and
+builds a k-d tree (scipy.spatial.cKDTree) over each year on first use, which
+takes milliseconds; the nearest peers of a hospital are then found by querying
+the tree of its latest year. To build the vectors, run:
+
+    python peer_finder.py [OUTPUT_DIR]
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import warnings
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import feature_distributions
+import provider_store
+
+
+PEERS_PATH = 'dataframe_data/peer_finder'
+
+FEATURES = [('S3_1_C2_27', 'Total Facility', 'NUMBER OF BEDS', 'Total Facility (S3_1_C2_27)'),
+            ('S3_1_C15_14', 'Total discharges', 'Total Inpatient Days/Outpatient Visits',
+             'Total discharges (S3_1_C15_14)'),
+            ('G3_C1_1', 'Gross Revenue', 'STATEMENT OF REVENUES AND EXPENSES', 'Gross Revenue (G3_C1_1)'),
+            ('G3_C1_3', 'Net Patient Revenue', 'STATEMENT OF REVENUES AND EXPENSES', 'Net Patient Revenue (G3_C1_3)'),
+            ('G3_C1_4', 'Total Operating Expense', 'STATEMENT OF REVENUES AND EXPENSES',
+             'Total Operating Expense (G3_C1_4)'),
+            ]
+
+# Distance between hospitals of different types, or states, in standard
+# deviations of one feature
+CATEGORY_WEIGHT = 1.0
+
+ARRAYS = ['years', 'providers', 'vectors']
+
+
+def feature_vectors(sums, counts):
+    """
+    :return: The standardized log-scaled features of a (rows, features) array
+             of sums of values and their counts, with missing features at 0.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        # Features that no hospital reports in a year are all missing
+        warnings.simplefilter('ignore', RuntimeWarning)
+        values = sums / counts
+        values = np.sign(values) * np.log1p(np.abs(values))
+        mean = np.nan_to_num(np.nanmean(values, axis=0))
+        std = np.nanstd(values, axis=0)
+
+    std = np.where(np.isfinite(std) & (std > 0), std, 1)
+    return np.nan_to_num((values - mean) / std)
+
+
+def one_hot(codes, n, weight=CATEGORY_WEIGHT):
+    """
+    :return: An array of one-hot rows of category codes, scaled so that rows
+             of different codes are weight apart. Unknown codes are all zero.
+    """
+    hot = np.zeros((len(codes), n), dtype=np.float32)
+    known = codes >= 0
+    hot[np.flatnonzero(known), codes[known]] = weight / np.sqrt(2)
+    return hot
+
+
+class PeerFinder(object):
+    """
+    Feature vectors of every hospital by Beginning FFY, searched with a k-d
+    tree per year.
+    """
+
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        self.version = meta['built']
+
+        self.prvdrs = meta['prvdrs']
+        self.names = meta['names']
+        self.positions = {prvdr: i for i, prvdr in enumerate(self.prvdrs)}
+
+        self.years = arrays['years']
+        self.providers = arrays['providers']
+        self.vectors = arrays['vectors']
+
+        self._trees = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, store, directory, max_workers=16, retries=2, batch_size=64):
+        """
+        :return: The PeerFinder of the reports of every provider in the
+                 hospital directory, read from store.
+        """
+        prvdrs, codes = feature_distributions.provider_codes(directory)
+        features, years, providers, values = feature_distributions.report_values(store, prvdrs, FEATURES, max_workers,
+                                                                                 retries, batch_size)
+
+        # Mean of each feature over the reports of a provider in a year
+        year_list = sorted(int(y) for y in np.unique(years))
+        rows, row_codes = np.unique(np.stack([np.searchsorted(year_list, years), providers], axis=1), axis=0,
+                                    return_inverse=True)
+        cells = row_codes.ravel() * len(FEATURES) + features
+        size = len(rows) * len(FEATURES)
+        sums = np.bincount(cells, weights=values, minlength=size).reshape(len(rows), len(FEATURES))
+        counts = np.bincount(cells, minlength=size).reshape(len(rows), len(FEATURES))
+
+        parts = []
+        for y in range(len(year_list)):
+            in_year = rows[:, 0] == y
+            year_codes = codes[rows[in_year, 1]]
+            parts.append(np.hstack([feature_vectors(sums[in_year], counts[in_year]),
+                                    one_hot(year_codes[:, 1], len(directory.categories['htypes'])),
+                                    one_hot(year_codes[:, 0], len(directory.categories['states']))]))
+
+        # Each provider is named by the first row of its number in the directory
+        first = {}
+        for row, prvdr in enumerate(directory.prvdrs):
+            first.setdefault(prvdr.decode('utf-8'), directory.names[directory.name_codes[row]])
+        names = [first[prvdr] for prvdr in prvdrs]
+
+        arrays = {'years': np.asarray(year_list, dtype=np.int32)[rows[:, 0]],
+                  'providers': rows[:, 1].astype(np.int32),
+                  'vectors': np.vstack(parts).astype(np.float32)}
+        meta = {'prvdrs': prvdrs, 'names': names, 'features': [list(c) for c in FEATURES],
+                'built': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        return cls(arrays, meta)
+
+    def save(self, path):
+        """
+        Write the vectors as .npy files and a JSON file of their providers in
+        the directory path.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for key, values in self.arrays.items():
+            np.save(os.path.join(path, key + '.npy'), np.asarray(values))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :return: The PeerFinder saved in path, with its arrays memory-mapped.
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {key: np.load(os.path.join(path, key + '.npy'), mmap_mode='r') for key in ARRAYS}
+        return cls(arrays, meta)
+
+    def year_rows(self, year):
+        """
+        :return: The first and last row, plus one, of the vectors of a year.
+        """
+        start, stop = np.searchsorted(self.years, [year, year + 1])
+        return int(start), int(stop)
+
+    def tree(self, year):
+        """
+        :return: The k-d tree of the vectors of a year, built on first use.
+        """
+        with self._lock:
+            if year not in self._trees:
+                start, stop = self.year_rows(year)
+                self._trees[year] = cKDTree(np.asarray(self.vectors[start:stop], dtype=float))
+            return self._trees[year]
+
+    def latest_year(self, prvdr):
+        """
+        :return: The latest Beginning FFY with a vector of a provider, or None.
+        """
+        rows = np.flatnonzero(np.asarray(self.providers) == self.positions.get(prvdr, -1))
+        if len(rows) == 0:
+            return None
+        return int(self.years[rows[-1]])
+
+    def nearest(self, prvdr, k, allowed=None, year=None):
+        """
+        :return: The Beginning FFY searched, by default the provider's latest,
+                 and the names of the k hospitals nearest to the provider in
+                 it, nearest first, among the names in allowed if given. None
+                 if the provider has no vector in that year.
+        """
+        year = self.latest_year(prvdr) if year is None else year
+        if year is None:
+            return None
+
+        start, stop = self.year_rows(year)
+        focal = np.flatnonzero(np.asarray(self.providers[start:stop]) == self.positions.get(prvdr, -1))
+        if len(focal) == 0:
+            return None
+
+        tree = self.tree(year)
+        n = stop - start
+        query = min(n, 2 * k + 1)
+        while True:
+            distances, rows = tree.query(np.asarray(self.vectors[start + focal[0]], dtype=float), k=query)
+            rows = np.atleast_1d(rows)
+            names = [self.names[self.providers[start + i]] for i in rows if i != focal[0] and i < n]
+            if allowed is not None:
+                names = [name for name in names if name in allowed]
+
+            # Search further when too many of the nearest are filtered out
+            if len(names) >= k or query == n:
+                return year, names[:k]
+            query = min(n, 4 * query)
+
+
+if __name__ == "__main__":
+    import app_data
+
+    path = sys.argv[1] if len(sys.argv) > 1 else PEERS_PATH
+    p = PeerFinder.build(provider_store.default_store(), app_data.directory(),
+                         max_workers=provider_store.default_workers())
+    p.save(path)
+    print(len(p.vectors), 'vectors of', len(p.prvdrs), 'providers written to', path)
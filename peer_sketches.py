@@ -0,0 +1,344 @@
+"""
+Mergeable quantile sketches of every feature for the peer groups of the
+hospital filters.
+
+The state, hospital type and control type filters of the hospital selection
+panel can be combined in thousands of ways, so their peer groups cannot each
+have a precomputed distribution (see feature_distributions.py). Instead, the
+reports are split into cells by state, hospital type, control type, Beginning
+FFY and feature, and each cell keeps a KLL sketch of its values. A sketch holds
+at most a few times k values, each standing for 2**level reports, and the
+sketches of any set of cells merge into a sketch of their union with the same
+bounded size and rank error, about 1.7% of the reports for k = 200. The peers
+of any combination of filters are answered by merging the sketches of the
+cells that pass them.
+
+Most cells hold the reports of a few hospitals and keep their values exactly.
+The sketches are stored as one pool of values and levels, with the offsets of
+each cell's values, sorted by a key of feature, year and cell, so that the
+cells of a feature are contiguous. To build them from the provider store the
+app reads from, run:
+
+    python peer_sketches.py [OUTPUT_DIR]
+
+Bed counts are not a dimension of the cells, so the bed range filter does not
+narrow the peer groups.
+"""
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import feature_distributions
+import provider_store
+
+
+SKETCHES_PATH = 'dataframe_data/peer_sketches'
+
+K = 200
+
+ARRAYS = ['keys', 'offsets', 'items', 'levels']
+
+# Comparison of the feature-over-time panel answered by the sketches
+COMPARISON = 'Peers matching the filters'
+
+
+class KLLSketch(object):
+    """
+    A KLL quantile sketch: compactors of values at levels whose values each
+    stand for 2**level values of the stream.
+    """
+
+    def __init__(self, k=K, seed=0):
+        self.k = k
+        self.compactors = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_levels(cls, items, levels, k=K, seed=0):
+        """
+        :return: The sketch holding items at the given levels.
+        """
+        sketch = cls(k, seed)
+        levels = np.asarray(levels)
+        sketch.compactors = [np.asarray(items)[levels == h] for h in range(int(levels.max(initial=0)) + 1)]
+        return sketch
+
+    def capacity(self, level):
+        # Lower levels hold geometrically fewer values than the top level
+        depth = len(self.compactors) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values):
+        """
+        Add an array of values to the sketch.
+        """
+        self.compactors[0] = np.concatenate([self.compactors[0], np.asarray(values, dtype=float)])
+        self.compress()
+
+    def merge(self, other):
+        """
+        Add the values of another sketch to this one.
+        """
+        for h, items in enumerate(other.compactors):
+            if h == len(self.compactors):
+                self.compactors.append(np.empty(0))
+            self.compactors[h] = np.concatenate([self.compactors[h], items])
+        self.compress()
+
+    def compress(self):
+        """
+        Compact every level holding more values than its capacity: of its
+        sorted values, every other one, from a random start, moves up a level.
+        """
+        h = 0
+        while h < len(self.compactors):
+            items = self.compactors[h]
+            if len(items) > self.capacity(h):
+                if h + 1 == len(self.compactors):
+                    self.compactors.append(np.empty(0))
+
+                items = np.sort(items)
+                pairs = len(items) // 2
+                offset = self.rng.integers(2)
+                self.compactors[h + 1] = np.concatenate([self.compactors[h + 1], items[offset:2 * pairs:2]])
+                self.compactors[h] = items[2 * pairs:]
+            h += 1
+
+    def items(self):
+        """
+        :return: The values of the sketch and their levels.
+        """
+        levels = np.concatenate([np.full(len(c), h, dtype=np.uint8) for h, c in enumerate(self.compactors)])
+        return np.concatenate(self.compactors), levels
+
+    def weighted(self):
+        """
+        :return: The sorted values of the sketch, their weights, and the
+                 percentile rank of each value.
+        """
+        items, levels = self.items()
+        order = np.argsort(items, kind='stable')
+        items = items[order]
+        weights = 2.0 ** levels[order]
+
+        # Each value stands at the middle of the ranks it covers; with unit
+        # weights these are the positions numpy.percentile interpolates between
+        total = weights.sum()
+        below = np.cumsum(weights) - weights
+        ranks = 100 * (below + (weights - 1) / 2) / max(total - 1, 1)
+        return items, weights, ranks
+
+    def count(self):
+        items, levels = self.items()
+        return int(np.sum(2 ** levels.astype(np.int64)))
+
+    def quantiles(self, percentiles):
+        """
+        :return: The estimated quantiles of the sketch at the given percentiles.
+        """
+        items, weights, ranks = self.weighted()
+        if len(items) == 0:
+            return np.full(len(percentiles), np.nan)
+        return np.interp(percentiles, ranks, items)
+
+    def rank(self, value):
+        """
+        :return: The estimated percentile rank of value.
+        """
+        items, weights, ranks = self.weighted()
+        if len(items) == 0:
+            return None
+        return feature_distributions.rank_in(items, value, ranks)
+
+
+def build_cells(keys, values, k=K, seed=0):
+    """
+    :return: The distinct keys, the offsets of the values of each key's sketch
+             in the pool, and the pool of values and their levels. Keys with at
+             most k values keep them all at level 0.
+    """
+    order = np.lexsort((values, keys))
+    keys = keys[order]
+    values = values[order]
+
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+
+    # Cells are concatenated in key order: runs of small cells as they are,
+    # large cells as their sketches
+    items, levels, sizes = [], [], counts.copy()
+    done = 0
+    for i in np.flatnonzero(counts > k):
+        items.append(values[done:starts[i]])
+        levels.append(np.zeros(starts[i] - done, dtype=np.uint8))
+
+        sketch = KLLSketch(k, seed + int(i))
+        sketch.update(values[starts[i]:starts[i] + counts[i]])
+        cell_items, cell_levels = sketch.items()
+        items.append(cell_items)
+        levels.append(cell_levels)
+        sizes[i] = len(cell_items)
+        done = starts[i] + counts[i]
+    items.append(values[done:])
+    levels.append(np.zeros(len(values) - done, dtype=np.uint8))
+
+    offsets = np.r_[0, np.cumsum(sizes)].astype(np.int64)
+    return keys[starts], offsets, np.concatenate(items).astype(np.float32), np.concatenate(levels)
+
+
+class PeerSketches(object):
+    """
+    KLL sketches of each feature by state, hospital type, control type and
+    fiscal year, merged into the peer groups of the hospital filters.
+    """
+
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        self.version = meta['built']
+        self.k = meta['k']
+
+        self.columns = {tuple(c): i for i, c in enumerate(meta['columns'])}
+        self.cells = meta['cells']
+        self.years = meta['years']
+
+        self.keys = arrays['keys']
+        self.offsets = arrays['offsets']
+        self.items = arrays['items']
+        self.levels = arrays['levels']
+
+    @classmethod
+    def build(cls, store, directory, k=K, max_workers=16, retries=2, batch_size=64):
+        """
+        :return: The PeerSketches of the reports of every provider in the
+                 hospital directory, read from store.
+        """
+        columns = feature_distributions.numeric_columns()
+        prvdrs, codes = feature_distributions.provider_codes(directory)
+        features, years, providers, values = feature_distributions.report_values(store, prvdrs, columns, max_workers,
+                                                                                 retries, batch_size)
+
+        # Cells of the combinations of categories that hospitals have; hospitals
+        # missing a category belong to no cell
+        known = np.all(codes[providers] >= 0, axis=1)
+        combos, cell_codes = np.unique(codes[providers[known]], axis=0, return_inverse=True)
+        cells = [[directory.categories['states'][s], directory.categories['htypes'][h],
+                  directory.categories['ctypes'][c]] for s, h, c in combos]
+
+        year_list = sorted(int(y) for y in np.unique(years))
+        year_codes = np.searchsorted(year_list, years[known])
+
+        keys = cls.cell_key(features[known], year_codes, cell_codes.ravel(), len(year_list), len(cells))
+        keys, offsets, items, levels = build_cells(keys, values[known], k)
+
+        arrays = {'keys': keys, 'offsets': offsets, 'items': items, 'levels': levels}
+        meta = {'columns': [list(c) for c in columns], 'cells': cells, 'years': year_list, 'k': k,
+                'built': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        return cls(arrays, meta)
+
+    @staticmethod
+    def cell_key(feature, year, cell, n_years, n_cells):
+        return (np.asarray(feature, dtype=np.int64) * n_years + year) * n_cells + cell
+
+    def save(self, path):
+        """
+        Write the sketches as .npy files and a JSON file of their columns,
+        cells and years in the directory path.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for key, values in self.arrays.items():
+            np.save(os.path.join(path, key + '.npy'), np.asarray(values))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :return: The sketches saved in path, with their arrays memory-mapped.
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {key: np.load(os.path.join(path, key + '.npy'), mmap_mode='r') for key in ARRAYS}
+        return cls(arrays, meta)
+
+    def cell_mask(self, states, htypes, ctypes):
+        """
+        :return: A mask of the cells passing the state, hospital type and
+                 control type filters, matched as HospitalDirectory.mask does.
+        """
+        states = set(states or [])
+        ctypes = set(ctypes or [])
+        htypes = htypes or []
+        return np.array([s in states and c in ctypes and any(v in h for v in htypes)
+                         for s, h, c in self.cells], dtype=bool)
+
+    def merged(self, mask, column):
+        """
+        :return: A dict of the KLLSketch of the cells in mask for each year
+                 holding data for a feature column.
+        """
+        if tuple(column) not in self.columns or not np.any(mask):
+            return {}
+
+        n_years, n_cells = len(self.years), len(self.cells)
+        first = self.cell_key(self.columns[tuple(column)], 0, 0, n_years, n_cells)
+        start, stop = np.searchsorted(self.keys, [first, first + n_years * n_cells])
+
+        keys = np.asarray(self.keys[start:stop]) - first
+        chosen = np.flatnonzero(mask[keys % n_cells])
+        years = keys[chosen] // n_cells
+
+        # Rows of the pool holding the values of every chosen cell, in order
+        low = np.asarray(self.offsets[start + chosen])
+        sizes = np.asarray(self.offsets[start + chosen + 1]) - low
+        rows = np.repeat(low - (np.cumsum(sizes) - sizes), sizes) + np.arange(sizes.sum())
+        row_years = np.repeat(years, sizes)
+
+        sketches = {}
+        for y in np.unique(years):
+            year_rows = rows[row_years == y]
+            sketch = KLLSketch.from_levels(np.asarray(self.items[year_rows], dtype=float), self.levels[year_rows],
+                                           self.k)
+            # Unions of many cells are compacted back to the size of one sketch
+            sketch.compress()
+            sketches[self.years[int(y)]] = sketch
+        return sketches
+
+    def percentile_table(self, mask, column, percentiles, sketches=None):
+        """
+        :return: A DataFrame of the estimated percentiles of a feature column
+                 over the cells in mask in each year, indexed by year, or None.
+        """
+        sketches = sketches if sketches is not None else self.merged(mask, column)
+        if len(sketches) == 0:
+            return None
+        years = sorted(sketches)
+        table = pd.DataFrame([sketches[y].quantiles(percentiles) for y in years], index=years, columns=percentiles)
+        table.index.name = 'year'
+        return table
+
+    def percentile_rank(self, mask, column, year, value, sketches=None):
+        """
+        :return: The estimated percentile rank of value among the reports of the
+                 cells in mask in a year, and the number of reports, or None.
+        """
+        sketches = sketches if sketches is not None else self.merged(mask, column)
+        if year not in sketches or not np.isfinite(value):
+            return None
+        return sketches[year].rank(value), sketches[year].count()
+
+
+if __name__ == "__main__":
+    import app_data
+
+    path = sys.argv[1] if len(sys.argv) > 1 else SKETCHES_PATH
+    s = PeerSketches.build(provider_store.default_store(), app_data.directory(),
+                           max_workers=provider_store.default_workers())
+    s.save(path)
+    print(len(s.keys), 'sketches of', len(s.columns), 'features written to', path)
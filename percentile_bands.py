@@ -0,0 +1,107 @@
+"""
+Percentile band summaries of the line plots (plots 1 and 3).
+
+With more than a few dozen hospitals, a line per hospital cannot be told apart
+and makes the figure large. The summary mode draws the distribution of the
+hospitals other than the focal hospital instead: the 10th, 25th, 50th, 75th
+and 90th percentiles of each fiscal year, computed for all years in one
+groupby, as two shaded bands and a median line. The focal hospital and,
+optionally, the hospitals lying furthest outside the 10th to 90th percentile
+band keep lines of their own, so a figure has a fixed number of traces
+however many hospitals are loaded.
+"""
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+
+PERCENTILES = [10, 25, 50, 75, 90]
+
+MODES = ['All hospitals', 'Percentile bands', 'Percentile bands and outliers']
+
+
+def percentile_table(years, values):
+    """
+    :return: A DataFrame of the percentiles of the finite values of each year,
+             indexed by year, with a column for each of PERCENTILES.
+    """
+    frame = pd.DataFrame({'year': np.asarray(years), 'value': np.asarray(values, dtype=float)})
+    frame = frame[np.isfinite(frame['value'].values)]
+    if frame.shape[0] == 0:
+        return pd.DataFrame(columns=PERCENTILES, dtype=float)
+
+    table = frame.groupby('year')['value'].quantile([p / 100 for p in PERCENTILES]).unstack()
+    table.columns = PERCENTILES
+    return table.sort_index()
+
+
+def outliers(names, years, values, table, n):
+    """
+    :return: The names of up to n hospitals lying furthest outside the 10th to
+             90th percentile band in any year, measured in interquartile ranges
+             of that year, furthest first.
+    """
+    if n <= 0 or table.shape[0] == 0:
+        return []
+
+    values = np.asarray(values, dtype=float)
+    finite = np.isfinite(values)
+    names = np.asarray(names)[finite]
+    values = values[finite]
+
+    bands = table.reindex(np.asarray(years)[finite]).to_numpy()
+    iqr = bands[:, 3] - bands[:, 1]
+    outside = np.maximum(np.maximum(values - bands[:, 4], bands[:, 0] - values), 0)
+    score = outside / np.where(iqr > 0, iqr, 1)
+
+    score = pd.Series(score, index=names).groupby(level=0).max()
+    score = score[score > 0].sort_values(ascending=False, kind='mergesort')
+    return list(score.index[:n])
+
+
+def band_traces(table, color='#3399ff', name='hospitals'):
+    """
+    :return: Traces of the 10th to 90th and 25th to 75th percentile bands of a
+             percentile_table, and of its median, in a hex color.
+    """
+    years = table.index.values
+    red, green, blue = (int(color[i:i + 2], 16) for i in (1, 3, 5))
+    fill = ['rgba(%d, %d, %d, %s)' % (red, green, blue, alpha) for alpha in (0.15, 0.35)]
+
+    traces = []
+    for (low, high), shade in zip([(10, 90), (25, 75)], fill):
+        label = str(low) + 'th to ' + str(high) + 'th percentile of ' + name
+        traces.append(go.Scatter(
+                        x=years,
+                        y=table[low].values,
+                        mode='lines',
+                        line=dict(width=0, color=color),
+                        legendgroup=label,
+                        showlegend=False,
+                        hovertemplate=str(low) + 'th percentile: %{y}<extra></extra>',
+                        )
+                    )
+        traces.append(go.Scatter(
+                        x=years,
+                        y=table[high].values,
+                        name=label,
+                        mode='lines',
+                        line=dict(width=0, color=color),
+                        fill='tonexty',
+                        fillcolor=shade,
+                        legendgroup=label,
+                        hovertemplate=str(high) + 'th percentile: %{y}<extra></extra>',
+                        )
+                    )
+
+    traces.append(go.Scatter(
+                    x=years,
+                    y=table[50].values,
+                    name='Median of ' + name,
+                    mode='lines',
+                    line=dict(width=2, color=color, dash='dash'),
+                    hovertemplate='Median: %{y}<extra></extra>',
+                    )
+                )
+    return traces
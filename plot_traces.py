@@ -0,0 +1,107 @@
+"""
+Packed WebGL traces for plots of large hospital selections.
+
+The plots draw one trace per hospital, which is what the legend and the
+colors of small selections need, but with hundreds of hospitals the figure
+JSON grows with every trace's attributes and the browser lays out and animates
+each SVG trace in turn. Above a number of hospitals, the plot callbacks pack
+the hospitals into a single Scattergl trace instead: each hospital's points
+keep their own marker color and hover text through per-point arrays, and for
+line plots each hospital's line is cut from the next by a NaN gap. The focal
+hospital keeps a trace of its own, drawn last so that it stays on top.
+"""
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+
+class Series(object):
+    """
+    The points of one hospital: its label, color, x and y values and hover text.
+    """
+
+    def __init__(self, label, color, x, y, text, focal=False):
+        self.label = label
+        self.color = color
+        self.x = numeric(x)
+        self.y = numeric(y)
+        self.text = list(text)
+        self.focal = focal
+
+
+def numeric(values):
+    """
+    :return: A float array of values, with NaN for text that is not a number.
+    """
+    return pd.to_numeric(pd.Series(np.asarray(values, dtype=object).ravel()), errors='coerce').to_numpy(dtype=float)
+
+
+def hover_text(label, dates):
+    """
+    :return: Hover text of label and each date, as the plots write it.
+    """
+    return [label + '<br>' + str(d) for d in dates]
+
+
+def pack(series, gaps):
+    """
+    :return: The x, y, text and marker colors of a list of Series joined into
+             single arrays, with a NaN point between hospitals if gaps is True.
+    """
+    xs, ys, text, colors = [], [], [], []
+    for i, s in enumerate(series):
+        if gaps and i > 0:
+            xs.append([np.nan])
+            ys.append([np.nan])
+            text.append('')
+            colors.append(s.color)
+        xs.append(s.x)
+        ys.append(s.y)
+        text.extend(s.text)
+        colors.extend([s.color] * len(s.x))
+
+    if len(xs) == 0:
+        return np.array([]), np.array([]), text, colors
+    return np.concatenate(xs), np.concatenate(ys), text, colors
+
+
+def packed_traces(series, mode, line_color='#cccccc'):
+    """
+    :return: Scattergl traces of a list of Series: one for the hospitals other
+             than the focal hospital, then one for the focal hospital, if any.
+    """
+    others = [s for s in series if not s.focal]
+    focal = [s for s in series if s.focal]
+    lines = 'lines' in mode
+
+    traces = []
+    if len(others) > 0:
+        x, y, text, colors = pack(others, lines)
+        name = 'Other hospitals' if len(focal) > 0 else 'Hospitals'
+        traces.append(go.Scattergl(
+                        x=x,
+                        y=y,
+                        name=name + ' (' + str(len(others)) + ')',
+                        mode=mode,
+                        marker=dict(color=colors),
+                        line=dict(color=line_color, width=1),
+                        text=text,
+                        hovertemplate='%{text}<br>%{x}, %{y}<extra></extra>',
+                        connectgaps=False,
+                        )
+                    )
+
+    for s in focal:
+        traces.append(go.Scattergl(
+                        x=s.x,
+                        y=s.y,
+                        name=s.label,
+                        mode=mode,
+                        marker=dict(color=s.color),
+                        line=dict(color=s.color),
+                        text=s.text,
+                        hovertemplate='%{text}<br>%{x}, %{y}<extra></extra>',
+                        )
+                    )
+    return traces
@@ -0,0 +1,239 @@
+"""
+Provider data stores for the Rush Hospital Cost Reports application.
+
+Cost reports are kept one file per provider (CMS certification number), each
+holding every fiscal year for that provider under a 4-level column header. A
+store hands those files to the app as DataFrames, either from Parquet files on
+local disk or from an HTTP mirror such as the HCRIS-databuilder repository.
+
+To build a local store from a directory of provider CSV files, run:
+
+    python provider_store.py path/to/provider_data_csv provider_data
+"""
+
+import io
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+GITHUB_URL = 'https://raw.githubusercontent.com/klocey/HCRIS-databuilder/master/provider_data/'
+
+
+def read_frame(path_or_buf, suffix, header_only=False):
+    """
+    :return: A cost report DataFrame parsed from a CSV or Parquet file, with no
+             rows if header_only is True.
+    """
+    if suffix == '.parquet':
+        # ParquetFile skips the dataset layer of pq.read_table, which is slow for
+        # files with thousands of columns
+        f = pq.ParquetFile(path_or_buf)
+        if header_only:
+            return f.schema_arrow.empty_table().to_pandas()
+        return f.read().to_pandas()
+    
+    frame = pd.read_csv(path_or_buf, header=[0,1,2,3], index_col=[0], nrows=0 if header_only else None)
+    
+    # Blank header cells are read as 'Unnamed: ...'; keep them blank, as in the schema manifest
+    frame.columns = pd.MultiIndex.from_tuples([tuple('' if l.startswith('Unnamed: ') else l for l in c) 
+                                               for c in frame.columns])
+    return frame
+
+
+def write_frame(frame, path):
+    """
+    Write a cost report DataFrame to a Parquet file, keeping its 4-level columns.
+    """
+    pq.write_table(pa.Table.from_pandas(frame), path)
+
+
+class ProviderStore(object):
+    """
+    Interface for reading the cost reports of a single provider.
+    """
+
+    def source(self, prvdr):
+        """
+        :return: A string naming where the reports for prvdr are read from.
+        """
+        raise NotImplementedError
+
+    def read(self, prvdr):
+        """
+        :return: A DataFrame of cost reports for prvdr.
+        """
+        raise NotImplementedError
+
+    def read_header(self, prvdr):
+        """
+        :return: A DataFrame with the columns of the reports for prvdr and no rows.
+        """
+        return self.read(prvdr).iloc[:0]
+
+
+class LocalProviderStore(ProviderStore):
+    """
+    Provider reports kept as <PRVDR>.parquet files in a local directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def source(self, prvdr):
+        return os.path.join(self.directory, prvdr + '.parquet')
+
+    def read(self, prvdr):
+        return read_frame(self.source(prvdr), '.parquet')
+
+    def read_header(self, prvdr):
+        return read_frame(self.source(prvdr), '.parquet', header_only=True)
+
+
+class HTTPProviderStore(ProviderStore):
+    """
+    Provider reports served as <PRVDR><suffix> files under a base URL.
+    """
+
+    def __init__(self, base_url=GITHUB_URL, suffix='.csv', timeout=30):
+        if not base_url.endswith('/'):
+            base_url = base_url + '/'
+        self.base_url = base_url
+        self.suffix = suffix
+        self.timeout = timeout
+
+    def source(self, prvdr):
+        return self.base_url + prvdr + self.suffix
+
+    def read(self, prvdr):
+        with urllib.request.urlopen(self.source(prvdr), timeout=self.timeout) as response:
+            content = response.read()
+        return read_frame(io.BytesIO(content), self.suffix)
+
+    def read_header(self, prvdr):
+        if self.suffix != '.csv':
+            return super().read_header(prvdr)
+
+        # The header rows are parsed as they arrive, and the rest is not downloaded
+        with urllib.request.urlopen(self.source(prvdr), timeout=self.timeout) as response:
+            return read_frame(response, self.suffix, header_only=True)
+
+
+def open_store(location, suffix='.csv', timeout=30):
+    """
+    :return: An HTTPProviderStore for http(s) locations, otherwise a LocalProviderStore.
+    """
+    if location.startswith('http://') or location.startswith('https://'):
+        return HTTPProviderStore(location, suffix=suffix, timeout=timeout)
+    return LocalProviderStore(location)
+
+
+def default_store(timeout=30):
+    """
+    :return: The store named by HCRIS_PROVIDER_STORE, by default the local
+             store in provider_data if there is one, otherwise the
+             HCRIS-databuilder repository, reading HCRIS_PROVIDER_SUFFIX files.
+    """
+    location = os.environ.get('HCRIS_PROVIDER_STORE',
+                              'provider_data' if os.path.isdir('provider_data') else GITHUB_URL)
+    return open_store(location, suffix=os.environ.get('HCRIS_PROVIDER_SUFFIX', '.csv'), timeout=timeout)
+
+
+def default_workers():
+    """
+    :return: The number of providers to read at a time, HCRIS_FETCH_WORKERS.
+    """
+    return int(os.environ.get('HCRIS_FETCH_WORKERS', 16))
+
+
+def is_missing(error):
+    """
+    :return: True if error means the provider file does not exist, so retrying is pointless.
+    """
+    if isinstance(error, FileNotFoundError):
+        return True
+    return isinstance(error, urllib.error.HTTPError) and error.code == 404
+
+
+def read_with_retries(store, prvdr, retries=2, backoff=0.5, header_only=False):
+    """
+    Read one provider, or only its header, retrying failed reads after
+    exponentially growing pauses.
+    """
+    for attempt in range(retries + 1):
+        try:
+            if header_only:
+                return store.read_header(prvdr)
+            return store.read(prvdr)
+        except Exception as e:
+            if attempt == retries or is_missing(e):
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def fetch_providers(store, prvdrs, max_workers=8, retries=2, backoff=0.5, progress=None, header_only=False):
+    """
+    Read the reports of many providers, or only their headers, at most
+    max_workers at a time.
+
+    A provider that still fails after its retries does not fail the others.
+    If given, progress is called with the number of providers finished so far
+    each time a provider is read or fails.
+
+    :return: A dict of DataFrames keyed by provider number, and a sorted list of
+             the provider numbers that could not be read.
+    """
+    frames = {}
+    failed = []
+    if len(prvdrs) == 0:
+        return frames, failed
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(prvdrs))) as executor:
+        futures = {executor.submit(read_with_retries, store, prvdr, retries, backoff, header_only): prvdr 
+                   for prvdr in prvdrs}
+        
+        for future in as_completed(futures):
+            try:
+                frames[futures[future]] = future.result()
+            except Exception:
+                failed.append(futures[future])
+            if progress is not None:
+                progress(len(frames) + len(failed))
+    
+    return frames, sorted(failed)
+
+
+def build_local_store(csv_dir, directory):
+    """
+    Convert every <PRVDR>.csv file in csv_dir into a Parquet file in directory.
+
+    :return: The number of provider files written.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    n = 0
+    for name in sorted(os.listdir(csv_dir)):
+        if not name.endswith('.csv'):
+            continue
+
+        frame = read_frame(os.path.join(csv_dir, name), '.csv')
+        write_frame(frame, os.path.join(directory, name[:-len('.csv')] + '.parquet'))
+        n += 1
+    return n
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print('usage: python provider_store.py CSV_DIR STORE_DIR')
+        sys.exit(1)
+
+    n = build_local_store(sys.argv[1], sys.argv[2])
+    print(n, 'provider files written to', sys.argv[2])
@@ -0,0 +1,93 @@
+"""
+Polynomial least squares fits for the scatter plot of features (plot 2).
+
+The fit is solved with a QR decomposition of the design matrix, with its
+columns scaled to unit norm first, since the powers of cost report values span
+many orders of magnitude. The leverage of each point comes from the same
+decomposition, which gives the confidence intervals of the fitted mean and the
+prediction intervals of new observations at the observed points without
+building the tables statsmodels' summary_table does. Designs that are not of
+full rank, such as a quadratic fit to two distinct values of x, fall back to a
+minimum norm least squares solution, as statsmodels' OLS does.
+
+Results follow statsmodels' OLS with a constant; benchmarks/bench_regression.py
+compares the two.
+"""
+
+import numpy as np
+from scipy.special import stdtrit
+
+
+class PolynomialFit(object):
+    """
+    A polynomial least squares fit of y on x, with its intervals at the fitted points.
+
+    params holds the coefficients from the constant up to the highest power of x.
+    """
+
+    def __init__(self, params, fittedvalues, leverage, ssr, centered_tss, nobs, rank, alpha):
+        self.params = params
+        self.fittedvalues = fittedvalues
+        self.nobs = nobs
+        self.df_model = np.float64(rank - 1)
+        # numpy floats, so that fits without residual degrees of freedom give nan
+        self.df_resid = np.float64(nobs - rank)
+        self.alpha = alpha
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.rsquared = 1 - ssr / centered_tss
+            self.rsquared_adj = 1 - (nobs - 1) / self.df_resid * (1 - self.rsquared)
+            self.scale = ssr / self.df_resid
+
+            q = stdtrit(self.df_resid, 1 - alpha / 2) if self.df_resid > 0 else np.nan
+            se_mean = np.sqrt(self.scale * leverage)
+            se_obs = np.sqrt(self.scale * (1 + leverage))
+
+        self.mean_ci_low = fittedvalues - q * se_mean
+        self.mean_ci_upp = fittedvalues + q * se_mean
+        self.obs_ci_low = fittedvalues - q * se_obs
+        self.obs_ci_upp = fittedvalues + q * se_obs
+
+
+def design_matrix(x, degree):
+    """
+    :return: The columns 1, x, ..., x**degree.
+    """
+    return np.vander(np.asarray(x, dtype=float), degree + 1, increasing=True)
+
+
+def fit_polynomial(x, y, degree, alpha=0.05):
+    """
+    :return: A PolynomialFit of y on the powers of x up to degree, with
+             (1 - alpha) confidence and prediction intervals.
+    """
+    y = np.asarray(y, dtype=float).ravel()
+    xp = design_matrix(np.ravel(x), degree)
+    n, p = xp.shape
+
+    norms = np.linalg.norm(xp, axis=0)
+    norms[norms == 0] = 1
+    scaled = xp / norms
+
+    q, r = np.linalg.qr(scaled)
+    diag = np.abs(np.diag(r))
+    tol = diag.max(initial=0) * max(n, p) * np.finfo(float).eps
+    rank = int(np.sum(diag > tol))
+
+    if rank == p:
+        params = np.linalg.solve(r, q.T @ y) / norms
+        leverage = np.sum(q * q, axis=1)
+    else:
+        # Minimum norm coefficients of the unscaled design, as statsmodels'
+        # pinv gives, and leverage from the singular vectors spanning it
+        u, s, vt = np.linalg.svd(xp, full_matrices=False)
+        rank = int(np.sum(s > s.max(initial=0) * 1e-15))
+        u, s, vt = u[:, :rank], s[:rank], vt[:rank]
+        params = vt.T @ ((u.T @ y) / s)
+        leverage = np.sum(u * u, axis=1)
+
+    fitted = xp @ params
+    resid = y - fitted
+    ssr = resid @ resid
+    centered_tss = np.sum((y - y.mean()) ** 2) if n else np.nan
+    return PolynomialFit(params, fitted, leverage, ssr, centered_tss, n, rank, alpha)
@@ -0,0 +1,247 @@
+"""
+Streaming export of the cost reports of a hospital selection.
+
+The reports are written one batch of providers at a time, straight from the
+per-provider frames of the report assembler (see report_merge.py), so the
+memory an export takes depends on the batch size and not on the number of
+hospitals selected. The columns are those of the schema manifest, in manifest
+order, followed by any other columns of the provider files. Those are found
+before the header is written: the assembler saves them for each provider it
+reads, and only the header of the other providers' files is read, that is the
+schema of a Parquet file or the first rows of a CSV file.
+
+CSV is written to the response as it is produced. Parquet and Excel files can
+only be read once complete, so they are written to a temporary file that is
+streamed to the response and then removed.
+"""
+
+import io
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import report_merge
+import schema_manifest
+
+
+FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'parquet': ('application/octet-stream', '.parquet'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', '.xlsx'),
+    }
+
+# Bytes read at a time when streaming a finished file
+BLOCK_SIZE = 2**20
+
+
+def provider_batches(assembler, prvdrs, batch_size):
+    """
+    :return: A generator of lists of provider frames, batch_size providers at a
+             time, in provider order. Providers that cannot be read are skipped.
+    """
+    prvdrs = sorted(set(prvdrs))
+    for i in range(0, len(prvdrs), batch_size):
+        frames, versions, failed = assembler.provider_frames(prvdrs[i:i + batch_size])
+        yield [frames[prvdr] for prvdr in sorted(frames)]
+
+
+def export_columns(assembler, prvdrs):
+    """
+    :return: The columns of the schema manifest followed by the other columns
+             of the provider files of prvdrs and the data url the assembler
+             adds, and a boolean array marking text columns. Other columns are
+             typed by the first provider holding them; those found in the
+             header of a CSV file, which carries no types, are text.
+    """
+    manifest = schema_manifest.load_manifest()['columns']
+    columns = [tuple(c[:4]) for c in manifest]
+    text = [c[4] == 'str' for c in manifest]
+
+    extra = assembler.extra_columns(sorted(set(prvdrs)))
+
+    # Other columns in order of first appearance
+    known = set(columns)
+    for prvdr in sorted(extra):
+        for c, is_text in extra[prvdr]:
+            if c not in known:
+                known.add(c)
+                columns.append(c)
+                text.append(is_text)
+
+    if report_merge.URL_COL not in known:
+        columns.append(report_merge.URL_COL)
+        text.append(True)
+    return pd.MultiIndex.from_tuples(columns), np.array(text)
+
+
+def typed_values(frame, columns, text):
+    """
+    :return: The values of frame in the given columns as a 2-D float array of
+             the number columns and a 2-D object array of the text columns,
+             holding strings or None.
+    """
+    frame = frame.reindex(columns=columns)
+
+    numbers = frame.iloc[:, np.flatnonzero(~text)]
+    mixed = (numbers.dtypes == object).values
+    values = np.empty(numbers.shape)
+    values[:, ~mixed] = numbers.iloc[:, np.flatnonzero(~mixed)].to_numpy(dtype=float)
+    for j in np.flatnonzero(mixed):
+        values[:, j] = pd.to_numeric(numbers.iloc[:, j], errors='coerce')
+
+    strings = frame.iloc[:, np.flatnonzero(text)].to_numpy(dtype=object)
+    strings = np.where(pd.isna(strings), None, strings.astype(str)).astype(object)
+    return values, strings
+
+
+def records(values, strings, text):
+    """
+    :return: A 2-D object array of the rows of values and strings, in column
+             order, with None for missing and infinite values.
+    """
+    rows = np.empty((values.shape[0], len(text)), dtype=object)
+    rows[:, ~text] = np.where(np.isfinite(values), values, None)
+    rows[:, text] = strings
+    return rows
+
+
+def write_csv(assembler, prvdrs, batch_size=16):
+    """
+    :return: A generator of CSV text: the 4 header rows, then the reports of
+             each batch of providers.
+    """
+    columns, text = export_columns(assembler, prvdrs)
+
+    buf = io.StringIO()
+    pd.DataFrame(columns=columns).to_csv(buf)
+    yield buf.getvalue()
+
+    start = 0
+    for frames in provider_batches(assembler, prvdrs, batch_size):
+        for frame in frames:
+            frame = frame.reindex(columns=columns)
+            frame.index = pd.RangeIndex(start, start + frame.shape[0])
+            start += frame.shape[0]
+
+            buf = io.StringIO()
+            frame.to_csv(buf, header=False)
+            yield buf.getvalue()
+
+
+def arrow_schema(columns, text):
+    """
+    :return: The Arrow schema of the Parquet export, with the pandas metadata
+             that pandas.read_parquet uses to restore the 4-level column header.
+    """
+    # Field names and metadata as pyarrow writes them for a DataFrame, built
+    # directly since pa.Schema.from_pandas looks up each column in turn
+    names = [str(tuple(c)) for c in columns]
+    fields = [pa.field(name, pa.string() if is_text else pa.float64()) for name, is_text in zip(names, text)]
+    metadata = {
+        'index_columns': [],
+        'column_indexes': [{'name': name, 'field_name': name, 'pandas_type': 'unicode',
+                            'numpy_type': 'object', 'metadata': {'encoding': 'UTF-8'}}
+                           for name in columns.names],
+        'columns': [{'name': name, 'field_name': name,
+                     'pandas_type': 'unicode' if is_text else 'float64',
+                     'numpy_type': 'object' if is_text else 'float64', 'metadata': None}
+                    for name, is_text in zip(names, text)],
+        'creator': {'library': 'pyarrow', 'version': pa.__version__},
+        'pandas_version': pd.__version__,
+        }
+    return pa.schema(fields, metadata={b'pandas': json.dumps(metadata).encode('utf-8')})
+
+
+def arrow_table(frames, columns, text, schema):
+    """
+    :return: An Arrow table with the given schema of the rows of frames.
+    """
+    typed = [typed_values(frame, columns, text) for frame in frames]
+    values = np.concatenate([t[0] for t in typed]).T
+    strings = np.concatenate([t[1] for t in typed]).T
+
+    arrays = [None] * len(text)
+    for j, i in enumerate(np.flatnonzero(~text)):
+        arrays[i] = pa.array(values[j], from_pandas=True)
+    for j, i in enumerate(np.flatnonzero(text)):
+        arrays[i] = pa.array(strings[j], type=pa.string())
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(assembler, prvdrs, path, batch_size=16):
+    """
+    Write the reports of prvdrs to a Parquet file at path, with one row group
+    per batch of providers.
+    """
+    columns, text = export_columns(assembler, prvdrs)
+    schema = arrow_schema(columns, text)
+
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for frames in provider_batches(assembler, prvdrs, batch_size):
+            if len(frames) == 0:
+                continue
+            writer.write_table(arrow_table(frames, columns, text, schema))
+
+
+def write_xlsx(assembler, prvdrs, path, batch_size=16):
+    """
+    Write the reports of prvdrs to an Excel workbook at path: the 4 header
+    rows, then one row per report. Rows are flushed to disk as they are
+    written (xlsxwriter's constant_memory mode).
+    """
+    import xlsxwriter
+
+    columns, text = export_columns(assembler, prvdrs)
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('cost_reports')
+    for level in range(columns.nlevels):
+        worksheet.write_row(level, 0, list(columns.get_level_values(level)))
+
+    row = columns.nlevels
+    for frames in provider_batches(assembler, prvdrs, batch_size):
+        for frame in frames:
+            values, strings = typed_values(frame, columns, text)
+            for record in records(values, strings, text):
+                worksheet.write_row(row, 0, record)
+                row += 1
+    workbook.close()
+
+
+def stream_file(write, *args):
+    """
+    :return: A generator of the bytes of the file written by write(*args, path),
+             which removes the file once it has been read.
+    """
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        write(*args, path)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                yield block
+    finally:
+        os.remove(path)
+
+
+def export(assembler, prvdrs, fmt):
+    """
+    :return: A generator of the content of the export of prvdrs in format fmt,
+             its mimetype, and its file name.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('Unknown export format ' + repr(fmt) + ', expected one of ' + ', '.join(sorted(FORMATS)))
+
+    mimetype, suffix = FORMATS[fmt]
+    if fmt == 'csv':
+        content = write_csv(assembler, prvdrs)
+    elif fmt == 'parquet':
+        content = stream_file(write_parquet, assembler, prvdrs)
+    else:
+        content = stream_file(write_xlsx, assembler, prvdrs)
+    return content, mimetype, 'cost_reports' + suffix
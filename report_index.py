@@ -0,0 +1,183 @@
+"""
+Column index of a loaded cost report frame.
+
+Plot and option callbacks name a feature by its report category and labelled
+feature (the 3rd and 4th column levels). A ColumnIndex maps those pairs to
+column positions once per loaded frame, so callbacks look columns up in
+constant time instead of scanning thousands of column labels, once per
+hospital, on every update.
+
+Which features of a category can be offered for a selection is decided with
+FeatureBits: a bitset over the labelled features of the schema manifest is
+computed for each provider when its reports are read, and the bitsets of a
+selection are OR-ed together and masked by category.
+"""
+
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+class ColumnIndex(object):
+    """
+    Maps (category, feature) pairs of a 4-level column MultiIndex to columns.
+    """
+
+    def __init__(self, columns, bits=None, features=None):
+        self.columns = columns
+        self.bits = bits
+        self.feature_bits = features
+        self._options = {}
+        self.positions = {}
+        self.codes = {}
+        for i, c in enumerate(columns):
+            # Keep the first column when a pair repeats, as the scans did
+            self.positions.setdefault(tuple(c[2:]), i)
+            # Feature codes (the 1st column level) name columns in expressions
+            self.codes.setdefault(c[0], i)
+        self.features = set(c[3] for c in columns)
+
+    def position(self, category, feature):
+        """
+        :return: The integer position of the column, or None if it is not loaded.
+        """
+        return self.positions.get((category, feature))
+
+    def column(self, category, feature):
+        """
+        :return: The column label of (category, feature), or None if it is not loaded.
+        """
+        i = self.position(category, feature)
+        if i is None:
+            return None
+        return self.columns[i]
+
+    def available(self, features):
+        """
+        :return: The features, in the given order, that have a loaded column.
+        """
+        return [f for f in features if f in self.features]
+
+    def category_features(self, category):
+        """
+        :return: The labelled features of category that hold data for any
+                 loaded provider, computed once per category.
+        """
+        if category not in self._options:
+            if self.bits is None:
+                import schema_manifest
+                options = self.available(schema_manifest.category_features(category))
+            else:
+                options = self.feature_bits.select(self.bits, self.feature_bits.category_mask(category))
+            self._options[category] = options
+        return self._options[category]
+
+
+class FeatureBits(object):
+    """
+    Packed bitsets over the labelled features (4th column level) of the
+    schema manifest, or of columns when they are given.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = columns
+        self._labels = None
+        self._categories = None
+        self._masks = {}
+
+    def load(self):
+        # The manifest columns are read on first use, not when the app starts
+        if self._labels is None:
+            if self.columns is None:
+                import schema_manifest
+                self.columns = schema_manifest.load_columns()
+            self._categories = np.asarray(self.columns.get_level_values(2))
+            self._labels = pd.Index(self.columns.get_level_values(3))
+
+    @property
+    def labels(self):
+        self.load()
+        return self._labels
+
+    @property
+    def categories(self):
+        self.load()
+        return self._categories
+
+    def of_frame(self, frame):
+        """
+        :return: The bitset of features that have at least one value in frame.
+        """
+        present = np.zeros(len(self.labels), dtype=bool)
+        positions = self.labels.get_indexer(frame.columns.get_level_values(3))
+        held = frame.notna().any().values
+        found = held & (positions >= 0)
+        present[positions[found]] = True
+
+        # Features missing from the manifest cannot be offered in the dropdowns
+        unknown = np.flatnonzero(held & (positions < 0))
+        if len(unknown) > 0:
+            warnings.warn(str(len(unknown)) + ' features of the loaded reports are not in the schema manifest, '
+                          'such as ' + repr(frame.columns[unknown[0]][3]) + '; regenerate it from a provider '
+                          'file with schema_manifest.py')
+        return np.packbits(present)
+
+    def union(self, bitsets):
+        """
+        :return: The bitset of features present in any of bitsets.
+        """
+        if len(bitsets) == 0:
+            return np.packbits(np.zeros(len(self.labels), dtype=bool))
+        return np.bitwise_or.reduce(np.vstack(bitsets), axis=0)
+
+    def category_mask(self, category):
+        """
+        :return: The bitset of the features of category.
+        """
+        if category not in self._masks:
+            self._masks[category] = np.packbits(self.categories == category)
+        return self._masks[category]
+
+    def select(self, bits, mask):
+        """
+        :return: The labels of the features set in both bits and mask, in manifest order.
+        """
+        selected = np.unpackbits(bits & mask)[:len(self.labels)]
+        return [self.labels[i] for i in np.flatnonzero(selected)]
+
+
+class IndexCache(object):
+    """
+    Keeps the ColumnIndex of the most recently used loaded frames, by session key.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: The ColumnIndex stored under key, or None.
+        """
+        with self._lock:
+            if key not in self._indexes:
+                return None
+            self._indexes.move_to_end(key)
+            return self._indexes[key]
+
+    def set(self, key, index):
+        """
+        Store index under key, dropping the least recently used indexes.
+
+        :return: index
+        """
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.maxsize:
+                self._indexes.popitem(last=False)
+        return index
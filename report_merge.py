@@ -0,0 +1,260 @@
+"""
+Incremental assembly of the cost reports loaded for a hospital selection.
+
+The reports of each provider are read once and kept in a frame cache keyed by
+provider number and data version. When a selection changes, only the providers
+that were added are read; the reports of providers that stay selected come from
+the cache, and the combined frame is built with a single concat. Removing a
+provider reads nothing at all.
+
+A provider's data version is the size and modification time of its file in a
+local store. Files behind an HTTP store cannot be checked cheaply, so their
+version is the data_version the app is configured with (HCRIS_DATA_VERSION),
+which should be changed when the mirror is rebuilt.
+
+Given a report_index.FeatureBits, the assembler also records which features
+hold data for each provider as its reports are read, so the feature options of
+a selection can be found without looking at the combined frame. The bitsets are
+written next to the provider's frame in the frame cache's disk tier, so that a
+process other than the one that read the reports, such as the app's worker
+after a load in a long callback process, finds them too. The most recently
+used max_bits bitsets are also kept in memory.
+
+The columns of a provider's file that are not in the schema manifest are
+saved the same way, so an export can write its header without reading the
+files of providers that were already read (see report_export.py).
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import provider_store
+import schema_manifest
+
+
+URL_COL = ('data url', 'data url', 'data url', 'data url')
+
+
+class ReportAssembler(object):
+    """
+    Builds the combined report frame of a selection from cached per-provider frames.
+    """
+
+    def __init__(self, store, frame_cache, data_version='', max_workers=8, retries=2, features=None,
+                 max_bits=4096):
+        self.store = store
+        self.frame_cache = frame_cache
+        self.features = features
+        self.max_bits = max_bits
+        self.bits = OrderedDict()
+        self._lock = threading.Lock()
+        self.data_version = data_version
+        self.max_workers = max_workers
+        self.retries = retries
+
+    def version(self, prvdr):
+        """
+        :return: A string that changes whenever the reports of prvdr change.
+        """
+        if isinstance(self.store, provider_store.LocalProviderStore):
+            try:
+                st = os.stat(self.store.source(prvdr))
+            except OSError:
+                return self.data_version
+            return str(st.st_size) + '-' + str(st.st_mtime_ns)
+        return self.data_version
+
+    def frame_key(self, prvdr, version):
+        return hashlib.sha1((prvdr + ':' + version).encode('utf-8')).hexdigest()
+
+    def session_key(self, versions):
+        """
+        :return: The cache key of a combined frame, given a dict of provider versions.
+        """
+        ids = [prvdr + ':' + versions[prvdr] for prvdr in sorted(versions)]
+        return hashlib.sha1(','.join(ids).encode('utf-8')).hexdigest()
+
+    def provider_frames(self, prvdrs, progress=None):
+        """
+        Get the reports of each provider from the frame cache, reading and
+        caching only the providers that are not in it. If given, progress is
+        called with the number of providers done and the number of providers.
+
+        :return: A dict of DataFrames keyed by provider number, a dict of their
+                 versions, and a sorted list of the providers that could not be read.
+        """
+        versions = {prvdr: self.version(prvdr) for prvdr in prvdrs}
+        frames = {}
+        missing = []
+        for prvdr in prvdrs:
+            key = self.frame_key(prvdr, versions[prvdr])
+            frame = self.frame_cache.get(key)
+            if frame is None:
+                missing.append(prvdr)
+            else:
+                frames[prvdr] = frame
+                self.record_bits(key, frame)
+                self.record_columns(key, frame)
+
+        on_fetch = None
+        if progress is not None:
+            progress(len(frames), len(prvdrs))
+            on_fetch = lambda n: progress(len(frames) + n, len(prvdrs))
+
+        fetched, failed = provider_store.fetch_providers(self.store, missing,
+                                                         max_workers=self.max_workers,
+                                                         retries=self.retries,
+                                                         progress=on_fetch,
+                                                         )
+        for prvdr, frame in fetched.items():
+            frame[URL_COL] = self.store.source(prvdr)
+            frame.reset_index(drop=True, inplace=True)
+            key = self.frame_key(prvdr, versions[prvdr])
+            self.frame_cache.set(key, frame)
+            self.record_bits(key, frame)
+            self.record_columns(key, frame)
+            frames[prvdr] = frame
+
+        versions = {prvdr: versions[prvdr] for prvdr in frames}
+        return frames, versions, failed
+
+    def sidecar_path(self, key, suffix):
+        return os.path.join(self.frame_cache.spill_dir, key + suffix)
+
+    def write_sidecar(self, key, suffix, data):
+        path = self.sidecar_path(key, suffix)
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def read_sidecar(self, key, suffix):
+        path = self.sidecar_path(key, suffix)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def remember_bits(self, key, bits):
+        with self._lock:
+            self.bits[key] = bits
+            self.bits.move_to_end(key)
+            while len(self.bits) > self.max_bits:
+                self.bits.popitem(last=False)
+
+    def get_bits(self, key):
+        """
+        :return: The feature bitset recorded for a provider's frame key, from
+                 memory or the disk tier, or None.
+        """
+        with self._lock:
+            bits = self.bits.get(key)
+            if bits is not None:
+                self.bits.move_to_end(key)
+                return bits
+
+        data = self.read_sidecar(key, '.bits.npy')
+        if data is None:
+            return None
+        try:
+            bits = np.load(io.BytesIO(data))
+        except ValueError:
+            return None
+        self.remember_bits(key, bits)
+        return bits
+
+    def record_bits(self, key, frame):
+        if self.features is None or self.get_bits(key) is not None:
+            return
+
+        bits = self.features.of_frame(frame)
+        buf = io.BytesIO()
+        np.save(buf, bits)
+        self.write_sidecar(key, '.bits.npy', buf.getvalue())
+        self.remember_bits(key, bits)
+
+    def record_columns(self, key, frame, force=False):
+        """
+        Save the columns of frame that are not in the schema manifest, unless
+        they were saved before.
+
+        :return: The saved columns as a list of (column, text) pairs.
+        """
+        if not force and os.path.exists(self.sidecar_path(key, '.columns.json')):
+            return None
+
+        known = set(schema_manifest.load_columns())
+        known.add(URL_COL)
+        extra = [(c, dtype == object) for c, dtype in zip(frame.columns, frame.dtypes) if c not in known]
+        self.write_sidecar(key, '.columns.json', json.dumps(extra).encode('utf-8'))
+        return extra
+
+    def extra_columns(self, prvdrs):
+        """
+        Get the columns outside the schema manifest of each provider, reading
+        only the header of the files of providers whose columns were not saved.
+
+        :return: A dict of lists of (column, text) pairs keyed by provider
+                 number, without the providers that could not be read.
+        """
+        keys = {prvdr: self.frame_key(prvdr, self.version(prvdr)) for prvdr in prvdrs}
+        extra = {}
+        missing = []
+        for prvdr in prvdrs:
+            data = self.read_sidecar(keys[prvdr], '.columns.json')
+            if data is None:
+                missing.append(prvdr)
+            else:
+                extra[prvdr] = [(tuple(c), is_text) for c, is_text in json.loads(data.decode('utf-8'))]
+
+        headers, failed = provider_store.fetch_providers(self.store, missing,
+                                                         max_workers=self.max_workers,
+                                                         retries=self.retries,
+                                                         header_only=True,
+                                                         )
+        for prvdr, header in headers.items():
+            extra[prvdr] = self.record_columns(keys[prvdr], header, force=True)
+        return extra
+
+    def feature_bits(self, prvdrs):
+        """
+        :return: The union of the feature bitsets of prvdrs, or None when the
+                 bitset of a provider has not been recorded.
+        """
+        if self.features is None:
+            return None
+
+        bitsets = []
+        for prvdr in prvdrs:
+            bits = self.get_bits(self.frame_key(prvdr, self.version(prvdr)))
+            if bits is None:
+                return None
+            bitsets.append(bits)
+        return self.features.union(bitsets)
+
+    def assemble(self, prvdrs, progress=None):
+        """
+        :return: The combined DataFrame of reports for prvdrs (None if none
+                 could be read), its session key, the providers it holds, and
+                 the providers that could not be read.
+        """
+        frames, versions, failed = self.provider_frames(sorted(set(prvdrs)), progress)
+        if len(frames) == 0:
+            return None, None, [], failed
+
+        df = pd.concat([frames[prvdr] for prvdr in sorted(frames)], ignore_index=True, copy=False)
+        if df.shape[0] == 0:
+            return None, None, [], failed
+
+        df.dropna(axis=1, how='all', inplace=True)
+        return df, self.session_key(versions), sorted(frames), failed
@@ -0,0 +1,112 @@
+"""
+Cache of the figures of the plot callbacks, keyed by a fingerprint of the query.
+
+A figure depends only on the reports it is drawn from and the options of its
+panel, so a fingerprint of those identifies it: the session key of the reports
+(a hash of the providers and their versions, see report_merge.py), the data
+and schema version, and the features, transforms, fiscal year, model and focal
+hospital chosen. Pressing "Run" again, or another session asking the same
+question of the same hospitals, returns the cached figure.
+
+Figures are kept as their JSON text in an in-memory LRU cache bounded by bytes,
+and written through to a disk tier shared by every gunicorn worker and by the
+processes that run long callbacks, which would otherwise start with an empty
+cache each time. Hits and misses of each tier are counted.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+
+
+def fingerprint(*parts):
+    """
+    :return: A hex digest identifying a query made of JSON serializable parts.
+             Lists and tuples are compared as given, so sets of providers
+             should be passed sorted.
+    """
+    text = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """
+    LRU cache of figures bounded by bytes, with an optional diskcache.Cache tier.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, disk=None, ttl=None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.ttl = ttl
+
+        self._results = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.counts = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def get(self, key):
+        """
+        :return: The figure stored under key, as a dict, or None.
+        """
+        with self._lock:
+            text = self._results.get(key)
+            if text is not None:
+                self._results.move_to_end(key)
+                self.counts['hits'] += 1
+                return json.loads(text)
+
+        text = self.disk.get(key) if self.disk is not None else None
+        if text is None:
+            with self._lock:
+                self.counts['misses'] += 1
+            return None
+
+        with self._lock:
+            self.counts['disk_hits'] += 1
+        self._remember(key, text)
+        return json.loads(text)
+
+    def set(self, key, figure):
+        """
+        Store a figure, or its dict, under key.
+        """
+        text = pio.to_json(figure, validate=False)
+        self._remember(key, text)
+        if self.disk is not None:
+            self.disk.set(key, text, expire=self.ttl)
+
+    def _remember(self, key, text):
+        if len(text) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._results.pop(key, None)
+            if old is not None:
+                self._nbytes -= len(old)
+            self._results[key] = text
+            self._nbytes += len(text)
+
+            while self._nbytes > self.max_bytes:
+                evicted_key, evicted = self._results.popitem(last=False)
+                self._nbytes -= len(evicted)
+
+    def stats(self):
+        """
+        :return: The hit and miss counts, and the number and bytes of the
+                 figures held in memory.
+        """
+        with self._lock:
+            stats = dict(self.counts)
+            stats['entries'] = len(self._results)
+            stats['bytes'] = self._nbytes
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._nbytes = 0
+        if self.disk is not None:
+            self.disk.clear()
@@ -0,0 +1,181 @@
+"""
+Column schema of the per-provider cost report files.
+
+Every provider file shares one 4-level column header: (feature code, feature
+description, report category, labelled feature). The app needs that header
+before any reports are loaded, to list the features of each category and to
+lay out downloads, so it is kept in a versioned manifest in dataframe_data/
+instead of being read from a provider file when the app starts.
+
+To regenerate the manifest from the header of a provider file, run:
+
+    python schema_manifest.py https://raw.githubusercontent.com/klocey/HCRIS-databuilder/master/provider_data/052043.csv
+
+This also writes the 4 header rows of that file to tests/data/provider_header.csv,
+which the tests check the manifest against without network access. Without an
+argument, the manifest is rebuilt from the crosswalk, which lists more features
+than the provider files hold.
+"""
+
+import csv
+import json
+import os
+import sys
+from functools import lru_cache
+
+
+MANIFEST_PATH = 'dataframe_data/provider_schema.json'
+HEADER_PATH = 'tests/data/provider_header.csv'
+CROSSWALK_PATH = 'dataframe_data/2552-10 SAS FILE RECORD LAYOUT AND CROSSWALK TO 96 - 2021.csv'
+
+# Columns added to every provider file by the HCRIS-databuilder
+DERIVED_COLUMNS = [
+    (('Curated Name and Num',) * 4, 'str'),
+    (('Hospital type (modified)',) * 4, 'str'),
+    (('Beginning FFY',) * 4, 'float'),
+    (('Lat',) * 4, 'float'),
+    (('Lon',) * 4, 'float'),
+    ]
+
+# Crosswalk data types that hold text rather than numbers
+TEXT_TYPES = ['ALPHANUMERIC', 'ID']
+
+
+def read_crosswalk(path=CROSSWALK_PATH):
+    """
+    :return: A list of (feature code, description, category, data type) rows,
+             one per distinct feature code in the crosswalk.
+    """
+    rows = []
+    codes = set()
+    with open(path, newline='', encoding='utf-8-sig') as csvfile:
+        for row in csv.DictReader(csvfile):
+            code = row['10_FIELD_NAME'].strip()
+            if code in ['', 'NOT ON FORM'] or code in codes or row['DATA_TYPE'] == 'DUPLICATE':
+                continue
+
+            codes.add(code)
+            rows.append((code, row['FIELD DESCRIPTION '].strip(), row['CATEGORY'].strip(), row['DATA_TYPE']))
+    return rows
+
+
+def build_from_crosswalk(path=CROSSWALK_PATH):
+    """
+    :return: Manifest columns as [code, description, category, label, dtype] lists.
+    """
+    columns = [list(c) + [dtype] for c, dtype in DERIVED_COLUMNS]
+    for code, desc, category, data_type in read_crosswalk(path):
+        dtype = 'str' if data_type in TEXT_TYPES else 'float'
+        columns.append([code, desc, category, desc + ' (' + code + ')', dtype])
+    return columns
+
+
+def build_from_provider_file(source, path=CROSSWALK_PATH, header_path=None):
+    """
+    :return: Manifest columns taken from the header of a provider CSV file,
+             with data types from the crosswalk where it knows the feature.
+             If header_path is given, the header of the file and the first
+             report are written there.
+    """
+    import provider_store
+
+    frame = provider_store.read_frame(source, '.csv')
+    if header_path is not None:
+        write_header(frame, header_path)
+    data_types = {code: data_type for code, desc, category, data_type in read_crosswalk(path)}
+
+    columns = []
+    for c in frame.columns:
+        if c[0] in data_types:
+            dtype = 'str' if data_types[c[0]] in TEXT_TYPES else 'float'
+        else:
+            dtype = 'str' if frame[c].dtype == object else 'float'
+        columns.append(list(c) + [dtype])
+    return columns
+
+
+def write_header(frame, path=HEADER_PATH):
+    """
+    Write the 4 header rows of a provider frame and its first report as CSV.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    frame.iloc[:1].to_csv(path)
+
+
+def write_manifest(columns, source, path=MANIFEST_PATH):
+    """
+    Write the manifest, bumping its version whenever the columns change.
+    """
+    version = 1
+    if os.path.exists(path):
+        with open(path) as f:
+            old = json.load(f)
+        version = old['version'] + int(old['columns'] != columns)
+
+    lines = [json.dumps(c) for c in columns]
+    with open(path, 'w') as f:
+        f.write('{\n"version": ' + str(version) + ',\n')
+        f.write('"source": ' + json.dumps(source) + ',\n')
+        f.write('"columns": [\n' + ',\n'.join(lines) + '\n]\n}\n')
+    return version
+
+
+@lru_cache(maxsize=None)
+def load_manifest(path=MANIFEST_PATH):
+    """
+    :return: The manifest as a dict with version, source and columns.
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def load_columns(path=MANIFEST_PATH):
+    """
+    :return: The 4-level column MultiIndex shared by all provider files.
+    """
+    import pandas as pd
+
+    return pd.MultiIndex.from_tuples([tuple(c[:4]) for c in load_manifest(path)['columns']])
+
+
+@lru_cache(maxsize=None)
+def category_features(category, path=MANIFEST_PATH):
+    """
+    :return: The labelled features (4th column level) of a report category.
+    """
+    return tuple(c[3] for c in load_manifest(path)['columns'] if c[2] == category)
+
+
+def compare_columns(columns, path=MANIFEST_PATH):
+    """
+    :return: The columns of a provider file missing from the manifest, and the
+             manifest columns missing from the file, as lists of 4-tuples.
+    """
+    manifest = [tuple(c[:4]) for c in load_manifest(path)['columns']]
+    columns = [tuple(c) for c in columns]
+    known, present = set(manifest), set(columns)
+    return [c for c in columns if c not in known], [c for c in manifest if c not in present]
+
+
+def empty_frame(path=MANIFEST_PATH):
+    """
+    :return: An empty DataFrame with the provider file columns.
+    """
+    import pandas as pd
+
+    return pd.DataFrame(columns=load_columns(path))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        source = sys.argv[1]
+        columns = build_from_provider_file(source, header_path=HEADER_PATH)
+    else:
+        source = os.path.basename(CROSSWALK_PATH)
+        columns = build_from_crosswalk()
+
+    version = write_manifest(columns, source)
+    print(len(columns), 'columns written to', MANIFEST_PATH, '(version ' + str(version) + ')')
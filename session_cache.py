@@ -0,0 +1,162 @@
+"""
+Server-side cache of the cost report frames loaded by each session.
+
+The browser only keeps a short key for the frame it loaded. The frame itself
+stays on the server: in an in-memory LRU cache bounded by bytes, and in a disk
+tier that every entry is written through to. The disk tier lets any gunicorn
+worker serve a key that another worker loaded, and brings entries back after
+they are evicted from memory. Entries expire ttl seconds after their last use.
+Disk entries are written with a frame_codec codec, Arrow IPC by default.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import frame_codec
+
+
+KEY_PATTERN = re.compile('^[0-9a-f]{8,64}$')
+
+# Seconds before a temporary spill file is taken to be left by a writer that
+# died; newer ones may still be written by another worker before os.replace
+TMP_GRACE = 600
+
+
+def frame_bytes(frame):
+    """
+    :return: The number of bytes a DataFrame holds in memory.
+    """
+    # Sized a dtype at a time; DataFrame.memory_usage looks up each of the
+    # thousands of MultiIndex columns one at a time
+    nbytes = frame.index.memory_usage(deep=True)
+    dtypes = frame.dtypes.values
+    for dtype in set(dtypes):
+        values = frame.iloc[:, np.flatnonzero(dtypes == dtype)].to_numpy()
+        if dtype == object:
+            nbytes += pd.Series(values.ravel()).memory_usage(index=False, deep=True)
+        else:
+            nbytes += values.nbytes
+    return int(nbytes)
+
+
+class SessionCache(object):
+    """
+    LRU cache of DataFrames keyed by hex strings, with TTL expiry and a disk tier.
+    """
+
+    def __init__(self, spill_dir, max_bytes=512 * 2**20, max_spill_bytes=4 * 2**30, ttl=6 * 3600,
+                 codec=None):
+        self.spill_dir = spill_dir
+        self.codec = codec if codec is not None else frame_codec.get_codec('arrow')
+        self.max_bytes = max_bytes
+        self.max_spill_bytes = max_spill_bytes
+        self.ttl = ttl
+
+        self._frames = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(spill_dir):
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def path(self, key):
+        if KEY_PATTERN.match(key) is None:
+            raise ValueError('Invalid session key: ' + repr(key))
+        return os.path.join(self.spill_dir, key + self.codec.suffix)
+
+    def get(self, key):
+        """
+        :return: The frame stored under key, or None if it is unknown or expired.
+        """
+        path = self.path(key)
+        now = time.time()
+
+        with self._lock:
+            if key in self._frames:
+                frame, nbytes, used = self._frames.pop(key)
+                self._nbytes -= nbytes
+                if now - used <= self.ttl:
+                    self._insert(key, frame, nbytes, now)
+                    self._touch(path, now)
+                    return frame
+
+        try:
+            if now - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            frame = self.codec.read(path)
+        except (OSError, EOFError, ValueError):
+            return None
+
+        with self._lock:
+            if key not in self._frames:
+                self._insert(key, frame, frame_bytes(frame), now)
+        self._touch(path, now)
+        return frame
+
+    def set(self, key, frame):
+        """
+        Store frame under key, in memory and on disk.
+        """
+        path = self.path(key)
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        self.codec.write(frame, tmp)
+        os.replace(tmp, path)
+
+        with self._lock:
+            if key in self._frames:
+                self._nbytes -= self._frames.pop(key)[1]
+            self._insert(key, frame, frame_bytes(frame), time.time())
+        self._evict_disk()
+
+    def _insert(self, key, frame, nbytes, used):
+        self._frames[key] = (frame, nbytes, used)
+        self._nbytes += nbytes
+
+        # Keep at least the newest frame, even when it alone is over the limit
+        while self._nbytes > self.max_bytes and len(self._frames) > 1:
+            self._nbytes -= self._frames.popitem(last=False)[1][1]
+
+    def _touch(self, path, now):
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        """
+        Remove expired spill files, then the least recently used ones until
+        the disk tier is back under max_spill_bytes. Temporary files are only
+        removed once they are older than TMP_GRACE.
+        """
+        now = time.time()
+        files = []
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith('.tmp'):
+                if now - st.st_mtime > TMP_GRACE:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+
+        total = 0
+        for mtime, size, path in sorted(files, reverse=True):
+            total += size
+            if now - mtime > self.ttl or total > self.max_spill_bytes:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
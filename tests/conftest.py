@@ -0,0 +1,95 @@
+"""
+Shared fixtures of the tests: small provider frames, and a local HTTP server
+standing in for a provider mirror.
+"""
+
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# The server's delays must not be replaced when tests record backoff pauses
+wait = time.sleep
+
+PRVDR_COL = ('PRVDR_NUM', 'Hospital Provider Number', 'HOSPITAL IDENTIFICATION INFORMATION',
+             'Hospital Provider Number (PRVDR_NUM)')
+FFY_COL = ('Beginning FFY', 'Beginning FFY', 'Beginning FFY', 'Beginning FFY')
+BEDS_COL = ('S3_1_C2_27', 'Total Facility', 'NUMBER OF BEDS', 'Total Facility (S3_1_C2_27)')
+NOTE_COL = ('S2_1_C1_38', 'MDH status beginning date (MM/DD/YY)', '',
+            'MDH status beginning date (MM/DD/YY) (S2_1_C1_38)')
+
+
+def provider_frame(prvdr, years=(2019, 2020)):
+    """
+    :return: A small cost report frame of a provider, with a 4-level header.
+    """
+    columns = pd.MultiIndex.from_tuples([PRVDR_COL, FFY_COL, BEDS_COL, NOTE_COL])
+    rows = [[int(prvdr), float(y), 100.0 + i if i % 2 == 0 else np.nan, '01/0%d/20' % (i + 1)]
+            for i, y in enumerate(years)]
+    return pd.DataFrame(rows, columns=columns)
+
+
+class StandIn(object):
+    """
+    Routes of the stand-in server: the body, status and delay of each path,
+    failures to serve before succeeding, and the number of requests of each path.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def add(self, path, body=b'', status=200, delay=0, failures=0):
+        self.routes[path] = {'body': body, 'status': status, 'delay': delay, 'failures': failures}
+
+    def respond(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            route = self.routes.get(path)
+            if route is None:
+                return 404, b'', 0
+            if route['failures'] > 0:
+                route['failures'] -= 1
+                return 500, b'', 0
+            return route['status'], route['body'], route['delay']
+
+
+@pytest.fixture
+def stand_in():
+    """
+    :return: The StandIn routes of a local HTTP server, and its base URL.
+    """
+    routes = StandIn()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body, delay = routes.respond(self.path.lstrip('/'))
+            wait(delay)
+            try:
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client timed out and went away
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield routes, 'http://127.0.0.1:%d/' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
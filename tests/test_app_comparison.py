@@ -0,0 +1,66 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+os.environ.setdefault('HCRIS_CACHE_DIR', tempfile.mkdtemp(prefix='hcris-app-test-'))
+
+import app
+import percentile_bands
+from conftest import BEDS_COL, FFY_COL
+
+
+class Distributions(object):
+    """
+    Stands in for feature_distributions.FeatureDistributions, recording the
+    years ranked.
+    """
+
+    def __init__(self):
+        self.ranked = []
+
+    def percentile_table(self, group, column, percentiles):
+        return pd.DataFrame([[1.0] * len(percentiles)] * 2, index=[2019, 2020], columns=percentiles)
+
+    def percentile_rank(self, group, column, year, value):
+        self.ranked.append(year)
+        if not np.isfinite(value):
+            return None
+        return 40.0, 1000
+
+
+class Directory(object):
+
+    def hospital(self, name):
+        return {'label': name, 'state': 'IL', 'htype': 'Short Term', 'color': '#000000'}
+
+
+@pytest.fixture
+def distributions(monkeypatch):
+    distributions = Distributions()
+    monkeypatch.setattr(app.app_data, 'distributions', lambda: distributions)
+    monkeypatch.setattr(app.app_data, 'sketches', lambda: None)
+    monkeypatch.setattr(app.app_data, 'directory', lambda: Directory())
+    return distributions
+
+
+def test_reports_without_a_year_are_not_ranked(distributions):
+    df = pd.DataFrame({app.NAME_COL: ['A'] * 4,
+                       FFY_COL: [np.nan, 2019.0, 2020.0, np.nan],
+                       BEDS_COL: [10.0, 20.0, np.nan, 30.0]})
+    traces, title = app.comparison_traces(df, BEDS_COL, 'A', 'Nation', None)
+
+    assert distributions.ranked == [2020, 2019]
+    assert title.endswith('percentile rank 40 among 1,000 reports of hospitals in the nation in 2019')
+    table = distributions.percentile_table(None, None, percentile_bands.PERCENTILES)
+    assert len(traces) == len(percentile_bands.band_traces(table))
+
+
+def test_no_year_to_rank(distributions):
+    df = pd.DataFrame({app.NAME_COL: ['A'], FFY_COL: [np.nan], BEDS_COL: [10.0]})
+    traces, title = app.comparison_traces(df, BEDS_COL, 'A', 'Nation', None)
+
+    assert distributions.ranked == []
+    assert title is None
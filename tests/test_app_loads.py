@@ -0,0 +1,73 @@
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault('HCRIS_CACHE_DIR', tempfile.mkdtemp(prefix='hcris-app-test-'))
+
+import app
+import provider_store
+import report_merge
+import session_cache
+from conftest import provider_frame
+
+
+class FlakyStore(provider_store.ProviderStore):
+    """
+    Fails the first read of each provider in flaky.
+    """
+
+    def __init__(self, flaky):
+        self.flaky = set(flaky)
+        self.reads = []
+
+    def source(self, prvdr):
+        return prvdr
+
+    def read(self, prvdr):
+        self.reads.append(prvdr)
+        if prvdr in self.flaky:
+            self.flaky.remove(prvdr)
+            raise OSError('connection reset')
+        return provider_frame(prvdr)
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    store = FlakyStore(['140001'])
+    frame_cache = session_cache.SessionCache(str(tmp_path / 'providers'))
+    monkeypatch.setattr(app, 'ASSEMBLER', report_merge.ReportAssembler(store, frame_cache, retries=0))
+    monkeypatch.setattr(app, 'SESSION_CACHE', session_cache.SessionCache(str(tmp_path / 'sessions')))
+    return store
+
+
+def load(prvdrs):
+    """
+    :return: The outputs of the load callback, got as the long callback
+             dispatcher gets them: from the manager's cache if it holds them,
+             otherwise by running the callback.
+    """
+    manager = app.load_callback_manager
+    key = manager.build_cache_key(app.update_df1_tab1, [prvdrs, None], [])
+    if not manager.result_ready(key):
+        manager.handle.set(key, app.update_df1_tab1(lambda value: None, prvdrs, None))
+    return manager.get_result(key, None)
+
+
+def test_failed_load_is_retried(store):
+    data, message = load(['140000', '140001'])
+    assert data['providers'] == ['140000']
+    assert message.endswith('Could not load reports for CMS numbers: 140001')
+
+    data, message = load(['140000', '140001'])
+    assert data['providers'] == ['140000', '140001']
+    assert message == 'Loaded 2 hospitals'
+
+    # The provider read by the first load comes from the frame cache
+    assert store.reads == ['140000', '140001', '140001']
+
+
+def test_load_of_no_readable_provider_is_retried(store):
+    assert load(['140001']) == (None, 'Loaded 0 hospitals. Could not load reports for CMS numbers: 140001')
+    data, message = load(['140001'])
+    assert data['providers'] == ['140001']
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app_data
+import crosswalk_index
+
+
+@pytest.fixture(scope='module')
+def crosswalk():
+    return app_data.crosswalk()
+
+
+@pytest.fixture(scope='module')
+def index(crosswalk):
+    return crosswalk_index.CrosswalkIndex(crosswalk)
+
+
+def pandas_filter(frame, filter_query, case_sensitive=True):
+    """
+    :return: The row ids of frame passing filter_query, filtered with pandas
+             as in the DataTable documentation's server-side example.
+    """
+    keep = pd.Series(True, index=frame.index)
+    for col, op, value, case in crosswalk_index.split_filter_query(filter_query):
+        if col not in frame.columns:
+            continue
+        values = frame[col].fillna('').astype(str)
+        if not (case_sensitive if case is None else case):
+            values, value = values.str.lower(), value.lower()
+        if op == 'contains':
+            keep &= values.str.contains(value, regex=False)
+        elif op == 'datestartswith':
+            keep &= values.str.startswith(value)
+        else:
+            keep &= {'=': values.eq, '!=': values.ne, '>=': values.ge, '<=': values.le,
+                     '>': values.gt, '<': values.lt}[op](value)
+    return np.flatnonzero(keep.to_numpy())
+
+
+def pandas_sort(frame, rows, sort_by):
+    """
+    :return: rows of frame sorted by sort_by with pandas, blank cells last.
+    """
+    sorted_frame = frame.iloc[rows].fillna('').astype(str).replace('', np.nan)
+    sorted_frame.index = rows
+    sorted_frame = sorted_frame.sort_values([s['column_id'] for s in sort_by],
+                                            ascending=[s['direction'] == 'asc' for s in sort_by],
+                                            na_position='last', kind='mergesort')
+    return sorted_frame.index.to_numpy()
+
+
+@pytest.mark.parametrize('filter_query, expected', [
+    ('{Feature code} icontains s3_1', [('Feature code', 'contains', 's3_1', False)]),
+    ('{Feature code} scontains S3_1', [('Feature code', 'contains', 'S3_1', True)]),
+    ('{Feature code} contains S3', [('Feature code', 'contains', 'S3', None)]),
+    ('{Feature code} = S3_1_C2_27', [('Feature code', '=', 'S3_1_C2_27', None)]),
+    ('{Feature code} eq "S3_1_C2_27"', [('Feature code', '=', 'S3_1_C2_27', None)]),
+    ('{Feature code} ieq s3_1_c2_27', [('Feature code', '=', 's3_1_c2_27', False)]),
+    ('{Feature code} sne S3_1_C2_27', [('Feature code', '!=', 'S3_1_C2_27', True)]),
+    ('{Feature code} >= G3', [('Feature code', '>=', 'G3', None)]),
+    ('{Feature code} lt G3', [('Feature code', '<', 'G3', None)]),
+    ('{Feature description} icontains "a && b" && {CATEGORY} contains B',
+     [('Feature description', 'contains', 'a && b', False), ('CATEGORY', 'contains', 'B', None)]),
+    ("{Feature description} contains it's && {CATEGORY} contains B",
+     [('Feature description', 'contains', "it's", None), ('CATEGORY', 'contains', 'B', None)]),
+    ("{Feature description} contains 'it\\'s'", [('Feature description', 'contains', "it's", None)]),
+    ('{Feature description} contains `total beds`', [('Feature description', 'contains', 'total beds', None)]),
+    ('{Feature description} datestartswith 2020', [('Feature description', 'datestartswith', '2020', None)]),
+    ('{CATEGORY} icontains beds && {Feature code} = S3_1_C2_27',
+     [('CATEGORY', 'contains', 'beds', False), ('Feature code', '=', 'S3_1_C2_27', None)]),
+    ('{CATEGORY} unknown beds', []),
+    ('no column', []),
+    ('', []),
+    (None, []),
+    ])
+def test_split_filter_query(filter_query, expected):
+    assert crosswalk_index.split_filter_query(filter_query) == expected
+
+
+@pytest.mark.parametrize('value', ['s3', 'S3_1_C2', 'beds', 'total beds', 'c2_2', 'ICU', 'of', '_1', 'x',
+                                   'zzzz', '---'])
+def test_candidates_are_a_superset_of_the_matches(crosswalk, index, value):
+    for col in index.columns:
+        values = crosswalk[col].fillna('').astype(str).str.lower()
+        truth = np.flatnonzero(values.str.contains(value.lower(), regex=False).to_numpy())
+        found = index.candidates(col, value)
+        if found is None:
+            continue
+        assert np.isin(truth, found).all()
+
+
+@pytest.mark.parametrize('filter_query', [
+    '{Feature code} icontains s3_1',
+    '{Feature code} scontains s3_1',
+    '{Feature code} contains S3_1_C2',
+    '{Feature description} icontains medicaid days',
+    '{Feature description} icontains "(y/n)"',
+    '{CATEGORY} icontains expense && {Feature description} icontains salar',
+    '{Feature code} = S3_1_C2_27',
+    '{Feature code} ieq s3_1_c2_27',
+    '{Feature code} != S3_1_C2_27',
+    '{Feature code} >= G3 && {Feature code} < G4',
+    '{SUBCATEGORY} contains HHA I',
+    '{Feature description} contains zzzz',
+    '{Not a column} contains beds',
+    ])
+def test_query_matches_pandas(crosswalk, index, filter_query):
+    np.testing.assert_array_equal(index.query(filter_query), pandas_filter(crosswalk, filter_query))
+
+
+def test_case_insensitive_by_default(crosswalk):
+    index = crosswalk_index.CrosswalkIndex(crosswalk, case_sensitive=False)
+    filter_query = '{Feature code} contains s3_1_c2'
+
+    rows = index.query(filter_query)
+    assert len(rows) > 0
+    np.testing.assert_array_equal(rows, pandas_filter(crosswalk, filter_query, case_sensitive=False))
+    # A case prefix overrides the default
+    assert len(index.query('{Feature code} scontains s3_1_c2')) == 0
+
+
+@pytest.mark.parametrize('sort_by', [
+    [{'column_id': 'Feature code', 'direction': 'asc'}],
+    [{'column_id': 'Feature code', 'direction': 'desc'}],
+    [{'column_id': 'SUBCATEGORY', 'direction': 'asc'}, {'column_id': 'Feature code', 'direction': 'desc'}],
+    [{'column_id': 'CATEGORY', 'direction': 'desc'}, {'column_id': 'SUBCATEGORY', 'direction': 'desc'},
+     {'column_id': 'Feature description', 'direction': 'asc'}],
+    ])
+def test_sort_matches_pandas(crosswalk, index, sort_by):
+    for filter_query in [None, '{Feature description} icontains total']:
+        rows = index.query(filter_query, sort_by)
+        np.testing.assert_array_equal(rows, pandas_sort(crosswalk, pandas_filter(crosswalk, filter_query), sort_by))
+
+
+def test_blanks_sort_last():
+    frame = pd.DataFrame({'a': ['b', None, 'a', 'b', '', 'c'], 'b': ['1', '2', '3', '4', '5', '']})
+    index = crosswalk_index.CrosswalkIndex(frame)
+
+    assert index.query(sort_by=[{'column_id': 'a', 'direction': 'asc'}]).tolist() == [2, 0, 3, 5, 1, 4]
+    assert index.query(sort_by=[{'column_id': 'a', 'direction': 'desc'}]).tolist() == [5, 0, 3, 2, 1, 4]
+    assert index.query(sort_by=[{'column_id': 'a', 'direction': 'desc'},
+                                {'column_id': 'b', 'direction': 'desc'}]).tolist() == [5, 3, 0, 2, 4, 1]
+    # Unknown columns are not sorted by
+    assert index.query(sort_by=[{'column_id': 'c', 'direction': 'asc'}]).tolist() == list(range(6))
+
+
+def test_page(crosswalk, index):
+    records, page_count = index.page(2, 100)
+    assert page_count == -(-crosswalk.shape[0] // 100)
+    assert records == crosswalk.iloc[200:300].to_dict('records')
+
+    records, page_count = index.page(0, 100, '{Feature description} contains zzzz')
+    assert records == []
+    assert page_count == 1
@@ -0,0 +1,120 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import zipfile
+
+import numpy as np
+import pytest
+
+import export_jobs
+import provider_store
+from conftest import provider_frame
+
+
+class Directory(object):
+    """
+    Stands in for hospital_directory.HospitalDirectory, with one row per
+    hospital and year, as the directory lists them.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.beds = np.array([r[2] for r in rows], dtype=float)
+
+    def mask(self, bed_range, states, htypes, ctypes):
+        return np.array([r[3] in states for r in self.rows])
+
+    def record(self, row):
+        name, prvdr, beds, state = self.rows[row]
+        return {'name': name, 'prvdr': prvdr, 'state': state, 'htype': 'Short Term', 'ctype': 'Nonprofit'}
+
+
+class Store(provider_store.ProviderStore):
+
+    def source(self, prvdr):
+        return prvdr
+
+    def read(self, prvdr):
+        if prvdr == '999999':
+            raise FileNotFoundError(prvdr)
+        return provider_frame(prvdr)
+
+
+def test_matching_hospitals_lists_each_hospital_once():
+    directory = Directory([('B', '140001', 100, 'IL'), ('A', '140000', 50, 'IL'), ('B', '140001', 120, 'IL'),
+                           ('A', '140000', 55, 'IL'), ('C', '140002', 10, 'WI'), ('A2', '140000', 60, 'IL')])
+    hospitals = export_jobs.matching_hospitals(directory, [0, 1000], ['IL'], [], [])
+
+    assert [(h['prvdr'], h['name'], h['beds']) for h in hospitals] == [('140000', 'A', 50), ('140000', 'A2', 60),
+                                                                       ('140001', 'B', 100)]
+
+
+def wait_for(jobs, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = jobs.status(job_id)
+        if status['state'] in ['done', 'failed']:
+            return status
+        time.sleep(0.05)
+    raise AssertionError('job did not finish')
+
+
+def test_export_job_writes_bundle(tmp_path):
+    jobs = export_jobs.ExportJobs(Store(), str(tmp_path), batch_size=2)
+    hospitals = export_jobs.matching_hospitals(Directory([('A', '140000', 50, 'IL'), ('B', '140001', 100, 'IL'),
+                                                          ('C', '140002', np.nan, 'IL'),
+                                                          ('D', '999999', 10, 'IL')]),
+                                               [0, 1000], ['IL'], [], [])
+    job_id = jobs.submit(hospitals, 'csv')
+    status = wait_for(jobs, job_id)
+
+    assert status['state'] == 'done'
+    assert status['done'] == 4
+    assert status['failed'] == ['999999']
+    with zipfile.ZipFile(jobs.bundle(job_id)) as bundle:
+        assert sorted(bundle.namelist()) == ['hospitals.csv', 'reports/140000.csv', 'reports/140001.csv',
+                                             'reports/140002.csv']
+
+
+def write_status(jobs, job_id, **fields):
+    status = {'job': job_id, 'state': 'running', 'format': 'csv', 'hospitals': 1, 'total': 1, 'done': 0,
+              'failed': [], 'error': None, 'created': time.time(), 'updated': time.time(),
+              'host': socket.gethostname(), 'pid': os.getpid()}
+    status.update(fields)
+    os.makedirs(jobs.path(job_id))
+    with open(jobs.path(job_id, 'status.json'), 'w') as f:
+        json.dump(status, f)
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+@pytest.mark.parametrize('state', ['queued', 'running'])
+def test_job_of_a_dead_worker_is_failed(tmp_path, state):
+    jobs = export_jobs.ExportJobs(Store(), str(tmp_path))
+    job_id = 'a' * 32
+    write_status(jobs, job_id, state=state, pid=dead_pid())
+
+    status = jobs.status(job_id)
+    assert status['state'] == 'failed'
+    assert 'stopped' in status['error']
+    assert jobs.status(job_id)['state'] == 'failed'
+
+
+def test_stalled_job_is_failed(tmp_path):
+    jobs = export_jobs.ExportJobs(Store(), str(tmp_path), stall_timeout=60)
+    write_status(jobs, 'b' * 32, updated=time.time() - 61)
+    write_status(jobs, 'c' * 32, updated=time.time() - 59)
+    write_status(jobs, 'd' * 32, state='queued', updated=time.time() - 61)
+    write_status(jobs, 'e' * 32, updated=time.time() - 61, host='another-host', pid=dead_pid())
+
+    assert jobs.status('b' * 32)['state'] == 'failed'
+    assert jobs.status('c' * 32)['state'] == 'running'
+    assert jobs.status('d' * 32)['state'] == 'queued'
+    assert jobs.status('e' * 32)['state'] == 'failed'
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import expressions
+
+
+def panel_of(columns, hospitals, years):
+    """
+    :return: A Panel of the reports with the given values by feature code,
+             hospital and Beginning FFY.
+    """
+    frame = pd.DataFrame(columns)
+    positions = {code: i for i, code in enumerate(frame.columns)}
+    return expressions.Panel(frame, positions, hospitals, years)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('A_1+B_2*C_3', 'A_1 + B_2 * C_3'),
+    ('(A_1 + B_2) * C_3', '(A_1 + B_2) * C_3'),
+    ('((A_1)) - (B_2 - C_3)', 'A_1 - (B_2 - C_3)'),
+    ('(A_1 - B_2) - C_3', 'A_1 - B_2 - C_3'),
+    ('A_1 / (B_2 * C_3)', 'A_1 / (B_2 * C_3)'),
+    ('-A_1 * 2.0', '-A_1 * 2'),
+    ('-(A_1 + B_2)', '-(A_1 + B_2)'),
+    ('+A_1', 'A_1'),
+    ('SUM( A_1,B_2 )', 'sum(A_1, B_2)'),
+    ('lag(A_1)', 'lag(A_1, 1)'),
+    ('1e3 * .5', '1000 * 0.5'),
+    ])
+def test_canonical_text(text, expected):
+    expression = expressions.parse(text)
+    assert expression.text == expected
+    assert expressions.parse(expression.text).node == expression.node
+
+
+def test_precedence():
+    panel = panel_of({'A_1': [2.0], 'B_2': [3.0], 'C_3': [4.0]}, ['h'], [2020])
+
+    def value(text):
+        return expressions.parse(text).evaluate(panel)[0]
+
+    assert value('A_1 + B_2 * C_3') == 14
+    assert value('A_1 - B_2 - C_3') == -5
+    assert value('A_1 - (B_2 - C_3)') == 3
+    assert value('C_3 / A_1 * B_2') == 6
+    assert value('C_3 / (A_1 * B_2)') == pytest.approx(2 / 3)
+    assert value('-A_1 * -B_2') == 6
+    assert value('--A_1') == 2
+
+
+def test_codes():
+    assert expressions.parse('sum(A_1, lag(B_2, 2)) / A_1 + 3').codes == ['A_1', 'B_2']
+
+
+def test_non_finite_values_are_missing():
+    panel = panel_of({'A_1': [1.0, 0.0, np.nan], 'B_2': [0.0, 0.0, 1.0]}, ['h', 'h', 'h'], [2018, 2019, 2020])
+    assert np.isnan(expressions.parse('A_1 / B_2').evaluate(panel)).all()
+
+
+def test_lag_across_missing_years():
+    # Hospital a has no report for 2019, and b's reports are out of order
+    panel = panel_of({'A_1': [10.0, 30.0, 40.0, 2.0, 1.0, 5.0]},
+                     ['a', 'a', 'a', 'b', 'b', 'b'],
+                     [2018, 2020, 2021, 2019, 2018, np.nan])
+
+    lagged = expressions.parse('lag(A_1)').evaluate(panel)
+    np.testing.assert_array_equal(lagged, [np.nan, np.nan, 30.0, 1.0, np.nan, np.nan])
+
+    lagged = expressions.parse('lag(A_1, 2)').evaluate(panel)
+    np.testing.assert_array_equal(lagged, [np.nan, 10.0, np.nan, np.nan, np.nan, np.nan])
+
+    change = expressions.parse('A_1 - lag(A_1)').evaluate(panel)
+    np.testing.assert_array_equal(change, [np.nan, np.nan, 10.0, 1.0, np.nan, np.nan])
+
+
+def test_sum_missing():
+    total = expressions.sum_missing([np.array([1.0, np.nan, np.nan]), np.array([2.0, 3.0, np.nan])])
+    np.testing.assert_array_equal(total, [3.0, 3.0, np.nan])
+
+    panel = panel_of({'A_1': [1.0, np.nan], 'B_2': [np.nan, np.nan]}, ['h', 'h'], [2019, 2020])
+    np.testing.assert_array_equal(expressions.parse('sum(A_1, B_2)').evaluate(panel), [1.0, np.nan])
+    assert np.isnan(expressions.parse('A_1 + B_2').evaluate(panel)).all()
+
+
+def test_unknown_code():
+    panel = panel_of({'A_1': [1.0]}, ['h'], [2020])
+    with pytest.raises(expressions.ExpressionError, match='Feature NOPE_1 is not in the loaded reports'):
+        expressions.parse('A_1 + NOPE_1').evaluate(panel)
+
+
+@pytest.mark.parametrize('text, message', [
+    ('', 'The expression is empty'),
+    ('   ', 'The expression is empty'),
+    ('A_1 $ 2', "Unexpected character '\\$' at position 5"),
+    ('(A_1 +', 'Unexpected end of expression'),
+    ('(A_1 + 2', 'Unexpected end of expression'),
+    ('A_1 2', "Unexpected '2' at position 5"),
+    ('A_1 + )', "Unexpected '\\)' at position 7"),
+    ('lag(A_1, 1.5)', 'lag at position 1 takes a feature and a whole number of years'),
+    ('lag(A_1, B_2)', 'lag at position 1 takes a feature and a whole number of years'),
+    ('sum(A_1 B_2)', "Expected '\\)' at position 9"),
+    ])
+def test_bad_expressions(text, message):
+    with pytest.raises(expressions.ExpressionError, match=message):
+        expressions.parse(text)
+
+
+def test_derived_cache_eviction():
+    values = [np.arange(10, dtype=float) + i for i in range(3)]
+    cache = expressions.DerivedCache(max_bytes=2 * values[0].nbytes)
+
+    cache.set('a', values[0])
+    cache.set('b', values[1])
+    assert cache.get('a') is values[0]
+    cache.set('c', values[2])
+
+    # b was the least recently used
+    assert cache.get('b') is None
+    assert cache.get('a') is values[0]
+    assert cache.get('c') is values[2]
+    assert cache._nbytes == 2 * values[0].nbytes
+    assert not values[0].flags.writeable
+
+    # Columns larger than the cache are not stored
+    large = np.zeros(30)
+    assert cache.set('d', large) is large
+    assert cache.get('d') is None
+    assert cache.get('a') is values[0]
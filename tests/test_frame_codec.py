@@ -0,0 +1,87 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import frame_codec
+from conftest import provider_frame
+
+
+def mixed_frame():
+    """
+    :return: A frame with a 4-level column MultiIndex and object columns of
+             mixed types, strings with NaN or None, and only missing values.
+    """
+    columns = pd.MultiIndex.from_tuples([('A', 'a', 'CAT', 'a (A)'), ('B', 'b', 'CAT', 'b (B)'),
+                                         ('C', 'c', '', 'c (C)'), ('D', 'd', 'CAT', 'd (D)'),
+                                         ('E', 'e', 'CAT', 'e (E)'), ('F', 'f', 'CAT', 'f (F)'),
+                                         ('G', 'g', 'CAT', 'g (G)'), ('H', 'h', 'CAT', 'h (H)')])
+    return pd.DataFrame({
+        0: [1.5, np.nan, 3.0, -np.inf],
+        1: pd.Series([1, 'two', 3.0, np.nan], dtype=object),
+        2: pd.Series(['x', np.nan, 'z', np.nan], dtype=object),
+        3: pd.Series(['x', None, 'z', 'w'], dtype=object),
+        4: pd.Series([np.nan] * 4, dtype=object),
+        5: pd.Series([1, 2, 3, 4], dtype=object),
+        6: pd.Series([datetime.date(2020, 1, 1), 'n/a', None, 7], dtype=object),
+        7: np.array([1, 2, 3, 4], dtype=np.int32),
+        }).set_axis(columns, axis=1)
+
+
+FRAMES = {
+    'provider': lambda: provider_frame('140000', years=(2018, 2019, 2020)),
+    'mixed': mixed_frame,
+    'indexed': lambda: mixed_frame().set_index(pd.Index(['r1', 'r2', 'r3', 'r4'], name='row')),
+    'row-multiindex': lambda: mixed_frame().set_index(pd.MultiIndex.from_tuples(
+        [('a', 1), ('a', 2), ('b', 1), ('b', 2)], names=['k', 'n'])),
+    'empty': lambda: provider_frame('140000').iloc[:0],
+    }
+
+
+def assert_identical(a, b):
+    pd.testing.assert_frame_equal(a, b, check_exact=True)
+    for i in range(a.shape[1]):
+        # NaN and None are told apart, as are 1, 1.0 and '1'
+        for x, y in zip(a.iloc[:, i], b.iloc[:, i]):
+            assert type(x) is type(y)
+
+
+@pytest.mark.parametrize('name', ['arrow', 'arrow-zstd', 'pickle'])
+@pytest.mark.parametrize('frame', sorted(FRAMES))
+def test_lossless_roundtrip(name, frame, tmp_path):
+    codec = frame_codec.get_codec(name)
+    original = FRAMES[frame]()
+
+    assert_identical(codec.decode(codec.encode(original)), original)
+
+    path = str(tmp_path / ('frame' + codec.suffix))
+    codec.write(original, path)
+    assert_identical(codec.read(path), original)
+
+
+def test_prepare_leaves_frame_unchanged():
+    original = mixed_frame()
+    copy = original.copy()
+    frame_codec.to_table(original)
+    assert_identical(original, copy)
+
+
+@pytest.mark.parametrize('frame', sorted(FRAMES))
+def test_json_roundtrip_keeps_values(frame):
+    # The JSON codec is lossy by design: dtypes and column labels are not kept
+    codec = frame_codec.get_codec('json')
+    original = FRAMES[frame]()
+    decoded = codec.decode(codec.encode(original))
+
+    assert decoded.shape == original.shape
+    numeric = [i for i, dtype in enumerate(original.dtypes) if dtype == float]
+    for i in numeric:
+        expected = original.iloc[:, i].to_numpy()
+        expected = np.where(np.isfinite(expected), expected, np.nan)
+        np.testing.assert_allclose(decoded.iloc[:, i].to_numpy(dtype=float), expected)
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        frame_codec.get_codec('csv')
@@ -0,0 +1,164 @@
+import numpy as np
+import pytest
+
+import hospital_directory
+
+
+STATES = ['IL', 'CA', 'TX', None]
+HTYPES = ['Short Term', 'Critical Access', 'Long Term', 'Psychiatric', 'Childrens', None]
+CTYPES = ['Proprietary-Corporation', 'Voluntary Nonprofit-Church', 'Governmental-City', None]
+
+
+def hospital_lists(n=400, seed=0):
+    """
+    :return: Random names, provider numbers, beds, states, hospital types and
+             control types of n hospitals, some sharing a name, some without
+             beds and some missing a category.
+    """
+    rng = np.random.default_rng(seed)
+    prvdrs = ['%06d' % (140000 + i) for i in range(n)]
+    names = ['HOSPITAL %d (%s)' % (i, prvdrs[i]) for i in range(n)]
+    # A few hospitals have more than one row in the general data
+    for i in range(0, n, 17):
+        names[i + 1] = names[i]
+    beds = rng.integers(1, 1500, size=n).astype(float)
+    beds[rng.random(n) < 0.1] = np.nan
+    states = [STATES[i] for i in rng.integers(len(STATES), size=n)]
+    htypes = [HTYPES[i] for i in rng.integers(len(HTYPES), size=n)]
+    ctypes = [CTYPES[i] for i in rng.integers(len(CTYPES), size=n)]
+    return names, prvdrs, beds, states, htypes, ctypes
+
+
+def baseline_filter(lists, bed_range, states_vals, htype_vals, ctype_vals):
+    """
+    :return: The options of the loop update_hospitals ran before the directory
+             was vectorized; hospitals missing a category pass no filter.
+    """
+    names, prvdrs, beds, states, htypes, ctypes = lists
+    low, high = bed_range
+    hospitals = []
+    for i, h in enumerate(names):
+        b = beds[i]
+        s = states[i]
+        ht = htypes[i]
+        ct = ctypes[i]
+
+        if low == 1:
+            b = 1
+
+        if b >= low and b <= high:
+            if s in states_vals:
+                if ct in ctype_vals:
+                    for htv in htype_vals:
+                        if ht is not None and htv in ht:
+                            hospitals.append(h)
+
+    hospitals = sorted(list(set(hospitals)))
+    return [{"label": i, "value": i} for i in hospitals]
+
+
+@pytest.fixture(scope='module')
+def lists():
+    return hospital_lists()
+
+
+@pytest.fixture(scope='module')
+def directory(lists):
+    return hospital_directory.HospitalDirectory.from_lists(*lists)
+
+
+@pytest.mark.parametrize('bed_range', [[1, 2800], [1, 100], [2, 2800], [100, 500], [500, 500], [1400, 2800],
+                                       [2000, 2800]])
+@pytest.mark.parametrize('states, htypes, ctypes', [
+    (['IL', 'CA', 'TX'], ['Short Term', 'Critical Access', 'Long Term', 'Psychiatric', 'Childrens'],
+     ['Proprietary-Corporation', 'Voluntary Nonprofit-Church', 'Governmental-City']),
+    (['IL'], ['Short Term'], ['Proprietary-Corporation']),
+    (['CA', 'TX'], ['Term'], ['Voluntary Nonprofit-Church', 'Governmental-City']),
+    (['IL', 'TX'], ['Short', 'Psych'], ['Governmental-City']),
+    (['IL'], ['Access', 'Critical Access'], ['Proprietary-Corporation', 'Not given']),
+    (['NY'], ['Short Term'], ['Proprietary-Corporation']),
+    ([], ['Short Term'], ['Proprietary-Corporation']),
+    (['IL'], [], ['Proprietary-Corporation']),
+    ])
+def test_filter_matches_baseline(lists, directory, bed_range, states, htypes, ctypes):
+    assert directory.filter(bed_range, states, htypes, ctypes) == \
+        baseline_filter(lists, bed_range, states, htypes, ctypes)
+
+
+def test_missing_filters_pass_nothing(directory):
+    assert directory.filter([1, 2800], None, ['Short Term'], ['Proprietary-Corporation']) == []
+    assert not directory.mask([1, 2800], ['IL'], None, None).any()
+
+
+def test_bed_mask(lists, directory):
+    beds = lists[2]
+
+    # A lower bound of 1 keeps hospitals without a bed count
+    assert directory.bed_mask(1, 10).all()
+    mask = directory.bed_mask(2, 2800)
+    assert not mask[np.isnan(beds)].any()
+    np.testing.assert_array_equal(mask, (beds >= 2) & (beds <= 2800))
+    np.testing.assert_array_equal(directory.bed_mask(300, 300), beds == 300)
+
+
+def test_missing_categories(lists, directory):
+    names, prvdrs, beds, states, htypes, ctypes = lists
+    mask = directory.mask([1, 2800], STATES[:-1], HTYPES[:-1], CTYPES[:-1])
+
+    known = np.array([s is not None and h is not None and c is not None for s, h, c in zip(states, htypes, ctypes)])
+    np.testing.assert_array_equal(mask, known)
+
+    i = int(np.flatnonzero(~known)[0])
+    record = directory.record(i)
+    assert (record['state'], record['htype'], record['ctype']) == (states[i], htypes[i], ctypes[i])
+
+
+def test_hospital_records(lists, directory):
+    names, prvdrs = lists[:2]
+
+    # A name with two rows is found by the provider number of either
+    record = directory.hospital(names[17])
+    assert record['prvdr'] == prvdrs[17]
+    assert directory.provider(prvdrs[18])['prvdr'] == prvdrs[17]
+    assert directory.provider('999999') is None
+
+    missing = directory.hospital('NOT A HOSPITAL')
+    assert missing['prvdr'] is None
+    assert missing['color'] == hospital_directory.hospital_color('NOT A HOSPITAL')
+    assert hospital_directory.hospital_color('RUSH UNIVERSITY MEDICAL CENTER (140119)') == \
+        hospital_directory.RUSH_COLOR
+
+
+def test_save_and_load(tmp_path, lists, directory):
+    path = str(tmp_path / 'hospital_directory')
+    directory.save(path)
+    loaded = hospital_directory.HospitalDirectory.load(path)
+
+    assert isinstance(loaded.name_codes, np.memmap)
+    assert sorted(loaded.arrays) == sorted(hospital_directory.ARRAYS)
+    for key in hospital_directory.ARRAYS:
+        np.testing.assert_array_equal(loaded.arrays[key], directory.arrays[key])
+
+    assert loaded.names == directory.names == sorted(set(lists[0]))
+    assert loaded.categories == directory.categories
+    np.testing.assert_array_equal(loaded.first_row, directory.first_row)
+    np.testing.assert_array_equal(loaded.bed_order, directory.bed_order)
+    np.testing.assert_array_equal(loaded.sorted_beds, directory.sorted_beds)
+
+    assert loaded.filter([100, 500], ['IL', 'CA'], ['Term'], CTYPES[:-1]) == \
+        directory.filter([100, 500], ['IL', 'CA'], ['Term'], CTYPES[:-1])
+    for i in [0, 1, 17, 399]:
+        assert loaded.record(i) == directory.record(i)
+
+
+def test_names_with_multibyte_characters(tmp_path):
+    names = ['CENTRO MÉDICO (400001)', 'HÔPITAL (400002)', 'A (400003)']
+    directory = hospital_directory.HospitalDirectory.from_lists(names, ['400001', '400002', '400003'],
+                                                                [10, np.nan, 30], ['PR'] * 3,
+                                                                ['Short Term'] * 3, [None] * 3)
+    directory.save(str(tmp_path / 'directory'))
+    loaded = hospital_directory.HospitalDirectory.load(str(tmp_path / 'directory'))
+
+    assert loaded.names == sorted(names)
+    assert loaded.provider('400002')['name'] == 'HÔPITAL (400002)'
+    assert loaded.hospital('CENTRO MÉDICO (400001)')['prvdr'] == '400001'
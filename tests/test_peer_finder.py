@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+import peer_finder
+
+
+def finder_of(vectors_by_year, seed=0):
+    """
+    :return: A PeerFinder of random vectors with n hospitals in each year of
+             vectors_by_year, a dict of n by year; hospital i is named H<i>.
+    """
+    rng = np.random.default_rng(seed)
+    years, providers, vectors = [], [], []
+    for year in sorted(vectors_by_year):
+        n = vectors_by_year[year]
+        years.extend([year] * n)
+        providers.extend(range(n))
+        vectors.append(rng.normal(size=(n, 4)))
+
+    size = max(vectors_by_year.values())
+    arrays = {'years': np.asarray(years, dtype=np.int32),
+              'providers': np.asarray(providers, dtype=np.int32),
+              'vectors': np.vstack(vectors).astype(np.float32)}
+    meta = {'prvdrs': ['14%04d' % i for i in range(size)], 'names': ['H' + str(i) for i in range(size)],
+            'built': '2020-01-01T00:00:00'}
+    return peer_finder.PeerFinder(arrays, meta)
+
+
+def brute_force(finder, prvdr, year, allowed=None):
+    """
+    :return: The names of the other hospitals of a year, nearest to prvdr first.
+    """
+    start, stop = finder.year_rows(year)
+    vectors = np.asarray(finder.vectors[start:stop], dtype=float)
+    providers = np.asarray(finder.providers[start:stop])
+    focal = np.flatnonzero(providers == finder.positions[prvdr])[0]
+
+    distances = np.linalg.norm(vectors - vectors[focal], axis=1)
+    names = [finder.names[providers[i]] for i in np.argsort(distances) if i != focal]
+    return [name for name in names if allowed is None or name in allowed]
+
+
+@pytest.mark.parametrize('k', [1, 5, 20, 199, 500])
+def test_nearest_matches_brute_force(k):
+    finder = finder_of({2019: 150, 2020: 200})
+
+    for prvdr in ['140000', '140042', '140199']:
+        year, names = finder.nearest(prvdr, k)
+        assert year == 2020
+        assert names == brute_force(finder, prvdr, 2020)[:k]
+
+    year, names = finder.nearest('140007', k, year=2019)
+    assert year == 2019
+    assert names == brute_force(finder, '140007', 2019)[:k]
+
+
+def test_latest_year():
+    finder = finder_of({2018: 10, 2019: 5, 2020: 3})
+
+    assert finder.latest_year('140002') == 2020
+    assert finder.latest_year('140004') == 2019
+    assert finder.latest_year('140009') == 2018
+    assert finder.latest_year('999999') is None
+    assert finder.nearest('999999', 5) is None
+    assert finder.nearest('140009', 5, year=2020) is None
+
+
+def test_nearest_among_allowed_names():
+    finder = finder_of({2020: 300})
+    allowed = {'H' + str(i) for i in range(0, 300, 3)}
+
+    year, names = finder.nearest('140001', 10, allowed=allowed)
+    assert names == brute_force(finder, '140001', 2020, allowed)[:10]
+    assert set(names) <= allowed
+
+
+def test_search_widens_when_few_candidates_pass_the_filter():
+    finder = finder_of({2020: 1000})
+    truth = brute_force(finder, '140000', 2020)
+
+    # The allowed hospitals are all far from the first 2k + 1 searched
+    allowed = set(truth[-7:])
+    year, names = finder.nearest('140000', 5, allowed=allowed)
+    assert names == truth[-7:-2]
+
+    # Fewer allowed hospitals than asked for returns all of them
+    year, names = finder.nearest('140000', 5, allowed=set(truth[-3:]))
+    assert names == truth[-3:]
+
+    year, names = finder.nearest('140000', 5, allowed=set())
+    assert names == []
+
+
+def test_save_and_load(tmp_path):
+    finder = finder_of({2019: 20, 2020: 30})
+    finder.save(str(tmp_path / 'peers'))
+    loaded = peer_finder.PeerFinder.load(str(tmp_path / 'peers'))
+
+    assert isinstance(loaded.vectors, np.memmap)
+    assert loaded.version == finder.version
+    assert loaded.nearest('140003', 8) == finder.nearest('140003', 8)
+
+
+def test_feature_vectors_are_standardized():
+    sums = np.array([[10.0, 0.0], [1000.0, 0.0], [np.nan, 0.0], [100.0, 0.0]])
+    counts = np.array([[1, 0], [1, 0], [0, 0], [1, 0]])
+    vectors = peer_finder.feature_vectors(sums, counts)
+
+    known = vectors[[0, 1, 3], 0]
+    assert known.mean() == pytest.approx(0)
+    assert known.std() == pytest.approx(1)
+    # Missing features are at the mean
+    assert vectors[2, 0] == 0
+    assert (vectors[:, 1] == 0).all()
+
+
+def test_one_hot_distance():
+    hot = peer_finder.one_hot(np.array([0, 1, 0, -1]), 2, weight=2.0)
+
+    assert np.linalg.norm(hot[0] - hot[1]) == pytest.approx(2.0)
+    assert np.linalg.norm(hot[0] - hot[2]) == 0
+    assert (hot[3] == 0).all()
@@ -0,0 +1,197 @@
+import numpy as np
+import pytest
+
+import peer_sketches
+
+
+PERCENTILES = np.arange(1, 100)
+
+# Rank error of a sketch of k = 200, in percentiles (see peer_sketches.py)
+RANK_ERROR = 1.7
+
+CELLS = [['IL', 'Short Term', 'Proprietary-Corporation'],
+         ['IL', 'Critical Access', 'Voluntary Nonprofit-Church'],
+         ['CA', 'Short Term', 'Voluntary Nonprofit-Church'],
+         ['CA', 'Psychiatric', 'Proprietary-Corporation']]
+
+COLUMNS = [['A_1', 'A', 'CATEGORY', 'A (A_1)'], ['B_2', 'B', 'CATEGORY', 'B (B_2)']]
+
+YEARS = [2019, 2020]
+
+
+def true_ranks(values, quantiles):
+    """
+    :return: The percentile rank of each quantile among values.
+    """
+    return 100 * np.searchsorted(np.sort(values), quantiles) / len(values)
+
+
+def test_kll_rank_error():
+    values = np.random.default_rng(1).lognormal(5, 2, size=50000)
+    sketch = peer_sketches.KLLSketch(200)
+    for chunk in np.array_split(values, 37):
+        sketch.update(chunk)
+
+    assert sketch.count() == len(values)
+    assert len(sketch.items()[0]) < 3 * sketch.k
+    error = true_ranks(values, sketch.quantiles(PERCENTILES)) - PERCENTILES
+    assert np.abs(error).max() < RANK_ERROR
+
+
+def test_small_sketches_are_exact():
+    values = np.random.default_rng(2).normal(size=150)
+    sketch = peer_sketches.KLLSketch(200)
+    sketch.update(values)
+
+    np.testing.assert_allclose(sketch.quantiles(PERCENTILES), np.percentile(values, PERCENTILES))
+    assert sketch.rank(np.sort(values)[30]) == pytest.approx(100 * 30 / 149)
+    assert sketch.rank(values.min() - 1) == 0
+    assert sketch.rank(values.max() + 1) == 100
+
+    empty = peer_sketches.KLLSketch(200)
+    assert np.isnan(empty.quantiles([50])).all()
+    assert empty.rank(1.0) is None
+
+
+def test_merge():
+    values = np.random.default_rng(3).lognormal(3, 1, size=40000)
+
+    merged = peer_sketches.KLLSketch(200, seed=1)
+    merged.update(values[:25000])
+    other = peer_sketches.KLLSketch(200, seed=2)
+    other.update(values[25000:])
+    merged.merge(other)
+
+    assert merged.count() == len(values)
+    assert len(merged.items()[0]) < 3 * merged.k
+    error = true_ranks(values, merged.quantiles(PERCENTILES)) - PERCENTILES
+    assert np.abs(error).max() < RANK_ERROR
+
+    # Sketches still holding every value merge exactly
+    small = peer_sketches.KLLSketch(200)
+    small.update(values[:50])
+    more = peer_sketches.KLLSketch(200)
+    more.update(values[50:120])
+    small.merge(more)
+    np.testing.assert_allclose(small.quantiles(PERCENTILES), np.percentile(values[:120], PERCENTILES))
+
+
+def test_from_levels_roundtrip():
+    sketch = peer_sketches.KLLSketch(50)
+    sketch.update(np.arange(1000, dtype=float))
+    items, levels = sketch.items()
+
+    copy = peer_sketches.KLLSketch.from_levels(items, levels, 50)
+    assert copy.count() == 1000
+    np.testing.assert_array_equal(copy.quantiles(PERCENTILES), sketch.quantiles(PERCENTILES))
+
+
+def test_build_cells():
+    rng = np.random.default_rng(4)
+    sizes = {3: 5, 7: 500, 8: 1, 12: 40, 20: 1200, 21: 2}
+    keys = np.concatenate([np.full(n, key) for key, n in sizes.items()])
+    values = rng.normal(size=len(keys))
+    order = rng.permutation(len(keys))
+    keys, values = keys[order], values[order]
+
+    cells, offsets, items, levels = peer_sketches.build_cells(keys, values, k=100)
+
+    assert cells.tolist() == sorted(sizes)
+    assert len(offsets) == len(cells) + 1
+    assert offsets[0] == 0 and offsets[-1] == len(items) == len(levels)
+    assert items.dtype == np.float32
+
+    for i, key in enumerate(cells):
+        cell_items = items[offsets[i]:offsets[i + 1]]
+        cell_levels = levels[offsets[i]:offsets[i + 1]]
+        if sizes[key] <= 100:
+            # Small cells keep their values, sorted, at level 0
+            np.testing.assert_array_equal(cell_items, np.sort(values[keys == key]).astype(np.float32))
+            assert (cell_levels == 0).all()
+        else:
+            assert np.sum(2 ** cell_levels.astype(np.int64)) == sizes[key]
+            assert len(cell_items) < 3 * 100
+
+
+def sketches_of(n_reports, seed=5):
+    """
+    :return: PeerSketches of random reports spread over CELLS, COLUMNS and
+             YEARS, and the feature, year, cell and value of each report.
+    """
+    rng = np.random.default_rng(seed)
+    features = rng.integers(len(COLUMNS), size=n_reports)
+    years = rng.integers(len(YEARS), size=n_reports)
+    cells = rng.integers(len(CELLS), size=n_reports)
+    values = rng.lognormal(4, 1, size=n_reports)
+
+    keys = peer_sketches.PeerSketches.cell_key(features, years, cells, len(YEARS), len(CELLS))
+    keys, offsets, items, levels = peer_sketches.build_cells(keys, values, k=200)
+    arrays = {'keys': keys, 'offsets': offsets, 'items': items, 'levels': levels}
+    meta = {'columns': COLUMNS, 'cells': CELLS, 'years': YEARS, 'k': 200, 'built': '2020-01-01T00:00:00'}
+    return peer_sketches.PeerSketches(arrays, meta), (features, years, cells, values.astype(np.float32))
+
+
+def test_cell_mask():
+    sketches = sketches_of(10)[0]
+
+    assert sketches.cell_mask(['IL'], ['Short Term'], ['Proprietary-Corporation']).tolist() == \
+        [True, False, False, False]
+    # Hospital types match as substrings, like the hospital filters
+    assert sketches.cell_mask(['IL', 'CA'], ['Short', 'Psych'], ['Proprietary-Corporation']).tolist() == \
+        [True, False, False, True]
+    assert sketches.cell_mask(['CA'], ['Term', 'Access'],
+                              ['Proprietary-Corporation', 'Voluntary Nonprofit-Church']).tolist() == \
+        [False, False, True, False]
+    assert not sketches.cell_mask(None, ['Short Term'], ['Proprietary-Corporation']).any()
+    assert not sketches.cell_mask(['IL'], None, ['Proprietary-Corporation']).any()
+    assert not sketches.cell_mask(['IL'], ['Short Term'], []).any()
+
+
+@pytest.mark.parametrize('n_reports, exact', [(600, True), (60000, False)])
+def test_merged_quantiles_and_ranks(n_reports, exact):
+    sketches, (features, years, cells, values) = sketches_of(n_reports)
+    mask = sketches.cell_mask(['IL', 'CA'], ['Short Term'], ['Proprietary-Corporation', 'Voluntary Nonprofit-Church'])
+    chosen = np.isin(cells, np.flatnonzero(mask)) & (features == 1)
+
+    merged = sketches.merged(mask, COLUMNS[1])
+    assert sorted(merged) == YEARS
+    table = sketches.percentile_table(mask, COLUMNS[1], PERCENTILES, merged)
+    assert table.index.tolist() == YEARS
+
+    for y, year in enumerate(YEARS):
+        peers = values[chosen & (years == y)]
+        assert merged[year].count() == len(peers)
+
+        estimate = table.loc[year].to_numpy()
+        value = np.sort(peers)[len(peers) // 3]
+        rank, count = sketches.percentile_rank(mask, COLUMNS[1], year, value, merged)
+        assert count == len(peers)
+
+        if exact:
+            np.testing.assert_allclose(estimate, np.percentile(peers, PERCENTILES), rtol=1e-6)
+            assert rank == pytest.approx(100 * (len(peers) // 3) / (len(peers) - 1))
+        else:
+            assert np.abs(true_ranks(peers, estimate) - PERCENTILES).max() < RANK_ERROR
+            assert rank == pytest.approx(100 * (len(peers) // 3) / len(peers), abs=RANK_ERROR)
+
+
+def test_merged_without_peers():
+    sketches = sketches_of(600)[0]
+    mask = sketches.cell_mask(['IL'], ['Short Term'], ['Proprietary-Corporation'])
+
+    assert sketches.merged(np.zeros(len(CELLS), dtype=bool), COLUMNS[0]) == {}
+    assert sketches.merged(mask, ['NOPE_1', 'Nope', 'CATEGORY', 'Nope (NOPE_1)']) == {}
+    assert sketches.percentile_table(mask, ['NOPE_1', 'Nope', 'CATEGORY', 'Nope (NOPE_1)'], PERCENTILES) is None
+    assert sketches.percentile_rank(mask, COLUMNS[0], 2018, 1.0) is None
+    assert sketches.percentile_rank(mask, COLUMNS[0], 2019, np.nan) is None
+
+
+def test_save_and_load(tmp_path):
+    sketches = sketches_of(3000)[0]
+    sketches.save(str(tmp_path / 'sketches'))
+    loaded = peer_sketches.PeerSketches.load(str(tmp_path / 'sketches'))
+
+    mask = loaded.cell_mask(['IL', 'CA'], ['Short Term'], ['Proprietary-Corporation'])
+    assert isinstance(loaded.items, np.memmap)
+    np.testing.assert_array_equal(loaded.percentile_table(mask, COLUMNS[0], PERCENTILES),
+                                  sketches.percentile_table(mask, COLUMNS[0], PERCENTILES))
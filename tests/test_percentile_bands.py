@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+import percentile_bands
+
+
+def reports(seed=0):
+    """
+    :return: Years and values of random reports over 2015-2020, with some
+             values missing or infinite.
+    """
+    rng = np.random.default_rng(seed)
+    years = rng.integers(2015, 2021, size=600)
+    values = rng.lognormal(5, 1, size=600)
+    values[rng.random(600) < 0.1] = np.nan
+    values[:3] = [np.inf, -np.inf, np.nan]
+    return years, values
+
+
+def test_bands_match_numpy():
+    years, values = reports()
+    table = percentile_bands.percentile_table(years, values)
+
+    assert table.index.tolist() == list(range(2015, 2021))
+    assert table.columns.tolist() == percentile_bands.PERCENTILES
+    for year in table.index:
+        year_values = values[(years == year) & np.isfinite(values)]
+        np.testing.assert_allclose(table.loc[year].to_numpy(),
+                                   np.percentile(year_values, percentile_bands.PERCENTILES))
+
+
+def test_years_without_finite_values():
+    years = [2018, 2018, 2019, 2019, 2020, 2020]
+    values = [1.0, 3.0, np.nan, np.inf, 5.0, np.nan]
+    table = percentile_bands.percentile_table(years, values)
+
+    # A year with only missing values has no row
+    assert table.index.tolist() == [2018, 2020]
+    assert table.loc[2018, 50] == 2.0
+    assert table.loc[2020].tolist() == [5.0] * 5
+
+    empty = percentile_bands.percentile_table([2019, 2020], [np.nan, np.nan])
+    assert empty.shape == (0, 5)
+    assert empty.columns.tolist() == percentile_bands.PERCENTILES
+    assert percentile_bands.outliers(['a', 'b'], [2019, 2020], [np.nan, np.nan], empty, 3) == []
+
+
+def outlier_scores(names, years, values, table):
+    """
+    :return: The largest distance of each hospital outside the 10th to 90th
+             percentile band of a year, in interquartile ranges, by a loop.
+    """
+    scores = {}
+    for name, year, value in zip(names, years, values):
+        if not np.isfinite(value):
+            continue
+        low, q1, median, q3, high = table.loc[year]
+        iqr = q3 - q1 if q3 > q1 else 1
+        scores[name] = max(scores.get(name, 0), max(value - high, low - value, 0) / iqr)
+    return scores
+
+
+def test_outliers():
+    rng = np.random.default_rng(1)
+    names = ['H' + str(i % 150).zfill(3) for i in range(900)]
+    years = [2015 + i // 150 for i in range(900)]
+    values = rng.normal(100, 10, size=900)
+    values[rng.random(900) < 0.05] = np.nan
+    values[[5, 160, 700]] = [500, -200, 180]
+    table = percentile_bands.percentile_table(years, values)
+
+    scores = outlier_scores(names, years, values, table)
+    expected = sorted((n for n in scores if scores[n] > 0), key=lambda n: (-scores[n], n))
+    found = percentile_bands.outliers(names, years, values, table, 10)
+    assert found == expected[:10]
+    assert found[:3] == ['H005', 'H010', 'H100']
+    assert percentile_bands.outliers(names, years, values, table, 1) == ['H005']
+    assert percentile_bands.outliers(names, years, values, table, 0) == []
+    assert percentile_bands.outliers(names, years, values, table, 1000) == expected
+
+
+def test_outliers_with_zero_iqr():
+    # Every hospital but one reports the same value, so the IQR is zero and
+    # the distance outside the band is measured in the units of the values
+    names = ['a', 'b', 'c', 'd', 'e', 'f']
+    years = [2020] * 6
+    values = [5.0, 5.0, 5.0, 5.0, 5.0, 50.0]
+    table = percentile_bands.percentile_table(years, values)
+    assert table.loc[2020, 75] == table.loc[2020, 25]
+
+    with np.errstate(all='raise'):
+        found = percentile_bands.outliers(names, years, values, table, 3)
+    assert found == ['f']
+
+    # With every value equal nobody is outside the band
+    assert percentile_bands.outliers(names, years, [5.0] * 6, percentile_bands.percentile_table(years, [5.0] * 6),
+                                     3) == []
+
+
+def test_band_traces():
+    years, values = reports()
+    table = percentile_bands.percentile_table(years, values)
+    traces = percentile_bands.band_traces(table, color='#ff8000', name='peers')
+
+    assert len(traces) == 5
+    assert [t.name for t in traces] == [None, '10th to 90th percentile of peers', None,
+                                        '25th to 75th percentile of peers', 'Median of peers']
+    assert traces[1].fillcolor == 'rgba(255, 128, 0, 0.15)'
+    assert traces[3].fillcolor == 'rgba(255, 128, 0, 0.35)'
+    np.testing.assert_array_equal(traces[4].y, table[50].values)
+    np.testing.assert_array_equal(traces[0].x, table.index.values)
+
+
+@pytest.mark.parametrize('years', [['2019', '2020', '2019'], [2019.0, 2020.0, 2019.0]])
+def test_year_types(years):
+    table = percentile_bands.percentile_table(years, [1.0, 2.0, 3.0])
+    assert len(table) == 2
+    assert table.iloc[0][50] == 2.0
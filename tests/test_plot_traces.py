@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+import plot_traces
+
+
+def test_series_of_text_values():
+    s = plot_traces.Series('A', '#cccccc', pd.Series([2019.0, 2020.0, 2021.0]),
+                           pd.Series(['1.5', 'N/A', np.nan], dtype=object), ['a', 'b', 'c'])
+
+    np.testing.assert_array_equal(s.x, [2019.0, 2020.0, 2021.0])
+    np.testing.assert_array_equal(s.y, [1.5, np.nan, np.nan])
+    assert s.y.dtype == float
+
+
+def test_pack_with_gaps():
+    a = plot_traces.Series('A', 'red', [1, 2], [3, 4], ['a1', 'a2'])
+    b = plot_traces.Series('B', 'blue', [1], ['text'], ['b1'])
+    x, y, text, colors = plot_traces.pack([a, b], gaps=True)
+
+    np.testing.assert_array_equal(x, [1, 2, np.nan, 1])
+    np.testing.assert_array_equal(y, [3, 4, np.nan, np.nan])
+    assert text == ['a1', 'a2', '', 'b1']
+    assert colors == ['red', 'red', 'blue', 'blue']
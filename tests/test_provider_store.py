@@ -0,0 +1,149 @@
+import urllib.error
+
+import pytest
+
+import provider_store
+from conftest import provider_frame
+
+
+@pytest.fixture
+def pauses(monkeypatch):
+    """
+    :return: The list of the backoff pauses of read_with_retries, which are recorded instead of slept.
+    """
+    slept = []
+    monkeypatch.setattr(provider_store.time, 'sleep', slept.append)
+    return slept
+
+
+def csv_body(prvdr):
+    return provider_frame(prvdr).to_csv().encode('utf-8')
+
+
+def test_http_store_reads_csv(stand_in):
+    routes, url = stand_in
+    routes.add('140000.csv', csv_body('140000'))
+
+    frame = provider_store.HTTPProviderStore(url, timeout=5).read('140000')
+    assert frame.shape == (2, 4)
+    assert frame.columns.tolist() == provider_frame('140000').columns.tolist()
+
+
+def test_timeout(stand_in, pauses):
+    routes, url = stand_in
+    routes.add('140001.csv', csv_body('140001'), delay=1)
+
+    store = provider_store.HTTPProviderStore(url, timeout=0.2)
+    with pytest.raises(Exception) as error:
+        provider_store.read_with_retries(store, '140001', retries=1)
+    assert not provider_store.is_missing(error.value)
+    assert routes.requests['140001.csv'] == 2
+
+
+def test_retry_with_backoff(stand_in, pauses):
+    routes, url = stand_in
+    routes.add('140002.csv', csv_body('140002'), failures=2)
+
+    store = provider_store.HTTPProviderStore(url, timeout=5)
+    frame = provider_store.read_with_retries(store, '140002', retries=2, backoff=0.5)
+    assert frame.shape[0] == 2
+    assert routes.requests['140002.csv'] == 3
+    assert pauses == [0.5, 1.0]
+
+
+def test_retries_exhausted(stand_in, pauses):
+    routes, url = stand_in
+    routes.add('140003.csv', csv_body('140003'), failures=5)
+
+    store = provider_store.HTTPProviderStore(url, timeout=5)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        provider_store.read_with_retries(store, '140003', retries=2, backoff=0.1)
+    assert error.value.code == 500
+    assert routes.requests['140003.csv'] == 3
+    assert pauses == [0.1, 0.2]
+
+
+def test_missing_is_not_retried(stand_in, pauses):
+    routes, url = stand_in
+
+    store = provider_store.HTTPProviderStore(url, timeout=5)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        provider_store.read_with_retries(store, '999999', retries=3)
+    assert provider_store.is_missing(error.value)
+    assert routes.requests['999999.csv'] == 1
+    assert pauses == []
+
+
+def test_fetch_partial_results(stand_in, pauses):
+    routes, url = stand_in
+    for prvdr in ['140000', '140004', '140005']:
+        routes.add(prvdr + '.csv', csv_body(prvdr))
+    routes.add('140006.csv', csv_body('140006'), failures=1)
+    routes.add('140007.csv', csv_body('140007'), delay=1)
+
+    calls = []
+    store = provider_store.HTTPProviderStore(url, timeout=0.2)
+    frames, failed = provider_store.fetch_providers(store, ['999999', '140007', '140000', '140004', '140005',
+                                                            '140006', '888888'],
+                                                    max_workers=4, retries=1, progress=calls.append)
+
+    assert sorted(frames) == ['140000', '140004', '140005', '140006']
+    assert failed == ['140007', '888888', '999999']
+    assert sorted(calls) == list(range(1, 8))
+
+
+def test_fetch_nothing():
+    assert provider_store.fetch_providers(provider_store.LocalProviderStore('.'), []) == ({}, [])
+
+
+def test_local_store_roundtrip(tmp_path):
+    csv_dir = tmp_path / 'csv'
+    csv_dir.mkdir()
+    provider_frame('140000').to_csv(csv_dir / '140000.csv')
+
+    assert provider_store.build_local_store(str(csv_dir), str(tmp_path / 'store')) == 1
+    frame = provider_store.LocalProviderStore(str(tmp_path / 'store')).read('140000')
+    assert frame.columns.tolist() == provider_frame('140000').columns.tolist()
+
+    with pytest.raises(FileNotFoundError) as error:
+        provider_store.LocalProviderStore(str(tmp_path / 'store')).read('999999')
+    assert provider_store.is_missing(error.value)
+
+
+def test_default_store(monkeypatch, tmp_path):
+    monkeypatch.delenv('HCRIS_PROVIDER_STORE', raising=False)
+    monkeypatch.delenv('HCRIS_PROVIDER_SUFFIX', raising=False)
+    monkeypatch.delenv('HCRIS_FETCH_WORKERS', raising=False)
+    monkeypatch.chdir(tmp_path)
+
+    store = provider_store.default_store()
+    assert isinstance(store, provider_store.HTTPProviderStore)
+    assert store.source('140000') == provider_store.GITHUB_URL + '140000.csv'
+    assert provider_store.default_workers() == 16
+
+    (tmp_path / 'provider_data').mkdir()
+    assert provider_store.default_store().source('140000') == 'provider_data/140000.parquet'
+
+    monkeypatch.setenv('HCRIS_PROVIDER_STORE', 'http://localhost:8000/data')
+    monkeypatch.setenv('HCRIS_PROVIDER_SUFFIX', '.parquet')
+    monkeypatch.setenv('HCRIS_FETCH_WORKERS', '4')
+    store = provider_store.default_store(timeout=5)
+    assert store.source('140000') == 'http://localhost:8000/data/140000.parquet'
+    assert store.timeout == 5
+    assert provider_store.default_workers() == 4
+
+
+def test_read_header(stand_in, tmp_path):
+    routes, url = stand_in
+    routes.add('140000.csv', csv_body('140000'))
+    frame = provider_frame('140000')
+
+    header = provider_store.HTTPProviderStore(url, timeout=5).read_header('140000')
+    assert header.shape[0] == 0
+    assert header.columns.tolist() == frame.columns.tolist()
+
+    provider_store.write_frame(frame, str(tmp_path / '140000.parquet'))
+    header = provider_store.LocalProviderStore(str(tmp_path)).read_header('140000')
+    assert header.shape[0] == 0
+    assert header.columns.tolist() == frame.columns.tolist()
+    assert header.dtypes.tolist() == frame.dtypes.tolist()
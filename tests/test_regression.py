@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import regression
+
+sm = pytest.importorskip('statsmodels.api')
+
+
+def points(n, seed=0):
+    """
+    :return: Skewed x and y values whose powers statsmodels' pinv still
+             treats as full rank, so that both fits have the same coefficients.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.sort(rng.lognormal(4, 1, n))
+    y = 50 + 1.5 * x - 2e-3 * x**2 + rng.normal(0, 0.2, n) * x
+    return x, y
+
+
+def statsmodels_fit(x, y, degree, alpha):
+    results = sm.OLS(y, regression.design_matrix(x, degree)).fit()
+    frame = results.get_prediction().summary_frame(alpha=alpha)
+    return results, frame
+
+
+def assert_close(actual, expected, rtol=1e-6):
+    # Relative to the scale of the expected values, as tiny coefficients of
+    # high powers are relative to the others
+    np.testing.assert_allclose(actual, expected, rtol=rtol, atol=rtol * np.max(np.abs(expected)))
+
+
+@pytest.mark.parametrize('degree', [1, 2, 3])
+@pytest.mark.parametrize('n', [5, 200, 5000])
+@pytest.mark.parametrize('alpha', [0.05, 0.1])
+def test_fit_matches_statsmodels(degree, n, alpha):
+    x, y = points(n)
+    fit = regression.fit_polynomial(x, y, degree, alpha)
+    results, frame = statsmodels_fit(x, y, degree, alpha)
+
+    np.testing.assert_allclose(fit.params, results.params, rtol=1e-6)
+    assert_close(fit.fittedvalues, results.fittedvalues)
+    np.testing.assert_allclose(fit.rsquared, results.rsquared, rtol=1e-8)
+    np.testing.assert_allclose(fit.rsquared_adj, results.rsquared_adj, rtol=1e-8)
+    assert fit.df_model == results.df_model
+    assert fit.df_resid == results.df_resid
+
+    assert_close(fit.mean_ci_low, frame['mean_ci_lower'])
+    assert_close(fit.mean_ci_upp, frame['mean_ci_upper'])
+    assert_close(fit.obs_ci_low, frame['obs_ci_lower'])
+    assert_close(fit.obs_ci_upp, frame['obs_ci_upper'])
+
+
+@pytest.mark.filterwarnings('ignore::UserWarning')
+def test_rank_deficient_fit_matches_statsmodels():
+    # A quadratic fit to two distinct values of x
+    x = np.array([1.0, 1.0, 2.0, 2.0, 2.0, 1.0])
+    y = np.array([3.0, 3.5, 5.0, 5.5, 4.5, 2.5])
+    fit = regression.fit_polynomial(x, y, 2)
+    results, frame = statsmodels_fit(x, y, 2, 0.05)
+
+    assert fit.df_model == results.df_model == 1
+    assert_close(fit.params, results.params)
+    assert_close(fit.fittedvalues, results.fittedvalues)
+    np.testing.assert_allclose(fit.rsquared, results.rsquared, rtol=1e-8)
+    assert_close(fit.mean_ci_low, frame['mean_ci_lower'])
+    assert_close(fit.obs_ci_upp, frame['obs_ci_upper'])
+
+
+def test_fit_without_residual_degrees_of_freedom():
+    fit = regression.fit_polynomial([1.0, 2.0, 3.0], [2.0, 1.0, 5.0], 2)
+
+    np.testing.assert_allclose(fit.fittedvalues, [2.0, 1.0, 5.0])
+    assert fit.df_resid == 0
+    assert np.isnan(fit.rsquared_adj)
+    assert np.all(np.isnan(fit.mean_ci_low))
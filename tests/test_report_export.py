@@ -0,0 +1,151 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import provider_store
+import report_export
+import report_merge
+import schema_manifest
+import session_cache
+from conftest import BEDS_COL, FFY_COL, provider_frame
+
+
+EXTRA_COL = ('X_EXTRA', 'Extra feature', 'EXTRA', 'Extra feature (X_EXTRA)')
+
+
+class Store(provider_store.LocalProviderStore):
+    """
+    A local store recording the providers read in full and by header only.
+    """
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.reads = []
+        self.headers = []
+
+    def read(self, prvdr):
+        self.reads.append(prvdr)
+        return super().read(prvdr)
+
+    def read_header(self, prvdr):
+        self.headers.append(prvdr)
+        return super().read_header(prvdr)
+
+
+def assembler_of(tmp_path, frames):
+    """
+    :return: A ReportAssembler reading frames, a dict keyed by provider number,
+             from a local store.
+    """
+    directory = tmp_path / 'store'
+    directory.mkdir()
+    for prvdr, frame in frames.items():
+        provider_store.write_frame(frame, str(directory / (prvdr + '.parquet')))
+    return report_merge.ReportAssembler(Store(str(directory)), session_cache.SessionCache(str(tmp_path / 'cache')))
+
+
+def with_extra(frame, values):
+    frame = frame.copy()
+    frame[EXTRA_COL] = values
+    return frame
+
+
+def read_csv(content):
+    return pd.read_csv(io.StringIO(''.join(content)), header=[0, 1, 2, 3], index_col=0)
+
+
+def test_csv_header_is_written_before_reports_are_read(tmp_path):
+    prvdrs = ['14000' + str(i) for i in range(6)]
+    assembler = assembler_of(tmp_path, {p: provider_frame(p) for p in prvdrs})
+
+    content = report_export.write_csv(assembler, prvdrs, batch_size=2)
+    header = next(content)
+
+    assert assembler.store.reads == []
+    assert sorted(assembler.store.headers) == prvdrs
+    assert header.startswith(',Curated Name and Num,')
+
+    frame = read_csv([header] + list(content))
+    assert sorted(assembler.store.reads) == prvdrs
+    assert frame.shape == (12, len(schema_manifest.load_manifest()['columns']) + 1)
+    assert frame.columns[-1] == report_merge.URL_COL
+
+
+def test_headers_of_loaded_providers_are_not_read(tmp_path):
+    frames = {'140000': with_extra(provider_frame('140000'), ['a', None]),
+              '140001': provider_frame('140001'),
+              '140002': provider_frame('140002')}
+    assembler = assembler_of(tmp_path, frames)
+    assembler.assemble(['140000', '140001'])
+
+    columns, text = report_export.export_columns(assembler, sorted(frames))
+    assert assembler.store.headers == ['140002']
+    assert columns[-2] == EXTRA_COL
+    assert text[-2]
+
+    report_export.export_columns(assembler, sorted(frames))
+    assert assembler.store.headers == ['140002']
+
+
+def test_column_of_a_later_batch_is_exported(tmp_path):
+    frames = {'140000': provider_frame('140000'),
+              '140001': provider_frame('140001'),
+              '140002': with_extra(provider_frame('140002'), [1.0, 2.0])}
+    assembler = assembler_of(tmp_path, frames)
+
+    columns, text = report_export.export_columns(assembler, sorted(frames))
+    assert columns[-2] == EXTRA_COL
+    assert not text[-2]
+
+    frame = read_csv(report_export.write_csv(assembler, sorted(frames), batch_size=1))
+    assert frame[EXTRA_COL].iloc[:4].isna().all()
+    assert frame[EXTRA_COL].iloc[4:].tolist() == [1.0, 2.0]
+
+    path = str(tmp_path / 'reports.parquet')
+    report_export.write_parquet(assembler, sorted(frames), path, batch_size=1)
+    assert pd.read_parquet(path)[EXTRA_COL].iloc[4:].tolist() == [1.0, 2.0]
+
+
+def test_unreadable_providers_are_skipped(tmp_path):
+    assembler = assembler_of(tmp_path, {'140000': provider_frame('140000')})
+
+    frame = read_csv(report_export.write_csv(assembler, ['140000', '999999']))
+    assert frame.shape[0] == 2
+
+
+def test_records_map_non_finite_values_to_none():
+    values = np.array([[1.5, np.nan], [np.inf, -np.inf]])
+    strings = np.array([['a'], [None]], dtype=object)
+    rows = report_export.records(values, strings, np.array([False, True, False]))
+
+    assert rows.tolist() == [[1.5, 'a', None], [None, None, None]]
+
+
+def test_xlsx_export_with_infinite_values(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    pytest.importorskip('xlsxwriter')
+
+    frame = provider_frame('140000')
+    frame[BEDS_COL] = [np.inf, -np.inf]
+    path = str(tmp_path / 'reports.xlsx')
+    report_export.write_xlsx(assembler_of(tmp_path, {'140000': frame}), ['140000'], path)
+
+    sheet = openpyxl.load_workbook(path, read_only=True).worksheets[0]
+    rows = list(sheet.iter_rows(values_only=True))
+    columns = [tuple(c[:4]) for c in schema_manifest.load_manifest()['columns']]
+    assert len(rows) == 6
+    assert rows[4][columns.index(BEDS_COL)] is None
+    assert rows[4][columns.index(FFY_COL)] == 2019
+
+
+def test_parquet_export_roundtrip(tmp_path):
+    frames = {p: provider_frame(p) for p in ['140000', '140001', '140002']}
+    path = str(tmp_path / 'reports.parquet')
+    report_export.write_parquet(assembler_of(tmp_path, frames), sorted(frames), path, batch_size=2)
+
+    frame = pd.read_parquet(path)
+    assert frame.shape[0] == 6
+    assert frame[BEDS_COL].iloc[0] == 100.0
+    assert np.isnan(frame[BEDS_COL].iloc[1])
@@ -0,0 +1,153 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import report_index
+import schema_manifest
+
+
+COLUMNS = pd.MultiIndex.from_tuples([
+    ('A_1', 'Beds', 'NUMBER OF BEDS', 'Total (A_1)'),
+    ('A_2', 'ICU beds', 'NUMBER OF BEDS', 'ICU (A_2)'),
+    ('B_1', 'Revenue', 'REVENUES', 'Gross (B_1)'),
+    ('B_2', 'Net revenue', 'REVENUES', 'Net (B_2)'),
+    ('B_3', 'Expense', 'REVENUES', 'Expense (B_3)'),
+    ('C_1', 'Days', 'DAYS', 'Days (C_1)'),
+    ('C_2', 'Discharges', 'DAYS', 'Discharges (C_2)'),
+    ('C_3', 'Visits', 'DAYS', 'Visits (C_3)'),
+    ('C_4', 'Stays', 'DAYS', 'Stays (C_4)'),
+    ])
+
+
+def frame_of(columns, values):
+    """
+    :return: A frame of one report with the given values, NaN where None.
+    """
+    return pd.DataFrame([[np.nan if v is None else v for v in values]], columns=columns)
+
+
+def scan(columns, category, feature):
+    # The lookup the callbacks did before the index: the first matching column
+    for i, c in enumerate(columns):
+        if c[2] == category and c[3] == feature:
+            return i
+    return None
+
+
+def test_positions_match_a_scan():
+    # The pair (NUMBER OF BEDS, Total (A_1)) repeats, under another code
+    columns = COLUMNS.append(pd.MultiIndex.from_tuples([('A_9', 'Beds again', 'NUMBER OF BEDS', 'Total (A_1)'),
+                                                        ('B_1', 'Revenue again', 'OTHER', 'Other (B_1)')]))
+    index = report_index.ColumnIndex(columns)
+
+    for category in ['NUMBER OF BEDS', 'REVENUES', 'DAYS', 'OTHER', 'MISSING']:
+        for feature in set(columns.get_level_values(3)) | {'Missing (X_1)'}:
+            assert index.position(category, feature) == scan(columns, category, feature)
+
+    # The first column wins when a pair or a code repeats
+    assert index.position('NUMBER OF BEDS', 'Total (A_1)') == 0
+    assert index.column('NUMBER OF BEDS', 'Total (A_1)') == COLUMNS[0]
+    assert index.column('MISSING', 'Total (A_1)') is None
+    assert index.codes['B_1'] == 2
+    assert index.codes['A_9'] == 9
+    assert index.codes == {c: list(columns.get_level_values(0)).index(c) for c in columns.get_level_values(0)}
+
+
+def test_available_features():
+    index = report_index.ColumnIndex(COLUMNS)
+    assert index.available(['Net (B_2)', 'Missing (X_1)', 'Total (A_1)']) == ['Net (B_2)', 'Total (A_1)']
+
+
+def test_feature_bits_roundtrip():
+    features = report_index.FeatureBits(COLUMNS)
+    frame = frame_of(COLUMNS, [1, None, 2, None, None, None, None, None, 3])
+
+    bits = features.of_frame(frame)
+    # Nine features take two bytes, the last holding padding
+    assert bits.dtype == np.uint8
+    assert len(bits) == 2
+    everything = np.packbits(np.ones(len(COLUMNS), dtype=bool))
+    assert features.select(bits, everything) == ['Total (A_1)', 'Gross (B_1)', 'Stays (C_4)']
+    np.testing.assert_array_equal(np.unpackbits(bits)[:len(COLUMNS)],
+                                  frame.notna().any().to_numpy())
+
+
+def test_feature_bits_of_a_frame_in_another_order():
+    features = report_index.FeatureBits(COLUMNS)
+    columns = COLUMNS[[8, 2, 0, 4]]
+    frame = frame_of(columns, [None, 1, 2, 3])
+
+    everything = np.packbits(np.ones(len(COLUMNS), dtype=bool))
+    assert features.select(features.of_frame(frame), everything) == ['Total (A_1)', 'Gross (B_1)', 'Expense (B_3)']
+
+
+def test_unknown_features_warn():
+    features = report_index.FeatureBits(COLUMNS[:4])
+    frame = frame_of(COLUMNS[[0, 6]], [1, 2])
+
+    with pytest.warns(UserWarning, match='Discharges'):
+        bits = features.of_frame(frame)
+    assert features.select(bits, np.packbits(np.ones(4, dtype=bool))) == ['Total (A_1)']
+
+    # Features without data do not warn
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        features.of_frame(frame_of(COLUMNS[[0, 6]], [1, None]))
+
+
+def test_union_and_category_mask():
+    features = report_index.FeatureBits(COLUMNS)
+    first = features.of_frame(frame_of(COLUMNS, [1, None, 2, None, None, None, None, None, None]))
+    second = features.of_frame(frame_of(COLUMNS, [None, None, None, 3, None, None, None, 4, None]))
+
+    bits = features.union([first, second])
+    assert features.select(bits, features.category_mask('REVENUES')) == ['Gross (B_1)', 'Net (B_2)']
+    assert features.select(bits, features.category_mask('DAYS')) == ['Visits (C_3)']
+    assert features.select(bits, features.category_mask('MISSING')) == []
+    assert features.select(features.union([]), features.category_mask('REVENUES')) == []
+
+
+def test_category_features():
+    frame = frame_of(COLUMNS, [1, None, None, 2, 3, None, 4, None, None])
+    features = report_index.FeatureBits(COLUMNS)
+    index = report_index.ColumnIndex(COLUMNS, features.of_frame(frame), features)
+
+    assert index.category_features('REVENUES') == ['Net (B_2)', 'Expense (B_3)']
+    assert index.category_features('NUMBER OF BEDS') == ['Total (A_1)']
+    assert index.category_features('DAYS') == ['Discharges (C_2)']
+
+
+def test_category_features_without_bits():
+    columns = schema_manifest.load_columns()
+    category = columns[10][2]
+    index = report_index.ColumnIndex(columns[[10, 11]])
+
+    assert index.category_features(category) == \
+        [f for f in schema_manifest.category_features(category) if f in {columns[10][3], columns[11][3]}]
+
+
+def test_manifest_bits():
+    columns = schema_manifest.load_columns()
+    features = report_index.FeatureBits()
+    frame = frame_of(columns[[5, 6, 7]], [1, None, 2])
+
+    bits = features.of_frame(frame)
+    assert len(bits) == -(-len(columns) // 8)
+    selected = features.select(bits, np.packbits(np.ones(len(columns), dtype=bool)))
+    assert selected == [columns[5][3], columns[7][3]]
+
+
+def test_index_cache():
+    cache = report_index.IndexCache(maxsize=2)
+    indexes = [report_index.ColumnIndex(COLUMNS) for i in range(3)]
+
+    cache.set('a', indexes[0])
+    cache.set('b', indexes[1])
+    assert cache.get('a') is indexes[0]
+    cache.set('c', indexes[2])
+
+    assert cache.get('b') is None
+    assert cache.get('a') is indexes[0]
+    assert cache.get('c') is indexes[2]
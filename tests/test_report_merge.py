@@ -0,0 +1,159 @@
+import os
+
+import numpy as np
+
+import provider_store
+import report_index
+import report_merge
+import schema_manifest
+import session_cache
+from conftest import BEDS_COL, PRVDR_COL, provider_frame
+
+
+class Store(provider_store.LocalProviderStore):
+    """
+    A local store recording the providers it reads.
+    """
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.reads = []
+
+    def read(self, prvdr):
+        self.reads.append(prvdr)
+        return super().read(prvdr)
+
+
+def write_provider(tmp_path, prvdr, frame=None):
+    directory = tmp_path / 'store'
+    directory.mkdir(exist_ok=True)
+    frame = provider_frame(prvdr) if frame is None else frame
+    provider_store.write_frame(frame, str(directory / (prvdr + '.parquet')))
+
+
+def assembler_of(tmp_path, prvdrs, **kwargs):
+    """
+    :return: A ReportAssembler with feature bits over the reports of prvdrs
+             in a local store.
+    """
+    for prvdr in prvdrs:
+        write_provider(tmp_path, prvdr)
+    return report_merge.ReportAssembler(Store(str(tmp_path / 'store')),
+                                        session_cache.SessionCache(str(tmp_path / 'cache')),
+                                        features=report_index.FeatureBits(schema_manifest.load_columns()),
+                                        **kwargs)
+
+
+def test_only_added_providers_are_read(tmp_path):
+    assembler = assembler_of(tmp_path, ['140000', '140001', '140002', '140003'])
+
+    df, key, prvdrs, failed = assembler.assemble(['140001', '140000'])
+    assert sorted(assembler.store.reads) == ['140000', '140001']
+    assert prvdrs == ['140000', '140001']
+    assert df[PRVDR_COL].tolist() == [140000, 140000, 140001, 140001]
+    assert df[report_merge.URL_COL].iloc[0] == assembler.store.source('140000')
+
+    assembler.store.reads = []
+    df, key2, prvdrs, failed = assembler.assemble(['140000', '140001', '140002', '140003'])
+    assert sorted(assembler.store.reads) == ['140002', '140003']
+    assert df.shape[0] == 8
+    assert key2 != key
+
+    # Removing a provider reads nothing, and the selection's key is that of
+    # the first load
+    assembler.store.reads = []
+    df, key3, prvdrs, failed = assembler.assemble(['140000', '140001'])
+    assert assembler.store.reads == []
+    assert key3 == key
+    assert df[PRVDR_COL].tolist() == [140000, 140000, 140001, 140001]
+
+
+def test_cached_frames_are_reused(tmp_path):
+    assembler = assembler_of(tmp_path, ['140000', '140001'])
+    frames = assembler.provider_frames(['140000', '140001'])[0]
+
+    again, versions, failed = assembler.provider_frames(['140000', '140001'])
+    assert sorted(assembler.store.reads) == ['140000', '140001']
+    assert again['140000'] is frames['140000']
+    assert failed == []
+
+    # A new assembler over the same cache reads the frames from its disk tier
+    other = report_merge.ReportAssembler(Store(assembler.store.directory),
+                                         session_cache.SessionCache(assembler.frame_cache.spill_dir))
+    frames = other.provider_frames(['140000', '140001'])[0]
+    assert other.store.reads == []
+    assert frames['140001'][PRVDR_COL].tolist() == [140001, 140001]
+
+
+def test_unreadable_providers_fail(tmp_path):
+    assembler = assembler_of(tmp_path, ['140000'])
+
+    df, key, prvdrs, failed = assembler.assemble(['140000', '999999'])
+    assert prvdrs == ['140000']
+    assert failed == ['999999']
+    assert assembler.assemble(['999999']) == (None, None, [], ['999999'])
+
+
+def test_store_changes_change_the_version(tmp_path):
+    assembler = assembler_of(tmp_path, ['140000', '140001'])
+    df, key, prvdrs, failed = assembler.assemble(['140000', '140001'])
+    version = assembler.version('140000')
+    assert version == assembler.version('140000')
+
+    frame = provider_frame('140000', years=(2019, 2020, 2021))
+    write_provider(tmp_path, '140000', frame)
+    path = assembler.store.source('140000')
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10**9))
+    assert assembler.version('140000') != version
+
+    assembler.store.reads = []
+    df, key2, prvdrs, failed = assembler.assemble(['140000', '140001'])
+    assert assembler.store.reads == ['140000']
+    assert key2 != key
+    assert df.shape[0] == 5
+
+
+def test_http_store_version_is_the_data_version():
+    store = provider_store.HTTPProviderStore('http://example.invalid/data')
+    first = report_merge.ReportAssembler(store, None, data_version='2021-01')
+    second = report_merge.ReportAssembler(store, None, data_version='2021-02')
+
+    assert first.version('140000') == '2021-01'
+    assert first.frame_key('140000', first.version('140000')) != \
+        second.frame_key('140000', second.version('140000'))
+    assert first.session_key({'140000': '2021-01'}) != second.session_key({'140000': '2021-02'})
+    assert first.session_key({'140000': 'a', '140001': 'b'}) == first.session_key({'140001': 'b', '140000': 'a'})
+
+
+def test_bits_are_read_by_another_process(tmp_path):
+    prvdrs = ['140000', '140001']
+    assembler = assembler_of(tmp_path, prvdrs)
+    df = assembler.assemble(prvdrs)[0]
+
+    # A new assembler over the same cache stands in for the app's worker
+    other = assembler_of(tmp_path, [])
+    bits = other.feature_bits(prvdrs)
+    assert bits is not None
+    assert np.array_equal(bits, other.features.of_frame(df))
+    assert other.feature_bits(prvdrs + ['140002']) is None
+
+
+def test_bits_in_memory_are_bounded(tmp_path):
+    prvdrs = ['14000' + str(i) for i in range(5)]
+    assembler = assembler_of(tmp_path, prvdrs, max_bits=2)
+    assembler.assemble(prvdrs)
+
+    assert len(assembler.bits) == 2
+    assert assembler.feature_bits(prvdrs) is not None
+    assert len(assembler.bits) == 2
+
+
+def test_extra_columns(tmp_path):
+    extra_col = ('X_EXTRA', 'Extra feature', 'EXTRA', 'Extra feature (X_EXTRA)')
+    frame = provider_frame('140001')
+    frame[extra_col] = [1.0, 2.0]
+    assembler = assembler_of(tmp_path, ['140000'])
+    write_provider(tmp_path, '140001', frame)
+
+    assert assembler.extra_columns(['140000', '140001', '999999']) == {'140000': [], '140001': [(extra_col, False)]}
+    assert BEDS_COL not in dict(assembler.extra_columns(['140001'])['140001'])
@@ -0,0 +1,114 @@
+import json
+
+import plotly.graph_objects as go
+import pytest
+
+import result_cache
+from conftest import wait
+
+
+def figure(title, n=10):
+    return {'data': [{'type': 'scatter', 'x': list(range(n)), 'y': list(range(n))}],
+            'layout': {'title': {'text': title}}}
+
+
+def size(fig):
+    return len(result_cache.pio.to_json(fig, validate=False))
+
+
+def test_fingerprint():
+    a = result_cache.fingerprint('key', {'x': 'G3_C1_1', 'y': 'G3_C1_3', 'scale': ['log10', 'linear']}, 2020)
+    b = result_cache.fingerprint('key', {'scale': ['log10', 'linear'], 'y': 'G3_C1_3', 'x': 'G3_C1_1'}, 2020)
+    assert a == b
+    assert len(a) == 40
+
+    # Order of lists, and every part, counts
+    assert a != result_cache.fingerprint('key', {'x': 'G3_C1_1', 'y': 'G3_C1_3', 'scale': ['linear', 'log10']}, 2020)
+    assert a != result_cache.fingerprint('key', {'x': 'G3_C1_1', 'y': 'G3_C1_3', 'scale': ['log10', 'linear']}, 2021)
+    assert result_cache.fingerprint(None, 1) != result_cache.fingerprint('None', '1')
+    assert result_cache.fingerprint(['a', 'b']) == result_cache.fingerprint(('a', 'b'))
+
+
+def test_lru_eviction_by_bytes():
+    figures = {key: figure(key) for key in 'abcd'}
+    cache = result_cache.ResultCache(max_bytes=3 * size(figures['a']))
+
+    for key in 'abc':
+        cache.set(key, figures[key])
+    assert cache.get('a') == figures['a']
+    cache.set('d', figures['d'])
+
+    # b was the least recently used
+    assert cache.get('b') is None
+    assert cache.get('a') == figures['a']
+    assert cache.get('c') == figures['c']
+    assert cache.get('d') == figures['d']
+    assert cache.stats()['entries'] == 3
+    assert cache.stats()['bytes'] == 3 * size(figures['a'])
+
+    # Replacing a figure does not count it twice
+    cache.set('d', figures['d'])
+    assert cache.stats()['bytes'] == 3 * size(figures['a'])
+
+    # Figures larger than the cache are not kept
+    cache.set('e', figure('e', n=1000))
+    assert cache.get('e') is None
+    assert cache.stats()['entries'] == 3
+
+
+def test_counters():
+    cache = result_cache.ResultCache()
+    assert cache.get('a') is None
+    cache.set('a', figure('a'))
+    cache.get('a')
+    cache.get('a')
+    cache.get('b')
+
+    assert cache.stats() == {'hits': 2, 'disk_hits': 0, 'misses': 2, 'entries': 1, 'bytes': size(figure('a'))}
+
+
+def test_plotly_figures_are_stored_as_dicts():
+    cache = result_cache.ResultCache()
+    fig = go.Figure(go.Scatter(x=[1, 2], y=[3, 4]), layout={'title': {'text': 'A figure'}})
+    cache.set('a', fig)
+
+    stored = cache.get('a')
+    assert isinstance(stored, dict)
+    assert stored == json.loads(fig.to_json())
+    assert go.Figure(stored).layout.title.text == 'A figure'
+
+
+def test_disk_tier(tmp_path):
+    diskcache = pytest.importorskip('diskcache')
+    disk = diskcache.Cache(str(tmp_path / 'results'))
+    cache = result_cache.ResultCache(disk=disk)
+    cache.set('a', figure('a'))
+
+    # Another worker, or a long callback process, finds the figure on disk
+    other = result_cache.ResultCache(disk=diskcache.Cache(str(tmp_path / 'results')))
+    assert other.get('a') == figure('a')
+    assert other.get('a') == figure('a')
+    assert other.get('b') is None
+    assert other.stats() == {'hits': 1, 'disk_hits': 1, 'misses': 1, 'entries': 1, 'bytes': size(figure('a'))}
+
+    # Figures evicted from memory are read back from disk
+    small = result_cache.ResultCache(max_bytes=size(figure('a')), disk=disk)
+    small.set('b', figure('b'))
+    small.set('c', figure('c'))
+    assert small.get('b') == figure('b')
+    assert small.stats()['disk_hits'] == 1
+
+    cache.clear()
+    assert cache.stats()['entries'] == 0
+    assert cache.get('a') is None
+    assert len(disk) == 0
+
+
+def test_disk_tier_expires(tmp_path):
+    diskcache = pytest.importorskip('diskcache')
+    cache = result_cache.ResultCache(disk=diskcache.Cache(str(tmp_path / 'results')), ttl=0.2)
+    cache.set('a', figure('a'))
+
+    other = result_cache.ResultCache(disk=diskcache.Cache(str(tmp_path / 'results')))
+    wait(0.4)
+    assert other.get('a') is None
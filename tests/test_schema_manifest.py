@@ -0,0 +1,105 @@
+import io
+import json
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+import provider_store
+import report_index
+import schema_manifest
+from conftest import NOTE_COL, provider_frame
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# HCRIS_SCHEMA_TEST_FILE (a path or URL), else the provider header checked in
+# by schema_manifest.py, else a provider file of the HCRIS-databuilder
+HEADER_FILE = os.path.join(ROOT, schema_manifest.HEADER_PATH)
+if 'HCRIS_SCHEMA_TEST_FILE' in os.environ:
+    PROVIDER_FILE = os.environ['HCRIS_SCHEMA_TEST_FILE']
+elif os.path.exists(HEADER_FILE):
+    PROVIDER_FILE = HEADER_FILE
+else:
+    PROVIDER_FILE = provider_store.GITHUB_URL + '052043.csv'
+
+
+def read_provider_file(source):
+    if source.startswith('http://') or source.startswith('https://'):
+        try:
+            with urllib.request.urlopen(source, timeout=30) as response:
+                source = response.read()
+        except (urllib.error.URLError, OSError) as e:
+            pytest.skip('provider file not reachable: ' + str(e))
+        source = io.BytesIO(source)
+    elif not os.path.exists(source):
+        pytest.skip('provider file not found: ' + source)
+    return provider_store.read_frame(source, '.csv')
+
+
+def test_manifest_matches_provider_file():
+    frame = read_provider_file(PROVIDER_FILE)
+    manifest = schema_manifest.load_manifest()
+
+    extra, missing = schema_manifest.compare_columns(frame.columns)
+    assert extra == [] and missing == []
+    assert [tuple(c) for c in frame.columns] == [tuple(c[:4]) for c in manifest['columns']]
+    assert manifest['source'] != os.path.basename(schema_manifest.CROSSWALK_PATH)
+
+
+def test_manifest_columns_are_distinct():
+    columns = schema_manifest.load_manifest()['columns']
+    assert len(set(tuple(c[:4]) for c in columns)) == len(columns)
+    assert set(c[4] for c in columns) <= {'str', 'float'}
+
+
+def test_build_from_provider_file(tmp_path):
+    path = tmp_path / '140000.csv'
+    frame = provider_frame('140000')
+    frame.to_csv(path)
+
+    columns = schema_manifest.build_from_provider_file(str(path))
+    assert [tuple(c[:4]) for c in columns] == frame.columns.tolist()
+    types = {c[0]: c[4] for c in columns}
+    assert types['S3_1_C2_27'] == 'float'
+    assert types[NOTE_COL[0]] == 'str'
+
+    manifest = str(tmp_path / 'schema.json')
+    assert schema_manifest.write_manifest(columns, str(path), manifest) == 1
+    assert schema_manifest.write_manifest(columns, str(path), manifest) == 1
+    assert schema_manifest.write_manifest(columns[:-1], str(path), manifest) == 2
+    with open(manifest) as f:
+        assert json.load(f)['columns'] == columns[:-1]
+
+
+def test_header_fixture_roundtrip(tmp_path):
+    frame = provider_frame('140000')
+    header = str(tmp_path / 'data' / 'provider_header.csv')
+    frame.to_csv(tmp_path / '140000.csv')
+
+    columns = schema_manifest.build_from_provider_file(str(tmp_path / '140000.csv'), header_path=header)
+    assert schema_manifest.build_from_provider_file(header) == columns
+    assert provider_store.read_frame(header, '.csv').shape == (1, frame.shape[1])
+
+
+def test_compare_columns(tmp_path):
+    frame = provider_frame('140000')
+    path = str(tmp_path / '140000.csv')
+    frame.to_csv(path)
+    manifest = str(tmp_path / 'schema.json')
+    schema_manifest.write_manifest(schema_manifest.build_from_provider_file(path), path, manifest)
+
+    columns = frame.columns.tolist()[:-1] + [('NEW_1', 'New', 'NEW', 'New (NEW_1)')]
+    extra, missing = schema_manifest.compare_columns(columns, manifest)
+    assert extra == [('NEW_1', 'New', 'NEW', 'New (NEW_1)')]
+    assert missing == [NOTE_COL]
+
+
+def test_unknown_features_warn():
+    frame = provider_frame('140000')
+    bits = report_index.FeatureBits(frame.columns[:-1])
+    with pytest.warns(UserWarning, match='not in the schema manifest'):
+        selected = bits.select(bits.of_frame(frame), bits.union([bits.of_frame(frame)]))
+    assert NOTE_COL[3] not in selected
+
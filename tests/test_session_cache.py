@@ -0,0 +1,35 @@
+import os
+import time
+
+import session_cache
+from conftest import provider_frame
+
+
+KEY = 'ab' * 20
+
+
+def test_set_and_get(tmp_path):
+    cache = session_cache.SessionCache(str(tmp_path))
+    frame = provider_frame('140000')
+    cache.set(KEY, frame)
+    assert cache.get(KEY).equals(frame)
+
+    # Another worker reads the disk tier
+    other = session_cache.SessionCache(str(tmp_path))
+    assert other.get(KEY).columns.tolist() == frame.columns.tolist()
+    assert other.get('cd' * 20) is None
+
+
+def test_eviction_keeps_temporary_files_being_written(tmp_path):
+    cache = session_cache.SessionCache(str(tmp_path), max_spill_bytes=1)
+
+    writing = tmp_path / ('ef' * 20 + '.arrow.123.tmp')
+    writing.write_bytes(b'x' * 1000)
+    stale = tmp_path / ('01' * 20 + '.arrow.456.tmp')
+    stale.write_bytes(b'x' * 1000)
+    old = time.time() - session_cache.TMP_GRACE - 60
+    os.utime(stale, (old, old))
+
+    cache.set(KEY, provider_frame('140000'))
+    assert writing.exists()
+    assert not stale.exists()
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+import transforms
+
+
+VALUES = np.array([-4.0, -1.0, 0.0, 0.5, 1.0, 10.0, 100.0, np.nan, np.inf, -np.inf])
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('linear', [True] * 7 + [False] * 3),
+    ('z-score', [True] * 7 + [False] * 3),
+    ('rank', [True] * 7 + [False] * 3),
+    ('log10', [False, False, False, True, True, True, True, False, False, False]),
+    ('ln', [False, False, False, True, True, True, True, False, False, False]),
+    ('square root', [False, False, True, True, True, True, True, False, False, False]),
+    ])
+def test_domain(name, expected):
+    assert transforms.domain(VALUES, name).tolist() == expected
+
+
+def test_unknown_transform():
+    with pytest.raises(ValueError, match="Unknown transform 'log2'"):
+        transforms.domain(VALUES, 'log2')
+
+
+@pytest.mark.parametrize('xscale, yscale, f, g', [
+    ('log10', 'linear', np.log10, lambda v: v),
+    ('ln', 'square root', np.log, np.sqrt),
+    ('square root', 'log10', np.sqrt, np.log10),
+    ])
+def test_transform_xy_masks_both_axes(xscale, yscale, f, g):
+    x = np.array([0.0, 1.0, -2.0, 4.0, 9.0, np.nan, 16.0, 25.0])
+    y = np.array([1.0, 0.0, 3.0, -1.0, 10.0, 2.0, np.inf, 100.0])
+
+    with np.errstate(all='raise'):
+        tx, ty, keep = transforms.transform_xy(x, y, xscale, yscale)
+
+    expected = transforms.domain(x, xscale) & transforms.domain(y, yscale)
+    np.testing.assert_array_equal(keep, expected)
+    np.testing.assert_allclose(tx, f(x[expected]))
+    np.testing.assert_allclose(ty, g(y[expected]))
+    assert np.isfinite(tx).all() and np.isfinite(ty).all()
+
+
+def test_zero_is_only_in_the_square_root_domain():
+    x = np.array([0.0, 0.0, 4.0])
+    y = np.array([1.0, 2.0, 3.0])
+
+    assert transforms.transform_xy(x, y, 'log10', 'linear')[2].tolist() == [False, False, True]
+    assert transforms.transform_xy(x, y, 'ln', 'linear')[2].tolist() == [False, False, True]
+    tx, ty, keep = transforms.transform_xy(x, y, 'square root', 'linear')
+    assert keep.all()
+    assert tx.tolist() == [0.0, 0.0, 2.0]
+
+
+def test_zscore_and_rank_use_the_pooled_values():
+    x = np.array([3.0, np.nan, 1.0, -5.0, 2.0, 2.0, 8.0])
+    y = np.array([1.0, 1.0, 10.0, 100.0, 0.0, 1000.0, 10.0])
+
+    tx, ty, keep = transforms.transform_xy(x, y, 'z-score', 'log10')
+    # Points dropped from either axis are not pooled
+    assert keep.tolist() == [True, False, True, True, False, True, True]
+    pooled = x[keep]
+    np.testing.assert_allclose(tx, (pooled - pooled.mean()) / pooled.std())
+    np.testing.assert_allclose(ty, np.log10(y[keep]))
+
+    tx, ty, keep = transforms.transform_xy(x, y, 'rank', 'rank')
+    assert keep.tolist() == [True, False, True, True, True, True, True]
+    np.testing.assert_array_equal(tx, stats.rankdata(x[keep]))
+    np.testing.assert_array_equal(ty, stats.rankdata(y[keep]))
+    # Ties share their average rank
+    assert tx.tolist() == [5.0, 2.0, 1.0, 3.5, 3.5, 6.0]
+
+
+def test_zscore_of_constant_and_empty_values():
+    assert transforms.zscore(np.array([2.0, 2.0, 2.0])).tolist() == [0.0, 0.0, 0.0]
+    assert len(transforms.zscore(np.array([]))) == 0
+
+    tx, ty, keep = transforms.transform_xy([np.nan, -1.0], [1.0, 1.0], 'log10', 'z-score')
+    assert len(tx) == len(ty) == 0
+    assert not keep.any()
+
+
+def test_object_values():
+    tx, ty, keep = transforms.transform_xy([1, '10', None], [100.0, 1000.0, 1.0], 'log10', 'log10')
+    assert keep.tolist() == [True, True, False]
+    np.testing.assert_allclose(tx, [0.0, 1.0])
+    np.testing.assert_allclose(ty, [2.0, 3.0])
@@ -0,0 +1,67 @@
+"""
+Axis transforms for the scatter plot of features (plot 2).
+
+Each transform maps a whole array of values at once. Values outside the domain
+of either axis' transform, or missing on either axis, drop out through one
+mask over the pooled reports. The z-score and rank transforms depend on every
+value they are applied to, so all transforms are applied to the pooled values
+that pass the mask, and the traces of each hospital and the regression are
+cut from the same transformed arrays.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def zscore(values):
+    sd = np.std(values)
+    if len(values) == 0 or sd == 0:
+        return np.zeros(len(values))
+    return (values - np.mean(values)) / sd
+
+
+def rank(values):
+    # Ties share their average rank
+    return pd.Series(values).rank(method='average').to_numpy()
+
+
+# Name: (mask of the values in the domain, transform)
+TRANSFORMS = {
+    'linear': (None, lambda v: v),
+    'log10': (lambda v: v > 0, np.log10),
+    'ln': (lambda v: v > 0, np.log),
+    'square root': (lambda v: v >= 0, np.sqrt),
+    'z-score': (None, zscore),
+    'rank': (None, rank),
+    }
+
+OPTIONS = ['linear', 'log10', 'ln', 'square root', 'z-score', 'rank']
+
+
+def domain(values, name):
+    """
+    :return: A mask of the finite values of an array that transform name accepts.
+    """
+    if name not in TRANSFORMS:
+        raise ValueError('Unknown transform ' + repr(name) + ', expected one of ' + ', '.join(OPTIONS))
+
+    in_domain, f = TRANSFORMS[name]
+    mask = np.isfinite(values)
+    if in_domain is not None:
+        with np.errstate(invalid='ignore'):
+            mask &= in_domain(values)
+    return mask
+
+
+def transform_xy(x, y, xscale, yscale):
+    """
+    :return: The transformed x and y values of the points where both are in
+             the domain of their transforms, and the mask of those points.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    keep = domain(x, xscale) & domain(y, yscale)
+    tx = TRANSFORMS[xscale][1](x[keep])
+    ty = TRANSFORMS[yscale][1](y[keep])
+    return tx, ty, keep